@@ -15,6 +15,11 @@ from models import Base # Импорт Base из вашего файла models.
 # Объект конфигурации Alembic, предоставляет доступ к значениям из файла alembic.ini.
 config = context.config
 
+# Переменная окружения DATABASE_URL (как в db.py) заменяет sqlalchemy.url из alembic.ini.
+# Символ % экранируется для подстановки значений configparser.
+if os.environ.get("DATABASE_URL"):
+    config.set_main_option("sqlalchemy.url", os.environ["DATABASE_URL"].replace("%", "%%"))
+
 # Интерпретация файла конфигурации для настройки логирования Python.
 if config.config_file_name is not None:
     fileConfig(config.config_file_name)
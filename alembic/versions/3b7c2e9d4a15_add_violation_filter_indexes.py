@@ -0,0 +1,33 @@
+"""add violation filter indexes
+
+Revision ID: 3b7c2e9d4a15
+Revises: 890fa0590f04
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7c2e9d4a15'
+down_revision: Union[str, None] = '890fa0590f04'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_violations_vehicle_id'), 'violations', ['vehicle_id'], unique=False)
+    op.create_index(op.f('ix_violations_timestamp'), 'violations', ['timestamp'], unique=False)
+    op.create_index(op.f('ix_violations_processed_video_path'), 'violations', ['processed_video_path'], unique=False)
+    op.create_index(op.f('ix_violations_original_video_path'), 'violations', ['original_video_path'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_violations_original_video_path'), table_name='violations')
+    op.drop_index(op.f('ix_violations_processed_video_path'), table_name='violations')
+    op.drop_index(op.f('ix_violations_timestamp'), table_name='violations')
+    op.drop_index(op.f('ix_violations_vehicle_id'), table_name='violations')
@@ -0,0 +1,28 @@
+"""add violation evidence clip path
+
+Revision ID: 7c41d2a9e8b3
+Revises: 3b7c2e9d4a15
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c41d2a9e8b3'
+down_revision: Union[str, None] = '3b7c2e9d4a15'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('violations', sa.Column('evidence_clip_path', sa.String(length=256), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('violations', 'evidence_clip_path')
@@ -0,0 +1,30 @@
+"""add violation vehicle class and created_at
+
+Revision ID: e5a9c1f7b2d4
+Revises: 7c41d2a9e8b3
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a9c1f7b2d4'
+down_revision: Union[str, None] = '7c41d2a9e8b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('violations', sa.Column('vehicle_class', sa.String(length=32), nullable=True))
+    op.add_column('violations', sa.Column('created_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('violations', 'created_at')
+    op.drop_column('violations', 'vehicle_class')
@@ -0,0 +1,168 @@
+"""
+Сравнение бэкендов инференса (inference_backend.py): пропускная способность и точность
+относительно исходной модели PyTorch на одинаковых кадрах.
+
+Каждый вариант загружается через load_model (экспорт в кэш EXPORT_CACHE_DIR при первом запуске)
+и обрабатывает первые --frames кадров каждого видео через model.track с persist=True, как
+track_frame в yolo8_video. Для варианта выводятся кадры в секунду, задержка кадра (p50, p95)
+и совпадение детекций с эталоном (первый вариант, по умолчанию torch): рамки одного класса
+сопоставляются жадно по IoU >= --iou; полнота - доля эталонных рамок, нашедших пару,
+точность - доля рамок варианта, нашедших пару, средний IoU - по найденным парам.
+Вариант int8 дополнительно сравнивается с fp32-вариантом того же бэкенда (если он есть в
+--variants): так видна потеря точности от квантования отдельно от расхождения бэкендов.
+
+Запуск (из корня репозитория):
+    python benchmarks/backend_compare.py
+    python benchmarks/backend_compare.py videos/4.mp4 --variants torch onnx onnx:int8 --threads 2
+    python benchmarks/backend_compare.py --variants torch openvino openvino:int8 --frames 300 --json results/backends.json
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import Any, Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+os.chdir(ROOT) # Путь к весам модели и видео задан относительно корня
+
+from inference_backend import EXPORT_CACHE_DIR, INFERENCE_IMGSZ, MODEL_WEIGHTS, load_model  # noqa: E402
+from utils import box_iou  # noqa: E402
+
+DEFAULT_SOURCES = ['videos/4.mp4', 'videos/5.mp4']
+DEFAULT_VARIANTS = ['torch', 'onnx', 'onnx:int8', 'openvino', 'openvino:int8']
+Frame = Tuple[np.ndarray, np.ndarray] # Рамки (N, 4) и классы (N,) одного кадра
+
+
+def read_frames(path: str, limit: int) -> List[np.ndarray]:
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while not limit or len(frames) < limit:
+        ok, frame = cap.read()
+        if not ok:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+
+def reset_trackers(model: Any) -> None:
+    """Сбрасывает треки BoT-SORT перед новым видео (как reset_session_state в yolo8_video)."""
+    for tracker in getattr(getattr(model, "predictor", None), "trackers", None) or []:
+        tracker.reset()
+
+
+def run_variant(model: Any, frames: List[np.ndarray], warmup: int) -> Tuple[List[float], List[Frame]]:
+    """Задержки кадров (сек.) и детекции по кадрам; кадры прогрева повторяются после сброса трекера."""
+    for frame in frames[:warmup]:
+        model.track(frame, tracker="botsort.yaml", persist=True, imgsz=INFERENCE_IMGSZ, show=False, verbose=False)
+    reset_trackers(model)
+    latencies, detections = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        boxes = model.track(frame, tracker="botsort.yaml", persist=True, imgsz=INFERENCE_IMGSZ, show=False, verbose=False)[0].boxes
+        latencies.append(time.perf_counter() - start)
+        detections.append((boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy().astype(int)))
+    reset_trackers(model)
+    return latencies, detections
+
+
+def match(reference: List[Frame], candidate: List[Frame], threshold: float) -> Dict[str, float]:
+    """Жадное сопоставление рамок одного класса по IoU; полнота, точность и средний IoU пар."""
+    matched, ious, total_ref, total_cand = 0, [], 0, 0
+    for (ref_boxes, ref_cls), (boxes, cls) in zip(reference, candidate):
+        total_ref += len(ref_cls)
+        total_cand += len(cls)
+        if not len(ref_cls) or not len(cls):
+            continue
+        iou = box_iou(ref_boxes, boxes)
+        iou[ref_cls[:, None] != cls[None, :]] = 0.0
+        while True:
+            i, j = np.unravel_index(np.argmax(iou), iou.shape)
+            if iou[i, j] < threshold:
+                break
+            matched += 1
+            ious.append(float(iou[i, j]))
+            iou[i, :] = 0.0
+            iou[:, j] = 0.0
+    return {
+        "recall": round(matched / total_ref, 4) if total_ref else 1.0,
+        "precision": round(matched / total_cand, 4) if total_cand else 1.0,
+        "mean_iou": round(float(np.mean(ious)), 4) if ious else 0.0,
+        "reference_boxes": total_ref,
+        "boxes": total_cand,
+    }
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    values = np.array(latencies)
+    return {
+        "frames": len(values),
+        "fps": round(len(values) / values.sum(), 2) if len(values) else 0.0,
+        "p50_ms": round(float(np.percentile(values, 50)) * 1000, 2) if len(values) else 0.0,
+        "p95_ms": round(float(np.percentile(values, 95)) * 1000, 2) if len(values) else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*', default=DEFAULT_SOURCES, help='Видеофайлы')
+    parser.add_argument('--variants', nargs='+', default=DEFAULT_VARIANTS,
+                        help='Варианты бэкенд[:int8]; первый - эталон точности')
+    parser.add_argument('--frames', type=int, default=200, help='Кадров каждого видео (0 - все)')
+    parser.add_argument('--warmup', type=int, default=5, help='Кадров прогрева перед замером')
+    parser.add_argument('--threads', type=int, default=0, help='INFERENCE_THREADS для всех вариантов (0 - по умолчанию)')
+    parser.add_argument('--iou', type=float, default=0.5, help='Порог IoU сопоставления рамок')
+    parser.add_argument('--weights', default=MODEL_WEIGHTS, help='Исходные веса модели')
+    parser.add_argument('--cache-dir', default=EXPORT_CACHE_DIR, help='Кэш экспортированных моделей')
+    parser.add_argument('--json', default=None, help='Файл для сохранения результата')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    videos = {}
+    for path in args.sources:
+        if not os.path.exists(path):
+            print(f"{path}: файл не найден, пропущен")
+            continue
+        videos[path] = read_frames(path, args.frames)
+    report: Dict[str, Any] = {"threads": args.threads, "imgsz": INFERENCE_IMGSZ, "variants": {}}
+    reference: Dict[str, List[Frame]] = {}
+    outputs: Dict[str, Dict[str, List[Frame]]] = {} # Детекции вариантов по видео для сравнения int8 с fp32
+    for variant in args.variants:
+        backend, _, option = variant.partition(':')
+        model = load_model(args.weights, backend, option == 'int8', args.threads, INFERENCE_IMGSZ, args.cache_dir)
+        report["variants"][variant] = {}
+        for path, frames in videos.items():
+            latencies, detections = run_variant(model, frames, args.warmup)
+            result = summarize(latencies)
+            if path in reference:
+                result.update(match(reference[path], detections, args.iou))
+            else:
+                reference[path] = detections # Первый вариант - эталон
+            outputs.setdefault(variant, {})[path] = detections
+            fp32 = outputs.get(backend, {}).get(path) if option == 'int8' else None
+            if fp32 is not None:
+                result["vs_fp32"] = match(fp32, detections, args.iou)
+            report["variants"][variant][path] = result
+            accuracy = (f", полнота {result['recall']:.3f}, точность {result['precision']:.3f}, IoU {result['mean_iou']:.3f}"
+                        if 'recall' in result else " (эталон)")
+            if fp32 is not None:
+                accuracy += f"; к {backend} fp32: полнота {result['vs_fp32']['recall']:.3f}, точность {result['vs_fp32']['precision']:.3f}"
+            print(f"{variant:<15} {path}: {result['fps']:7.2f} кадр/с, p50 {result['p50_ms']:.1f} мс, "
+                  f"p95 {result['p95_ms']:.1f} мс{accuracy}")
+        del model
+
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранен: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
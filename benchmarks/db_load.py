@@ -0,0 +1,224 @@
+"""
+Нагрузочная проверка: частота кадров /ws/video_feed при интенсивных запросах к /violations.
+
+Сервер запускается отдельным процессом (uvicorn main:app) с базой SQLite во временном
+каталоге (DATABASE_URL), таблица заполняется --rows нарушениями. Один клиент WebSocket
+принимает кадры источника; после прогрева замеряется фаза без нагрузки, затем фаза, в которой
+--clients клиентов непрерывно запрашивают страницы /violations (limit=--limit, случайный курсор).
+Для каждой фазы выводятся кадры в секунду и интервалы между кадрами (p95, максимум), для фазы
+нагрузки - запросы в секунду и их задержка. Если запросы к БД блокируют цикл событий сервера,
+частота кадров под нагрузкой падает, а интервалы между кадрами растут.
+Если видео заканчивается раньше фазы, клиент переподключается (источник начинается заново).
+
+Запуск (из корня репозитория):
+    python benchmarks/db_load.py
+    python benchmarks/db_load.py videos/4.mp4 --clients 32 --duration 30 --json results/db_load.json
+    python benchmarks/db_load.py --server http://localhost:8000 --file-path uploaded_videos/<файл>
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+
+
+def seed_database(url: str, rows: int) -> None:
+    """Создает таблицы и добавляет rows нарушений."""
+    from sqlalchemy import create_engine, insert
+    from models import Base, Violation
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for start in range(0, rows, 5000):
+            connection.execute(insert(Violation), [{
+                'vehicle_id': str(i % 500),
+                'timestamp': None,
+                'video_second': i // 30,
+                'processed_video_path': 'output/processed_load.mp4',
+                'original_video_path': 'videos/load.mp4',
+                'evidence_clip_path': f'output/evidence_load_f{i}_id{i}.mp4'
+            } for i in range(start, min(rows, start + 5000))])
+    engine.dispose()
+
+
+def start_server(port: int, database_url: str) -> subprocess.Popen:
+    env = {**os.environ, "DATABASE_URL": database_url}
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+
+
+async def wait_ready(client: Any, base: str, timeout: float) -> None:
+    """Ждет, пока сервер начнет отвечать (пул воркеров загружает модель)."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get(f"{base}/video_feed/stats")).status_code == 200:
+                return
+        except Exception:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Сервер {base} не ответил за {timeout} с")
+        await asyncio.sleep(0.5)
+
+
+class FrameClock:
+    """Время прихода кадров клиенту WebSocket; переподключается, когда источник заканчивается."""
+
+    def __init__(self, uri: str, file_path: str, protocol: str):
+        self.uri = uri
+        self.file_path = file_path
+        self.protocol = protocol
+        self.arrivals: List[float] = []
+        self.reconnects = 0
+
+    async def run(self, stop: asyncio.Event) -> None:
+        import websockets
+        while not stop.is_set():
+            frames, last = 0, None
+            async with websockets.connect(self.uri, max_size=None) as ws:
+                await ws.send(json.dumps({"file_path": self.file_path, "protocol": self.protocol}))
+                async for message in ws:
+                    if stop.is_set():
+                        break
+                    # legacy и delta: кадр - бинарное сообщение; metadata: JSON frame_data на кадр
+                    if self.protocol == "metadata":
+                        is_frame = isinstance(message, str) and '"frame_data"' in message
+                    else:
+                        is_frame = isinstance(message, bytes)
+                    if is_frame:
+                        self.arrivals.append(time.perf_counter())
+                        frames += 1
+                    last = message
+            if not frames and not stop.is_set():
+                raise RuntimeError(f"Источник {self.file_path} не отдал ни одного кадра: {last!r}")
+            self.reconnects += 1
+
+    def window(self, start: float, end: float) -> Dict[str, Any]:
+        """Кадры в секунду и интервалы между кадрами за [start, end)."""
+        times = np.array([t for t in self.arrivals if start <= t < end])
+        gaps = np.diff(times) if len(times) > 1 else np.array([0.0])
+        return {
+            "frames": int(len(times)),
+            "fps": round(len(times) / (end - start), 2),
+            "gap_p50_ms": round(float(np.percentile(gaps, 50)) * 1000, 1),
+            "gap_p95_ms": round(float(np.percentile(gaps, 95)) * 1000, 1),
+            "gap_max_ms": round(float(gaps.max()) * 1000, 1),
+        }
+
+
+async def query_loop(client: Any, base: str, limit: int, max_id: int, stop: asyncio.Event, latencies: List[float]) -> None:
+    """Непрерывно запрашивает страницы /violations со случайным курсором."""
+    while not stop.is_set():
+        params = {"limit": limit, "before_id": random.randint(limit, max_id + 1)}
+        start = time.perf_counter()
+        response = await client.get(f"{base}/violations", params=params)
+        response.raise_for_status()
+        latencies.append(time.perf_counter() - start)
+
+
+async def run(args: argparse.Namespace, base: str) -> Dict[str, Any]:
+    import httpx
+    limits = httpx.Limits(max_connections=args.clients + 4)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        await wait_ready(client, base, args.startup_timeout)
+        clock = FrameClock(base.replace("http", "ws", 1) + "/ws/video_feed", args.file_path, args.protocol)
+        stop_frames = asyncio.Event()
+        frames_task = asyncio.create_task(clock.run(stop_frames))
+
+        await asyncio.sleep(args.warmup) # Запуск конвейера и прогрев модели
+        baseline_start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        baseline_end = time.perf_counter()
+
+        stop_queries = asyncio.Event()
+        latencies: List[float] = []
+        queries = [asyncio.create_task(query_loop(client, base, args.limit, args.rows, stop_queries, latencies))
+                   for _ in range(args.clients)]
+        load_start = time.perf_counter()
+        await asyncio.sleep(args.duration)
+        load_end = time.perf_counter()
+        stop_queries.set()
+        await asyncio.gather(*queries)
+        stop_frames.set()
+        frames_task.cancel()
+        error = (await asyncio.gather(frames_task, return_exceptions=True))[0]
+        if isinstance(error, Exception): # Источник не отдает кадров (CancelledError - не Exception)
+            raise error
+
+    baseline = clock.window(baseline_start, baseline_end)
+    load = clock.window(load_start, load_end)
+    values = np.array(latencies) if latencies else np.array([0.0])
+    load.update({
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / (load_end - load_start), 2),
+        "request_p50_ms": round(float(np.percentile(values, 50)) * 1000, 1),
+        "request_p95_ms": round(float(np.percentile(values, 95)) * 1000, 1),
+    })
+    return {
+        "baseline": baseline, "load": load, "reconnects": clock.reconnects,
+        "fps_ratio": round(load["fps"] / baseline["fps"], 3) if baseline["fps"] else None
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('source', nargs='?', default='videos/4.mp4', help='Видеофайл источника')
+    parser.add_argument('--server', default=None, help='Адрес запущенного сервера (без запуска своего и заполнения БД)')
+    parser.add_argument('--file-path', default=None, help='file_path для /ws/video_feed (по умолчанию - путь source)')
+    parser.add_argument('--protocol', default='delta', choices=['legacy', 'delta', 'metadata'], help='Протокол кадров')
+    parser.add_argument('--port', type=int, default=8765, help='Порт запускаемого сервера')
+    parser.add_argument('--rows', type=int, default=20000, help='Нарушений в таблице')
+    parser.add_argument('--clients', type=int, default=16, help='Одновременных клиентов /violations')
+    parser.add_argument('--limit', type=int, default=1000, help='Размер страницы /violations')
+    parser.add_argument('--warmup', type=float, default=5.0, help='Прогрев перед замером (сек.)')
+    parser.add_argument('--duration', type=float, default=20.0, help='Длительность каждой фазы (сек.)')
+    parser.add_argument('--startup-timeout', type=float, default=180.0, help='Ожидание запуска сервера (сек.)')
+    parser.add_argument('--json', default=None, help='Файл для сохранения результата')
+    args = parser.parse_args()
+    args.file_path = args.file_path or os.path.abspath(args.source)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        server: Optional[subprocess.Popen] = None
+        base = args.server
+        if base is None:
+            database_url = f"sqlite:///{os.path.join(tmp, 'violations.db')}"
+            seed_database(database_url, args.rows)
+            server = start_server(args.port, database_url)
+            base = f"http://127.0.0.1:{args.port}"
+        try:
+            report = asyncio.run(run(args, base))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait(30)
+
+    report.update({"clients": args.clients, "limit": args.limit, "rows": args.rows, "protocol": args.protocol})
+    for phase in ("baseline", "load"):
+        result = report[phase]
+        print(f"{phase:<9} {result['fps']:7.2f} кадр/с, интервал p50 {result['gap_p50_ms']:.1f} мс, "
+              f"p95 {result['gap_p95_ms']:.1f} мс, макс. {result['gap_max_ms']:.1f} мс")
+    load = report["load"]
+    print(f"/violations: {load['requests_per_second']:.1f} запр./с, p50 {load['request_p50_ms']:.1f} мс, "
+          f"p95 {load['request_p95_ms']:.1f} мс ({args.clients} клиентов, limit={args.limit})")
+    print(f"Частота кадров под нагрузкой: {report['fps_ratio']} от исходной")
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранен: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Сравнение пропускной способности с декодированием в потоке обработки и с упреждающим
+декодированием (FrameSource, отдельный поток с ограниченным буфером).
+
+Инференс имитируется нагрузкой, освобождающей GIL, как и прямой проход torch:
+по умолчанию --infer-ms миллисекунд ожидания, с --cpu - размытие кадра средствами OpenCV.
+Для каждого режима выводятся кадры в секунду и время чистого декодирования.
+
+Запуск (из корня репозитория):
+    python benchmarks/decode_prefetch.py videos/4.mp4 --infer-ms 15
+    python benchmarks/decode_prefetch.py videos/4.mp4 --cpu --prefetch 0 4 16
+"""
+import os
+import sys
+import time
+import argparse
+
+import cv2
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from frame_source import FrameSource  # noqa: E402
+
+
+def fake_inference(frame, args: argparse.Namespace) -> None:
+    if args.cpu:
+        cv2.GaussianBlur(frame, (0, 0), 9)
+    else:
+        time.sleep(args.infer_ms / 1000)
+
+
+def run(args: argparse.Namespace, prefetch: int) -> None:
+    source = FrameSource(args.video, prefetch=prefetch)
+    frames = 0
+    start = time.perf_counter()
+    try:
+        for frame in source:
+            fake_inference(frame, args)
+            frames += 1
+            if args.frames and frames >= args.frames:
+                break
+    finally:
+        source.close()
+    elapsed = time.perf_counter() - start
+    mode = f"упреждение {prefetch} кадров" if prefetch else "декодирование в потоке обработки"
+    print(f"{mode:>34}: {frames} кадров за {elapsed:6.2f} с, {frames / elapsed:7.1f} кадр/с")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('video', help='Видеофайл')
+    parser.add_argument('--prefetch', type=int, nargs='+', default=[0, 8], help='Размеры буфера упреждения (0 - без него)')
+    parser.add_argument('--infer-ms', type=float, default=15.0, help='Имитация времени инференса на кадр (мс)')
+    parser.add_argument('--cpu', action='store_true', help='Имитировать инференс вычислениями OpenCV вместо ожидания')
+    parser.add_argument('--frames', type=int, default=0, help='Ограничение числа кадров (0 - все)')
+    args = parser.parse_args()
+
+    decode = FrameSource(args.video, prefetch=0)
+    start = time.perf_counter()
+    count = sum(1 for _ in decode)
+    decode.close()
+    decode_time = time.perf_counter() - start
+    print(f"Источник {args.video}: {count} кадров, {decode.width}x{decode.height}, {decode.fps:.1f} FPS; "
+          f"декодирование без инференса {decode_time / max(count, 1) * 1000:.2f} мс/кадр")
+    for prefetch in args.prefetch:
+        run(args, prefetch)
+
+
+if __name__ == "__main__":
+    main()
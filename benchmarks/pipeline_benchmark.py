@@ -0,0 +1,323 @@
+"""
+Воспроизводимый бенчмарк конвейера детекции на CPU: пропускная способность и задержки по этапам.
+
+Каждый источник обрабатывается process_video (без записи видео, фрагментов и нарушений в БД),
+а этапы кадра замеряются через параметр timings:
+    decode      - ожидание декодированного кадра (FrameSource);
+    inference   - детекция и трекинг;
+    postprocess - разбор рамок и масок классов;
+    crosswalk   - поиск перехода (на первых кадрах) и пересечения ТС с ним;
+    draw        - отрисовка рамок и счетчиков;
+    output      - метаданные кадра и постановка в очереди записи;
+    encode      - JPEG и сообщение протокола delta, как при отправке в /ws/video_feed.
+Отдельно замеряются detect_crosswalk на кадре со светофором (crosswalk_detect) и пакетная
+вставка нарушений через ViolationWriter (db, по умолчанию во временную SQLite).
+
+По умолчанию используется детектор-заглушка с детерминированными рамками (stub_detector.py):
+результат не зависит от весов модели, и версии кода сравниваются на одинаковых детекциях.
+--detector yolo измеряет реальную модель (нужны ultralytics и yolo-coco/best.pt).
+Источник "synthetic" - сгенерированное видео сцены заглушки, где переход находится
+и фиксируются нарушения.
+
+Для каждого этапа выводятся кадры в секунду (кадров / суммарное время этапа) и перцентили
+задержки; --json сохраняет результат, --compare сравнивает с сохраненным ранее.
+
+Запуск (из корня репозитория):
+    python benchmarks/pipeline_benchmark.py --json results/base.json
+    python benchmarks/pipeline_benchmark.py --compare results/base.json --json results/new.json
+    python benchmarks/pipeline_benchmark.py synthetic --synthetic-size 1920x1080 --threads 1
+    python benchmarks/pipeline_benchmark.py videos/4.mp4 --detector yolo --frames 300
+"""
+import os
+import sys
+import json
+import time
+import logging
+import platform
+import tempfile
+import argparse
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.append(ROOT)
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT) # Путь к весам модели и видео задан относительно корня
+os.environ.setdefault("CALIBRATION_CACHE_PATH", "") # Поиск перехода замеряется в каждом прогоне
+
+import stub_detector  # noqa: E402
+
+DEFAULT_SOURCES = ['videos/4.mp4', 'videos/5.mp4', 'synthetic']
+FRAME_STAGES = ['decode', 'inference', 'postprocess', 'crosswalk', 'draw', 'output', 'encode'] # Этапы кадра по порядку
+PERCENTILES = (50, 90, 95, 99)
+
+
+class StageTimer:
+    """Время этапов кадра: lap(stage) добавляет к этапу время с предыдущей отметки."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {stage: [] for stage in FRAME_STAGES + ['total']}
+        self._frame: Dict[str, float] = {}
+        self._last = time.perf_counter()
+
+    def reset(self) -> None:
+        self.__init__()
+
+    def lap(self, stage: str) -> None:
+        now = time.perf_counter()
+        self._frame[stage] = self._frame.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def observe(self, stage: str, seconds: float) -> None:
+        self._frame[stage] = self._frame.get(stage, 0.0) + seconds
+
+    def end_frame(self, record: bool = True) -> None:
+        """Завершает кадр; record=False - кадр прогрева, в статистику не входит."""
+        if record:
+            for stage in FRAME_STAGES:
+                self.samples[stage].append(self._frame.get(stage, 0.0))
+            self.samples['total'].append(sum(self._frame.values()))
+        self._frame = {}
+
+
+def summarize(samples: List[float], units: int = 1) -> Dict[str, Any]:
+    """Статистика этапа: units - объектов (кадров, строк) на один замер, для расчета пропускной способности."""
+    if not samples:
+        return {"count": 0}
+    values = np.array(samples) * 1000
+    total = float(np.sum(samples))
+    stats = {
+        "count": len(samples),
+        "total_s": round(total, 6),
+        "per_second": round(len(samples) * units / total, 2) if total > 0 else None,
+        "mean_ms": round(float(values.mean()), 4),
+        "max_ms": round(float(values.max()), 4)
+    }
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        stats[f"p{q}_ms"] = round(float(value), 4)
+    return stats
+
+
+def run_source(path: str, args: argparse.Namespace, timer: StageTimer) -> Dict[str, Any]:
+    """Обрабатывает источник process_video с замером этапов; возвращает статистику по этапам."""
+    import yolo8_video
+    from stream_control import JPEG_MAX_QUALITY
+    from wire_protocol import DeltaEncoder
+
+    track_frame = yolo8_video.track_frame
+    light_frame: List[Any] = [] # Первый кадр со светофором (до отрисовки) для crosswalk_detect
+
+    def capturing_track_frame(frame: np.ndarray) -> Any:
+        detections = track_frame(frame)
+        if not light_frame:
+            lights = detections.xyxy[np.isin(detections.cls, yolo8_video.LIGHT_CLASS_IDS)]
+            if len(lights):
+                x1, y1, x2, y2 = lights[0].tolist()
+                light_frame.append((frame.copy(), (x1, y1, x2 - x1, y2 - y1)))
+        return detections
+
+    yolo8_video.track_frame = capturing_track_frame # process_video получает track_frame из модуля при вызове
+    encoder = DeltaEncoder()
+    params = [cv2.IMWRITE_JPEG_QUALITY, JPEG_MAX_QUALITY]
+    timer.reset()
+    frames = 0
+    frame_data: Dict[str, Any] = {}
+    start = time.perf_counter()
+    results = yolo8_video.process_video(
+        path, return_frame=True, save_output=False, save_violations=False, save_evidence=False,
+        detect_every=args.detect_every, timings=timer
+    )
+    try:
+        for frame_data, frame in results:
+            ok, jpeg = cv2.imencode('.jpg', frame, params)
+            encoder.encode(frame_data, jpeg)
+            timer.lap("encode")
+            timer.end_frame(record=frames >= args.warmup)
+            frames += 1
+            if frames == args.warmup:
+                start = time.perf_counter() # Общая скорость - без кадров прогрева
+            if args.frames and frames >= args.frames + args.warmup:
+                break
+    finally:
+        results.close()
+        yolo8_video.track_frame = track_frame
+    wall = time.perf_counter() - start
+    measured = max(0, frames - args.warmup)
+
+    stages = {stage: summarize(timer.samples[stage]) for stage in FRAME_STAGES + ['total']}
+    if light_frame: # Полный поиск перехода выполняется однократно, поэтому замеряется отдельно
+        frame, light_box = light_frame[0]
+        samples = []
+        for _ in range(args.crosswalk_runs):
+            t0 = time.perf_counter()
+            yolo8_video.detect_crosswalk(frame, light_box)
+            samples.append(time.perf_counter() - t0)
+        stages["crosswalk_detect"] = summarize(samples)
+    return {
+        "frames": measured,
+        "wall_s": round(wall, 4),
+        "fps": round(measured / wall, 2) if wall > 0 and measured else None,
+        "total_crossings": frame_data.get('total_crossings'), # Совпадение счетчиков - проверка, что версии делают одно и то же
+        "red_light_violations": frame_data.get('red_light_violations'),
+        "stages": stages
+    }
+
+
+def run_db(args: argparse.Namespace) -> Dict[str, Any]:
+    """Пакетная вставка нарушений через ViolationWriter: задержка пакета и строк в секунду."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from models import Base
+    from violation_writer import VIOLATION_FLUSH_SIZE, ViolationWriter
+
+    with tempfile.TemporaryDirectory() as tmp:
+        url = args.db_url or f"sqlite:///{os.path.join(tmp, 'violations.db')}"
+        engine = create_engine(url)
+        Base.metadata.create_all(engine)
+        writer = ViolationWriter(session_factory=sessionmaker(autocommit=False, autoflush=False, bind=engine))
+        rows = [{
+            'vehicle_id': str(i),
+            'timestamp': None,
+            'video_second': i // 30,
+            'processed_video_path': 'output/processed_benchmark.mp4',
+            'original_video_path': 'videos/benchmark.mp4',
+            'evidence_clip_path': f'output/evidence_benchmark_f{i}_id{i}.mp4'
+        } for i in range(args.db_rows)]
+        samples = []
+        for i in range(0, len(rows), VIOLATION_FLUSH_SIZE): # Пакеты, как их собирает поток записи
+            t0 = time.perf_counter()
+            writer._flush(rows[i:i + VIOLATION_FLUSH_SIZE])
+            samples.append(time.perf_counter() - t0)
+        engine.dispose()
+    stats = summarize(samples, VIOLATION_FLUSH_SIZE) # per_second - строк в секунду, задержки - на пакет
+    stats.update({"rows": writer.written, "batch_size": VIOLATION_FLUSH_SIZE, "url": url.split('://')[0]})
+    return stats
+
+
+def git_revision() -> Optional[str]:
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+        return revision + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment(args: argparse.Namespace) -> Dict[str, Any]:
+    """Сведения о версии кода и окружении для сопоставления результатов."""
+    return {
+        "revision": git_revision(),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "opencv_threads": cv2.getNumThreads(),
+        "args": {k: v for k, v in vars(args).items() if k not in ('json', 'compare')}
+    }
+
+
+def print_stages(name: str, result: Dict[str, Any]) -> None:
+    print(f"{name}: {result['frames']} кадров, {result['fps']} кадр/с, "
+          f"пересечений {result['total_crossings']}, нарушений {result['red_light_violations']}")
+    print(f"  {'этап':<17}{'кадр/с':>10}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}  (мс)")
+    for stage, stats in result['stages'].items():
+        if not stats.get("count"):
+            continue
+        per_second = f"{stats['per_second']:.1f}" if stats['per_second'] else "-"
+        print(f"  {stage:<17}{per_second:>10}{stats['mean_ms']:>9.2f}{stats['p50_ms']:>9.2f}"
+              f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}")
+
+
+def change(old: Optional[float], new: Optional[float]) -> str:
+    if not old or not new:
+        return "-"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def print_comparison(baseline: Dict[str, Any], report: Dict[str, Any]) -> None:
+    """Сравнение пропускной способности и p95 по этапам с сохраненным результатом."""
+    print(f"\nСравнение с {baseline['environment'].get('revision')} ({baseline['environment'].get('time')}):")
+    for name, result in report['sources'].items():
+        old = baseline['sources'].get(name)
+        if old is None:
+            continue
+        print(f"{name}: {old['fps']} -> {result['fps']} кадр/с ({change(old['fps'], result['fps'])})")
+        if old['frames'] != result['frames']:
+            print(f"  ВНИМАНИЕ: число кадров различается: {old['frames']} -> {result['frames']}")
+        elif (old['total_crossings'], old['red_light_violations']) != (result['total_crossings'], result['red_light_violations']):
+            print(f"  ВНИМАНИЕ: счетчики различаются: {old['total_crossings']}/{old['red_light_violations']} -> "
+                  f"{result['total_crossings']}/{result['red_light_violations']}")
+        for stage, stats in result['stages'].items():
+            before = old['stages'].get(stage, {})
+            if not stats.get("count") or not before.get("count"):
+                continue
+            print(f"  {stage:<17}{change(before['per_second'], stats['per_second']):>9} кадр/с, "
+                  f"p95 {before['p95_ms']:.2f} -> {stats['p95_ms']:.2f} мс")
+    if baseline.get('db') and report.get('db'):
+        print(f"db: {baseline['db']['per_second']} -> {report['db']['per_second']} строк/с "
+              f"({change(baseline['db']['per_second'], report['db']['per_second'])})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('sources', nargs='*', default=DEFAULT_SOURCES, help='Видеофайлы и/или "synthetic"')
+    parser.add_argument('--detector', choices=['stub', 'yolo'], default='stub', help='Детектор-заглушка или модель YOLO')
+    parser.add_argument('--stub-infer-ms', type=float, default=0.0, help='Имитация времени инференса заглушки (мс)')
+    parser.add_argument('--detect-every', default='1', help='Параметр detect_every process_video')
+    parser.add_argument('--frames', type=int, default=0, help='Ограничение числа замеряемых кадров источника (0 - все)')
+    parser.add_argument('--warmup', type=int, default=10, help='Кадров прогрева в начале источника (не замеряются)')
+    parser.add_argument('--synthetic-frames', type=int, default=300, help='Кадров синтетического видео')
+    parser.add_argument('--synthetic-size', default='1280x720', help='Размер синтетического видео (ШxВ)')
+    parser.add_argument('--crosswalk-runs', type=int, default=20, help='Повторов detect_crosswalk для crosswalk_detect')
+    parser.add_argument('--db-rows', type=int, default=2000, help='Строк нарушений для этапа db (0 - не замерять)')
+    parser.add_argument('--db-url', default=None, help='Строка подключения БД для этапа db (по умолчанию временная SQLite)')
+    parser.add_argument('--threads', type=int, default=None, help='Число потоков OpenCV (cv2.setNumThreads)')
+    parser.add_argument('--json', default=None, help='Файл для сохранения результата')
+    parser.add_argument('--compare', default=None, help='Сохраненный ранее результат для сравнения')
+    parser.add_argument('--verbose', action='store_true', help='Не скрывать журнал process_video')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    if args.detector == 'stub':
+        stub_detector.install(args.stub_infer_ms) # До импорта yolo8_video: веса модели не загружаются
+    import yolo8_video  # noqa: F401 (загрузка модели до замеров)
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+
+    report: Dict[str, Any] = {"environment": environment(args), "sources": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.sources:
+            path = name
+            if name == 'synthetic':
+                width, height = (int(v) for v in args.synthetic_size.lower().split('x'))
+                path = stub_detector.write_synthetic_video(os.path.join(tmp, 'synthetic.avi'), args.synthetic_frames, (width, height))
+                name = f"synthetic:{width}x{height}"
+            elif not os.path.exists(path):
+                print(f"{name}: файл не найден, пропущен")
+                continue
+            report["sources"][name] = run_source(path, args, StageTimer())
+            print_stages(name, report["sources"][name])
+    if args.db_rows > 0:
+        report["db"] = run_db(args)
+        db = report["db"]
+        print(f"db ({db['url']}): {db['rows']} строк пакетами по {db['batch_size']}, {db['per_second']} строк/с, "
+              f"пакет p50 {db['p50_ms']:.2f} мс, p95 {db['p95_ms']:.2f} мс")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(json.load(f), report)
+    if args.json:
+        os.makedirs(os.path.dirname(os.path.abspath(args.json)), exist_ok=True)
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результат сохранен: {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Проверка полноты фиксации нарушений в режиме пропуска кадров.
+
+Каждое видео обрабатывается на полной частоте (detect_every=1) и в заданных режимах
+пропуска кадров. Нарушения (переход ТС в состояние crossed_on_red) сопоставляются
+по времени с допуском; полнота = доля нарушений полного прогона, найденных в режиме пропуска.
+Запись в БД и сохранение видео отключены.
+
+Запуск (из корня репозитория):
+    python benchmarks/skip_recall.py --modes 2 3 auto
+    python benchmarks/skip_recall.py videos/4.mp4 --modes 2 --tolerance 0.5
+"""
+import os
+import sys
+import glob
+import time
+import argparse
+from typing import Dict, List, Tuple
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+os.chdir(os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))) # Путь к весам модели задан относительно корня
+
+from yolo8_video import process_video  # noqa: E402
+
+
+def collect_violations(video: str, detect_every) -> Tuple[List[int], int, float]:
+    """Возвращает индексы кадров с новыми нарушениями, число кадров и время обработки."""
+    events: List[int] = []
+    seen = set()
+    frames = 0
+    start = time.perf_counter()
+    for frame_data in process_video(video, save_output=False, save_violations=False, detect_every=detect_every):
+        for tid, state in frame_data['vehicle_states'].items():
+            if state['crossed_on_red'] and tid not in seen:
+                seen.add(tid)
+                events.append(frames)
+        frames += 1
+    return events, frames, time.perf_counter() - start
+
+
+def match_events(reference: List[int], candidate: List[int], tolerance: int) -> int:
+    """Жадно сопоставляет события по индексу кадра с допуском; возвращает число совпадений."""
+    unmatched = sorted(candidate)
+    matched = 0
+    for frame_idx in sorted(reference):
+        best = None
+        for i, other in enumerate(unmatched):
+            if abs(other - frame_idx) <= tolerance and (best is None or abs(other - frame_idx) < abs(unmatched[best] - frame_idx)):
+                best = i
+        if best is not None:
+            unmatched.pop(best)
+            matched += 1
+    return matched
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('videos', nargs='*', help='Видеофайлы (по умолчанию videos/*.mp4)')
+    parser.add_argument('--modes', nargs='+', default=['2', '3', 'auto'], help='Значения detect_every для сравнения')
+    parser.add_argument('--tolerance', type=float, default=1.0, help='Допуск сопоставления нарушений (сек.)')
+    parser.add_argument('--fps', type=float, default=30.0, help='FPS для пересчета допуска в кадры')
+    args = parser.parse_args()
+
+    videos = args.videos or sorted(glob.glob('videos/*.mp4'))
+    tolerance = int(round(args.tolerance * args.fps))
+    totals: Dict[str, List[int]] = {mode: [0, 0] for mode in args.modes}
+    for video in videos:
+        reference, frames, full_time = collect_violations(video, 1)
+        print(f"{video}: {frames} кадров, {len(reference)} нарушений на полной частоте, {full_time:.1f} с")
+        for mode in args.modes:
+            events, _, elapsed = collect_violations(video, mode)
+            matched = match_events(reference, events, tolerance)
+            totals[mode][0] += matched
+            totals[mode][1] += len(reference)
+            recall = matched / len(reference) if reference else 1.0
+            print(f"  detect_every={mode:>4}: полнота {recall:.3f} ({matched}/{len(reference)}), "
+                  f"лишних {len(events) - matched}, {elapsed:.1f} с (x{full_time / elapsed if elapsed else 0:.2f})")
+    print("Итого:")
+    for mode, (matched, total) in totals.items():
+        print(f"  detect_every={mode:>4}: полнота {matched / total if total else 1.0:.3f} ({matched}/{total})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Детектор-заглушка для бенчмарков: детерминированные рамки вместо YOLO, без весов модели и torch.
+
+`install()` регистрирует модуль ultralytics с классом YOLO-заглушкой; вызывается до импорта
+yolo8_video. Рамки зависят только от номера кадра сессии и размера кадра: светофор у левого
+края (красный и зеленый по очереди по STUB_LIGHT_PERIOD кадров) и ТС, движущиеся сверху вниз
+через полосу перехода. `synthetic_frames` рисует ту же сцену (с зеброй под светофором),
+поэтому на синтетическом видео переход находится и нарушения фиксируются.
+"""
+import sys
+import time
+import types
+from typing import Dict, Generator, List, Tuple
+
+import cv2
+import numpy as np
+
+STUB_NAMES: Dict[int, str] = { # Классы заглушки (метки совпадают с метками модели)
+    0: 'car', 1: 'bus', 2: 'truck', 3: 'motorcycle', 4: 'van',
+    5: 'green_light', 6: 'red_light', 7: 'yellow_light'
+}
+STUB_VEHICLES = 4 # ТС в кадре одновременно
+STUB_LIGHT_PERIOD = 90 # Кадров между переключениями светофора
+LIGHT_BOX = (0.08, 0.05, 0.025, 0.12) # Рамка светофора (x, y, w, h) в долях кадра
+CROSSWALK_CENTER = (0.5, 0.6) # Центр зебры в долях кадра
+ZEBRA_BLOCK = (44, 30) # Размер блока зебры (пикс.): центры блоков ближе CROSSWALK_CLUSTER_DISTANCE
+ZEBRA_STEP = (64, 50) # Шаг блоков зебры по x и y (пикс.)
+VEHICLE_SIZE = (0.1, 0.12) # Ширина и высота ТС в долях кадра
+
+
+def stub_boxes(frame_idx: int, width: int, height: int) -> np.ndarray:
+    """Рамки кадра frame_idx: массив (N, 6) - x1, y1, x2, y2, ID трека (-1 у светофора), класс."""
+    lx, ly, lw, lh = (int(v * s) for v, s in zip(LIGHT_BOX, (width, height, width, height)))
+    red = (frame_idx // STUB_LIGHT_PERIOD) % 2 == 0
+    rows = [[lx, ly, lx + lw, ly + lh, -1, 6 if red else 5]]
+    vw, vh = int(VEHICLE_SIZE[0] * width), int(VEHICLE_SIZE[1] * height)
+    span = height + vh # Путь ТС от появления сверху до ухода за нижний край
+    for k in range(STUB_VEHICLES):
+        speed = 3 + 2 * k # Пикс. за кадр
+        travel = frame_idx * speed + k * span // STUB_VEHICLES
+        lap, offset = divmod(travel, span)
+        y = offset - vh
+        x = int((0.25 + 0.17 * k) * width)
+        track_id = 1 + k + STUB_VEHICLES * lap # Каждый новый проезд - новый трек
+        rows.append([x, max(0, y), x + vw, min(height, y + vh), track_id, k % 5])
+    return np.array(rows, dtype=float)
+
+
+class _Array:
+    """Обертка массива с интерфейсом тензора, который использует parse_boxes (.cpu().numpy())."""
+
+    def __init__(self, data: np.ndarray):
+        self.data = data
+
+    def cpu(self) -> "_Array":
+        return self
+
+    def numpy(self) -> np.ndarray:
+        return self.data
+
+
+class StubBoxes:
+    def __init__(self, rows: np.ndarray):
+        self.xyxy = _Array(rows[:, :4])
+        self.id = _Array(rows[:, 4])
+        self.cls = _Array(rows[:, 5])
+
+
+class StubResult:
+    def __init__(self, frame: np.ndarray, rows: np.ndarray):
+        self.orig_img = frame
+        self.boxes = StubBoxes(rows)
+
+
+class StubTracker:
+    """Состояние сессии заглушки; сбрасывается reset_session_state, как трекеры BoT-SORT."""
+
+    def __init__(self):
+        self.frame_idx = 0
+
+    def reset(self) -> None:
+        self.frame_idx = 0
+
+
+class StubPredictor:
+    def __init__(self):
+        self.trackers = [StubTracker()]
+
+
+class StubYOLO:
+    """Заглушка ultralytics.YOLO: track возвращает рамки stub_boxes для очередного кадра сессии."""
+    infer_ms = 0.0 # Имитация времени инференса на кадр (мс)
+
+    def __init__(self, weights: str = ""):
+        self.weights = weights
+        self.names = dict(STUB_NAMES)
+        self.predictor = StubPredictor()
+
+    def track(self, source: np.ndarray, **kwargs) -> List[StubResult]:
+        tracker = self.predictor.trackers[0]
+        rows = stub_boxes(tracker.frame_idx, source.shape[1], source.shape[0])
+        tracker.frame_idx += 1
+        if self.infer_ms > 0:
+            time.sleep(self.infer_ms / 1000)
+        return [StubResult(source, rows)]
+
+
+def install(infer_ms: float = 0.0) -> None:
+    """Подменяет модуль ultralytics заглушкой (до импорта yolo8_video)."""
+    StubYOLO.infer_ms = infer_ms
+    module = types.ModuleType("ultralytics")
+    module.YOLO = StubYOLO
+    sys.modules["ultralytics"] = module
+
+
+def draw_scene(frame_idx: int, width: int, height: int, texture: np.ndarray) -> np.ndarray:
+    """Кадр синтетической сцены: дорога с шумом, зебра под светофором, светофор и ТС из stub_boxes."""
+    frame = np.roll(texture, frame_idx % 16, axis=1).copy() # Сдвиг шума: соседние кадры различаются
+    cx, cy = int(CROSSWALK_CENTER[0] * width), int(CROSSWALK_CENTER[1] * height)
+    for dx in (-1, 1): # Блоки 2x2: detect_crosswalk объединит их в один кластер
+        for dy in (-1, 1):
+            x = cx + dx * ZEBRA_STEP[0] // 2 - ZEBRA_BLOCK[0] // 2
+            y = cy + dy * ZEBRA_STEP[1] // 2 - ZEBRA_BLOCK[1] // 2
+            cv2.rectangle(frame, (x, y), (x + ZEBRA_BLOCK[0], y + ZEBRA_BLOCK[1]), (235, 235, 235), -1)
+    for x1, y1, x2, y2, _, cls in stub_boxes(frame_idx, width, height).astype(int).tolist():
+        if STUB_NAMES[cls].endswith('_light'):
+            color = (0, 0, 230) if STUB_NAMES[cls] == 'red_light' else (0, 200, 0)
+        else:
+            color = (60 + 40 * (cls % 5), 90, 200 - 30 * (cls % 5))
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, -1)
+    return frame
+
+
+def synthetic_frames(count: int, width: int, height: int, seed: int = 0) -> Generator[np.ndarray, None, None]:
+    """Детерминированная последовательность кадров синтетической сцены."""
+    rng = np.random.default_rng(seed)
+    texture = (70 + rng.integers(-12, 13, size=(height, width, 1))).astype(np.uint8).repeat(3, axis=2)
+    for frame_idx in range(count):
+        yield draw_scene(frame_idx, width, height, texture)
+
+
+def write_synthetic_video(path: str, count: int, size: Tuple[int, int], fps: float = 30.0, seed: int = 0) -> str:
+    """Записывает синтетическую сцену в файл MJPG (декодирование в бенчмарке идет как для реального видео)."""
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    if not writer.isOpened():
+        raise RuntimeError(f"cv2.VideoWriter не открыл {path}")
+    try:
+        for frame in synthetic_frames(count, width, height, seed):
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
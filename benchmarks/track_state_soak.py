@@ -0,0 +1,98 @@
+"""
+Длительный (soak) тест хранилища состояний треков.
+
+Имитирует круглосуточный поток с камеры: каждые --spawn кадров появляется новое ТС,
+которое видно --lifetime кадров и один раз пересекает переход (на красный с вероятностью
+--red-share). На каждом кадре выполняется та же работа с состояниями, что и в process_video:
+регистрация пересечений, продление видимых треков, удаление старых, чтение счетчиков
+и словаря vehicle_states для frame_data.
+
+Для сравнения можно запустить прежнюю схему (--legacy): словарь без удаления и подсчет
+нарушений полным проходом на каждом кадре.
+
+Запуск (из корня репозитория):
+    python benchmarks/track_state_soak.py --frames 5000000
+    python benchmarks/track_state_soak.py --frames 200000 --legacy
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from typing import Dict, List
+
+import psutil
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from track_state import TRACK_STATE_TTL, TrackStateStore  # noqa: E402
+
+
+def visible_tracks(frame_idx: int, spawn: int, lifetime: int) -> List[int]:
+    """ID треков, видимых на кадре: трек k появляется на кадре k * spawn и виден lifetime кадров."""
+    first = max(0, (frame_idx - lifetime) // spawn + 1)
+    return list(range(first, frame_idx // spawn + 1))
+
+
+def run_store(args: argparse.Namespace, rng: random.Random) -> None:
+    store = TrackStateStore(ttl=args.ttl)
+    process = psutil.Process()
+    window = max(1, args.frames // args.windows)
+    start = time.perf_counter()
+    for frame_idx in range(args.frames):
+        tracks = visible_tracks(frame_idx, args.spawn, args.lifetime)
+        crossing = tracks[len(tracks) // 2] if tracks else None # Переход пересекает трек в середине видимости
+        if crossing is not None:
+            store.mark_crossed(crossing, frame_idx, rng.random() < args.red_share)
+        store.touch(tracks, frame_idx)
+        store.evict(frame_idx)
+        frame_data = (store.total_crossings, store.red_light_violations, store.snapshot())
+        if (frame_idx + 1) % window == 0:
+            elapsed = time.perf_counter() - start
+            print(f"{frame_idx + 1:>10} кадров: {elapsed / window * 1e6:7.2f} мкс/кадр, "
+                  f"состояний {len(store):>6}, нарушений {frame_data[1]:>8}, "
+                  f"RSS {process.memory_info().rss / 1024 ** 2:7.1f} МБ")
+            start = time.perf_counter()
+
+
+def run_legacy(args: argparse.Namespace, rng: random.Random) -> None:
+    vehicle_states: Dict[int, Dict[str, bool]] = {}
+    process = psutil.Process()
+    window = max(1, args.frames // args.windows)
+    start = time.perf_counter()
+    for frame_idx in range(args.frames):
+        tracks = visible_tracks(frame_idx, args.spawn, args.lifetime)
+        crossing = tracks[len(tracks) // 2] if tracks else None
+        if crossing is not None and crossing not in vehicle_states:
+            vehicle_states[crossing] = {'crossed': True, 'crossed_on_red': rng.random() < args.red_share}
+        red = sum(1 for v in vehicle_states.values() if v['crossed_on_red'])
+        if (frame_idx + 1) % window == 0:
+            elapsed = time.perf_counter() - start
+            print(f"{frame_idx + 1:>10} кадров: {elapsed / window * 1e6:7.2f} мкс/кадр, "
+                  f"состояний {len(vehicle_states):>6}, нарушений {red:>8}, "
+                  f"RSS {process.memory_info().rss / 1024 ** 2:7.1f} МБ")
+            start = time.perf_counter()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=2_000_000, help='Число кадров')
+    parser.add_argument('--windows', type=int, default=10, help='Число интервалов отчета')
+    parser.add_argument('--spawn', type=int, default=15, help='Кадров между появлением новых ТС')
+    parser.add_argument('--lifetime', type=int, default=150, help='Кадров, в течение которых видно ТС')
+    parser.add_argument('--red-share', type=float, default=0.1, help='Доля пересечений на красный')
+    parser.add_argument('--ttl', type=int, default=TRACK_STATE_TTL, help='TTL состояний в кадрах')
+    parser.add_argument('--legacy', action='store_true', help='Прежняя схема: словарь без удаления и полный подсчет')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'Прежняя схема' if args.legacy else 'TrackStateStore'}: {args.frames} кадров, "
+          f"новое ТС каждые {args.spawn} кадров, видно {args.lifetime} кадров, ttl {args.ttl}")
+    if args.legacy:
+        run_legacy(args, rng)
+    else:
+        run_store(args, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Сравнение транспорта кадров между воркером и обработчиком WebSocket:
+текущий путь через `multiprocessing.Queue` + `run_in_executor(queue.get)`
+и кольцевой буфер в разделяемой памяти `SharedFrameRing`.
+
+Запуск (из корня репозитория):
+    python benchmarks/transport_benchmark.py --frames 600 --streams 4
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import multiprocessing
+from typing import Any, Dict, List
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from frame_transport import SharedFrameRing  # noqa: E402
+
+
+def make_jpeg(width: int, height: int) -> np.ndarray:
+    """Формирует синтетический кадр заданного размера и кодирует его в JPEG."""
+    rng = np.random.default_rng(0)
+    frame = np.zeros((height, width, 3), np.uint8)
+    frame[:] = rng.integers(0, 255, (1, width, 3), dtype=np.uint8) # Вертикальные полосы
+    noise = rng.integers(0, 40, (height, width, 3), dtype=np.uint8)
+    frame = cv2.add(frame, noise)
+    _, jpeg = cv2.imencode('.jpg', frame)
+    return jpeg
+
+
+def make_frame_data(frame_idx: int) -> Dict[str, Any]:
+    """Метаданные кадра, по объему сопоставимые с реальными данными `process_video`."""
+    return {
+        'vehicles': [{'id': i, 'label': 'car', 'bbox': [i, i, i + 50, i + 40]} for i in range(20)],
+        'traffic_lights': [{'label': 'red_light', 'bbox': [10, 10, 30, 60]}],
+        'crosswalk_bbox': [0, 500, 1920, 120],
+        'total_crossings': frame_idx,
+        'red_light_violations': 0,
+        'frame_width': 1920,
+        'frame_height': 1080,
+        'vehicle_states': {},
+        'output_path': None,
+    }
+
+
+# --- Производители (выполняются в дочерних процессах) ---
+def queue_producer(queue, frames: int, width: int, height: int) -> None:
+    jpeg = make_jpeg(width, height)
+    for i in range(frames):
+        queue.put((make_frame_data(i), jpeg.tobytes()))
+    queue.put(None)
+
+
+def ring_producer(ring: SharedFrameRing, frames: int, width: int, height: int) -> None:
+    jpeg = make_jpeg(width, height)
+    for i in range(frames):
+        ring.put(make_frame_data(i), jpeg)
+    ring.close_stream()
+
+
+# --- Потребители (выполняются в цикле событий, как эндпоинт video_feed) ---
+async def consume_queue(frames: int, width: int, height: int) -> int:
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=queue_producer, args=(queue, frames, width, height))
+    process.start()
+    received = 0
+    while True:
+        item = await asyncio.get_event_loop().run_in_executor(None, queue.get)
+        if item is None:
+            break
+        received += 1
+    process.join()
+    queue.close()
+    return received
+
+
+async def consume_ring(frames: int, width: int, height: int) -> int:
+    ring = SharedFrameRing()
+    process = multiprocessing.Process(target=ring_producer, args=(ring, frames, width, height))
+    process.start()
+    received = 0
+    while True:
+        item = await ring.recv_async()
+        if item is None:
+            break
+        received += 1
+    process.join()
+    ring.close()
+    return received
+
+
+async def run_case(consumer, streams: int, frames: int, width: int, height: int) -> Dict[str, float]:
+    """Запускает несколько параллельных потоков и замеряет пропускную способность и CPU."""
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    counts: List[int] = await asyncio.gather(*(consumer(frames, width, height) for _ in range(streams)))
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    total = sum(counts)
+    return {
+        'frames': total,
+        'seconds': elapsed,
+        'fps': total / elapsed if elapsed > 0 else 0.0,
+        'consumer_cpu_ms_per_frame': 1000.0 * cpu / total if total else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=600, help='Кадров на поток')
+    parser.add_argument('--streams', type=int, default=4, help='Количество параллельных потоков')
+    parser.add_argument('--width', type=int, default=1920)
+    parser.add_argument('--height', type=int, default=1080)
+    args = parser.parse_args()
+
+    jpeg_size = make_jpeg(args.width, args.height).nbytes
+    print(f"Кадр {args.width}x{args.height}, JPEG {jpeg_size / 1024:.0f} КБ, "
+          f"{args.streams} поток(ов) по {args.frames} кадров")
+    for name, consumer in (('queue', consume_queue), ('shared_ring', consume_ring)):
+        stats = asyncio.run(run_case(consumer, args.streams, args.frames, args.width, args.height))
+        print(f"{name:>12}: {stats['fps']:8.1f} кадр/с, "
+              f"{stats['consumer_cpu_ms_per_frame']:.3f} мс CPU потребителя на кадр "
+              f"({stats['frames']} кадров за {stats['seconds']:.2f} с)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+from utils import valid_box
+
+# --- Кэш калибровки источников (переопределяется переменными окружения) ---
+CALIBRATION_CACHE_PATH = os.environ.get("CALIBRATION_CACHE_PATH", "calibration/crosswalk.json") # Пустая строка отключает кэш
+FINGERPRINT_BYTES = 4 * 1024 * 1024 # Сколько байт начала файла учитывается в отпечатке источника
+
+
+def source_fingerprint(source: Any) -> str:
+    """
+    Ключ источника для кэша калибровки. Для видеофайла - SHA-256 размера и начала
+    содержимого, поэтому повторная загрузка того же файла под другим именем дает тот же ключ.
+    Для камеры - номер устройства или адрес потока.
+    """
+    if isinstance(source, int):
+        return f"camera:{source}"
+    if isinstance(source, str) and os.path.isfile(source):
+        digest = hashlib.sha256(str(os.path.getsize(source)).encode())
+        with open(source, "rb") as f:
+            digest.update(f.read(FINGERPRINT_BYTES))
+        return f"file:{digest.hexdigest()}"
+    return f"stream:{source}"
+
+
+class CalibrationCache:
+    """
+    Постоянный кэш найденных областей пешеходного перехода по источникам (JSON-файл).
+    Запись атомарна (временный файл + os.replace). Файл меняют процессы воркеров и сегментов,
+    поэтому чтение, изменение и запись выполняются под файловой блокировкой (filelock):
+    записи других процессов не теряются.
+    """
+
+    def __init__(self, path: str = CALIBRATION_CACHE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.warning(f"Не удалось прочитать кэш калибровки {self.path}, он будет перезаписан")
+            return {}
+
+    def get(self, key: str, frame_size: Optional[Tuple[int, int]] = None) -> Optional[Tuple[int, int, int, int]]:
+        """
+        Возвращает сохраненную рамку перехода (x, y, w, h) для источника или None.
+        Если передан frame_size (ширина, высота), запись другого разрешения не используется.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._load().get(key)
+        if entry is None:
+            return None
+        if frame_size is not None and tuple(entry.get("frame_size", ())) != tuple(frame_size):
+            return None
+        crosswalk = tuple(entry.get("crosswalk", ()))
+        if not valid_box(crosswalk): # Вырожденная запись (например, из старой версии): переход ищется заново
+            return None
+        return crosswalk
+
+    def put(self, key: str, crosswalk: Tuple[int, int, int, int], frame_size: Tuple[int, int]) -> None:
+        """Сохраняет найденную рамку перехода для источника."""
+        if not self.enabled:
+            return
+        if not valid_box(crosswalk):
+            logging.warning(f"Рамка перехода {crosswalk} для {key} не сохраняется в кэш калибровки: нулевой размер")
+            return
+        from filelock import FileLock
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with self._lock, FileLock(self.path + ".lock"):
+            data = self._load()
+            data[key] = {"crosswalk": [int(v) for v in crosswalk], "frame_size": [int(v) for v in frame_size]}
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, self.path)
+            except OSError:
+                logging.exception(f"Не удалось сохранить кэш калибровки {self.path}")
+
+
+crosswalk_cache = CalibrationCache() # Общий кэш калибровки процесса
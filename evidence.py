@@ -0,0 +1,149 @@
+import os
+import queue
+import logging
+import threading
+from collections import deque
+from typing import Any, Deque, List, Optional, Tuple
+
+import numpy as np
+
+from video_output import OUTPUT_BACKEND, OUTPUT_QUEUE_SIZE, backend_extension, close_backend, open_backend, resolve_backend
+
+# --- Видеофрагменты нарушений (переопределяются переменными окружения) ---
+EVIDENCE_CLIPS = os.environ.get("EVIDENCE_CLIPS", "0") == "1" # Сохранять фрагмент видео для каждого нарушения (по запросу)
+FULL_RECORDING = os.environ.get("FULL_RECORDING", "0") == "1" # Записывать обработанное видео целиком для /ws/video_feed
+EVIDENCE_PRE_SECONDS = float(os.environ.get("EVIDENCE_PRE_SECONDS", "5")) # Секунд видео до нарушения во фрагменте
+EVIDENCE_POST_SECONDS = float(os.environ.get("EVIDENCE_POST_SECONDS", "5")) # Секунд видео после нарушения
+EVIDENCE_BUFFER_MB = float(os.environ.get("EVIDENCE_BUFFER_MB", "256")) # Предел памяти буфера кадров одного источника
+
+
+class EvidenceClip:
+    """Открытый фрагмент: файл и последний кадр, который в него войдет."""
+    __slots__ = ("path", "end_idx", "writer", "failed")
+
+    def __init__(self, path: str, end_idx: int):
+        self.path = path
+        self.end_idx = end_idx
+        self.writer: Any = None
+        self.failed = False # Ошибка записи: остальные кадры фрагмента пропускаются
+
+
+class EvidenceRecorder:
+    """
+    Запись видеофрагментов нарушений из кольцевого буфера последних кадров.
+
+    Цикл обработки передает каждый размеченный кадр в `add` (очередь к фоновому потоку).
+    Поток хранит ссылки на кадры последних pre_seconds секунд без сжатия (не больше buffer_mb МБ):
+    кодируются только кадры, попавшие во фрагмент, а не каждый кадр источника.
+    `trigger` при нарушении сразу возвращает путь фрагмента, а поток записывает в него
+    кадры из буфера и следующие post_seconds секунд. Нарушение, случившееся во время
+    записи фрагмента, продлевает его и получает тот же путь.
+    """
+
+    def __init__(
+        self,
+        base_path: str, # Префикс путей фрагментов (без расширения)
+        fps: float,
+        pre_seconds: float = EVIDENCE_PRE_SECONDS,
+        post_seconds: float = EVIDENCE_POST_SECONDS,
+        buffer_mb: float = EVIDENCE_BUFFER_MB,
+        backend: str = OUTPUT_BACKEND,
+        queue_size: int = OUTPUT_QUEUE_SIZE
+    ):
+        self.base_path = base_path
+        self.fps = fps
+        self.pre_frames = max(0, int(round(pre_seconds * fps)))
+        self.post_frames = max(0, int(round(post_seconds * fps)))
+        self.buffer_bytes = int(buffer_mb * 1024 * 1024)
+        self.backend = resolve_backend(backend)
+        self.extension = backend_extension(self.backend)
+        self._queue: "queue.Queue[Optional[Tuple[str, int, Any]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._clip_path: Optional[str] = None # Фрагмент, который еще записывается (сторона цикла обработки)
+        self._clip_end = -1
+        self.clips: List[str] = [] # Пути созданных фрагментов
+        self.stalls = 0 # Ожиданий места в очереди
+        self._thread = threading.Thread(target=self._run, name="evidence-recorder", daemon=True)
+        self._thread.start()
+
+    def _put(self, item: Tuple[str, int, Any]) -> None:
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.stalls += 1
+            self._queue.put(item)
+
+    def add(self, frame: np.ndarray, frame_idx: int) -> None:
+        """Передает размеченный кадр frame_idx в буфер и открытые фрагменты (кадр после этого не изменяется)."""
+        self._put(("frame", frame_idx, frame))
+
+    def trigger(self, frame_idx: int, label: str) -> str:
+        """
+        Запрашивает фрагмент вокруг кадра frame_idx (вызывается до `add` этого кадра).
+        Возвращает путь файла; файл дописывается через post_seconds секунд видео.
+        """
+        end_idx = frame_idx + self.post_frames
+        if self._clip_path is not None and frame_idx <= self._clip_end: # Фрагмент еще пишется - продлеваем
+            self._clip_end = max(self._clip_end, end_idx)
+        else:
+            self._clip_path = f"{self.base_path}_{label}{self.extension}"
+            self._clip_end = end_idx
+            self.clips.append(self._clip_path)
+        self._put(("trigger", frame_idx, (self._clip_path, self._clip_end)))
+        return self._clip_path
+
+    def close(self) -> None:
+        """Дописывает открытые фрагменты доступными кадрами и останавливает поток."""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        """Основной цикл потока: буфер последних кадров и запись фрагментов."""
+        buffer: Deque[Tuple[int, np.ndarray]] = deque() # (индекс кадра, кадр)
+        buffered_bytes = 0
+        clip: Optional[EvidenceClip] = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, frame_idx, payload = item
+            if kind == "trigger":
+                path, end_idx = payload
+                if clip is not None and clip.path == path:
+                    clip.end_idx = end_idx
+                    continue
+                if clip is not None and clip.writer is not None:
+                    close_backend(clip.writer)
+                clip = EvidenceClip(path, end_idx)
+                start_idx = frame_idx - self.pre_frames
+                for idx, buffered in buffer: # Кадры до нарушения
+                    if idx >= start_idx:
+                        self._write(clip, buffered)
+                continue
+
+            frame = payload
+            if clip is not None:
+                self._write(clip, frame)
+                if frame_idx >= clip.end_idx:
+                    if clip.writer is not None:
+                        close_backend(clip.writer)
+                    logging.info(f"Фрагмент нарушения записан: {clip.path}")
+                    clip = None
+            if self.pre_frames: # Буфер нужен только для кадров до нарушения
+                buffer.append((frame_idx, frame))
+                buffered_bytes += frame.nbytes
+                while buffer and (buffer[0][0] <= frame_idx - self.pre_frames or buffered_bytes > self.buffer_bytes):
+                    buffered_bytes -= buffer.popleft()[1].nbytes
+        if clip is not None and clip.writer is not None:
+            close_backend(clip.writer)
+
+    def _write(self, clip: EvidenceClip, frame: np.ndarray) -> None:
+        """Записывает кадр во фрагмент, открывая файл при первом кадре."""
+        if clip.failed:
+            return
+        try:
+            if clip.writer is None:
+                clip.writer = open_backend(self.backend, clip.path, self.fps, (frame.shape[1], frame.shape[0]))
+            clip.writer.write(frame)
+        except Exception:
+            logging.exception(f"Ошибка записи фрагмента нарушения {clip.path}")
+            clip.failed = True
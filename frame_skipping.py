@@ -0,0 +1,154 @@
+import os
+import math
+import time
+import logging
+from typing import Any, Callable, Generator, Optional, Tuple, Union
+
+import numpy as np
+
+from utils import Detections
+from frame_source import FrameSource
+
+# --- Конфигурация режима пропуска кадров (переопределяется переменными окружения) ---
+DETECT_EVERY = os.environ.get("DETECT_EVERY", "1") # Детекция каждые N кадров или "auto"
+MAX_DETECT_INTERVAL = int(os.environ.get("MAX_DETECT_INTERVAL", "5")) # Верхний предел N в режиме "auto"
+VELOCITY_SMOOTHING = 0.5 # Вес новой оценки скорости в экспоненциальном сглаживании
+LOAD_SMOOTHING = 0.2 # Вес нового замера времени детекции в режиме "auto"
+
+
+def parse_detect_every(value: Union[int, str, None]) -> Union[int, str]:
+    """Приводит настройку частоты детекции к целому N >= 1 или строке "auto"."""
+    if value is None:
+        return 1
+    if isinstance(value, str) and value.strip().lower() == "auto":
+        return "auto"
+    return max(1, int(value))
+
+
+class BoxPropagator:
+    """
+    Модель движения с постоянной скоростью для переноса рамок между детекциями.
+    Для каждого трека хранится последняя рамка и сглаженная скорость (пикселей за кадр);
+    объекты без трека (светофоры, ТС без ID) переносятся без смещения.
+    """
+
+    def __init__(self):
+        empty = Detections.empty()
+        self._ids = empty.ids # ID треков последней детекции
+        self._cls = empty.cls # Классы треков
+        self._boxes = np.zeros((0, 4), dtype=np.float32) # Последние рамки треков (x1, y1, x2, y2)
+        self._velocity = np.zeros((0, 4), dtype=np.float32) # Сглаженные скорости треков
+        self._untracked = empty # Объекты без трека из последней детекции
+        self._frame_idx = 0 # Индекс кадра последней детекции
+
+    def update(self, detections: Detections, frame_idx: int) -> None:
+        """Обновляет модель результатами детекции на кадре frame_idx."""
+        gap = max(1, frame_idx - self._frame_idx)
+        tracked = detections.ids != -1
+        ids = detections.ids[tracked]
+        boxes = detections.xyxy[tracked].astype(np.float32)
+        velocity = np.zeros_like(boxes)
+        if len(self._ids) and len(ids):
+            # Сопоставление треков с предыдущей детекцией по ID
+            order = np.argsort(self._ids)
+            pos = np.clip(np.searchsorted(self._ids[order], ids), 0, len(order) - 1)
+            previous = order[pos]
+            found = self._ids[previous] == ids
+            measured = (boxes[found] - self._boxes[previous[found]]) / gap
+            velocity[found] = VELOCITY_SMOOTHING * measured + (1 - VELOCITY_SMOOTHING) * self._velocity[previous[found]]
+        self._ids, self._cls, self._boxes, self._velocity = ids, detections.cls[tracked], boxes, velocity
+        self._untracked = Detections(detections.xyxy[~tracked], detections.cls[~tracked], detections.ids[~tracked])
+        self._frame_idx = frame_idx
+
+    def predict(self, frame_idx: int) -> Detections:
+        """Возвращает рамки, перенесенные на кадр frame_idx по модели движения."""
+        steps = frame_idx - self._frame_idx
+        moved = np.rint(self._boxes + self._velocity * steps).astype(int)
+        return Detections(
+            np.concatenate((self._untracked.xyxy, moved)),
+            np.concatenate((self._untracked.cls, self._cls)),
+            np.concatenate((self._untracked.ids, self._ids))
+        )
+
+
+class DetectionInterval:
+    """
+    Решает, на каких кадрах запускать детектор.
+    В фиксированном режиме детекция идет каждые N кадров; в режиме "auto" N подбирается так,
+    чтобы среднее время детекции укладывалось в длительность N кадров источника.
+    """
+
+    def __init__(self, every: Union[int, str], fps: float, max_interval: int = MAX_DETECT_INTERVAL):
+        self.adaptive = every == "auto"
+        self.interval = 1 if self.adaptive else int(every)
+        self.max_interval = max(1, max_interval)
+        self.frame_period = 1.0 / fps if fps and fps > 0 else 1.0 / 30
+        self._detect_time: Optional[float] = None # Сглаженное время одной детекции (сек.)
+        self._since_detection = self.interval # Кадров с последней детекции
+
+    def should_detect(self) -> bool:
+        """Вызывается для каждого кадра; True, если на этом кадре нужна детекция."""
+        if self._since_detection >= self.interval:
+            self._since_detection = 1
+            return True
+        self._since_detection += 1
+        return False
+
+    def record(self, seconds: float) -> None:
+        """Учитывает время очередной детекции (используется в режиме "auto")."""
+        if not self.adaptive:
+            return
+        if self._detect_time is None:
+            self._detect_time = seconds
+        else:
+            self._detect_time = LOAD_SMOOTHING * seconds + (1 - LOAD_SMOOTHING) * self._detect_time
+        needed = math.ceil(self._detect_time / self.frame_period)
+        self.interval = min(self.max_interval, max(1, needed))
+
+
+class SkippingStream:
+    """
+    Источник кадров с детекцией не на каждом кадре.
+    Видео открывается один раз и декодируется с упреждением (FrameSource); на кадрах
+    с детекцией вызывается detect(frame), на пропущенных рамки переносятся BoxPropagator.
+    Выдает пары (кадр, детекции) для каждого декодированного кадра, поэтому проверка
+    пересечения перехода выполняется на каждом кадре.
+    """
+
+    def __init__(
+        self,
+        source: Any,
+        detect: Callable[[np.ndarray], Detections],
+        every: Union[int, str],
+        on_close: Optional[Callable[[], None]] = None,
+        start_frame: int = 0
+    ):
+        self.source = FrameSource(source, start_frame=start_frame)
+        self.fps: Optional[float] = self.source.fps
+        self.detect = detect
+        self.interval = DetectionInterval(every, self.fps or 30)
+        self.propagator = BoxPropagator()
+        self.on_close = on_close
+        self.detected_frames = 0 # Кадров, на которых запускался детектор
+
+    def __iter__(self) -> Generator[Tuple[np.ndarray, Detections], None, None]:
+        frame_idx = 0
+        for frame in self.source:
+            if self.interval.should_detect():
+                start = time.perf_counter()
+                detections = self.detect(frame)
+                self.interval.record(time.perf_counter() - start)
+                self.propagator.update(detections, frame_idx)
+                self.detected_frames += 1
+            else:
+                detections = self.propagator.predict(frame_idx)
+            yield frame, detections
+            frame_idx += 1
+        if frame_idx:
+            logging.info(f"Детекция выполнена на {self.detected_frames} из {frame_idx} кадров")
+
+    def close(self) -> None:
+        """Закрывает источник."""
+        self.source.close()
+        if self.on_close is not None:
+            self.on_close()
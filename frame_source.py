@@ -0,0 +1,106 @@
+import os
+import queue
+import logging
+import threading
+from typing import Any, Generator, Optional
+
+import cv2
+import numpy as np
+
+# --- Декодирование источника (переопределяется переменными окружения) ---
+PREFETCH_FRAMES = int(os.environ.get("PREFETCH_FRAMES", "8")) # Кадров, декодируемых заранее (0 - декодирование в потоке обработки)
+PREFETCH_POLL_INTERVAL = 0.1 # Период проверки остановки при ожидании места в буфере (сек.)
+
+_END = None # Признак конца источника в буфере
+
+
+class FrameSource:
+    """
+    Источник кадров видео: файл или камера открываются один раз (`cv2.VideoCapture`),
+    метаданные (fps, размер, число кадров) доступны сразу после создания.
+
+    При prefetch > 0 кадры декодируются отдельным потоком в ограниченный буфер, поэтому
+    декодирование следующих кадров идет параллельно с инференсом текущего (OpenCV и torch
+    освобождают GIL). Для файла поток ждет места в буфере, и кадры не теряются. Для камеры
+    (live) при заполненном буфере отбрасывается самый старый кадр, чтобы обработка не отставала
+    от реального времени; число таких кадров - dropped.
+    start_frame > 0 начинает чтение файла с этого кадра (сегменты в segments.py).
+    """
+
+    def __init__(self, source: Any, prefetch: int = PREFETCH_FRAMES, live: Optional[bool] = None, start_frame: int = 0):
+        self.source = source
+        self.cap = cv2.VideoCapture(source)
+        self.opened = self.cap.isOpened()
+        self.fps: Optional[float] = self.cap.get(cv2.CAP_PROP_FPS) if self.opened else None
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) if self.opened else 0
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) if self.opened else 0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) if self.opened else 0 # 0 или меньше - неизвестно (камера)
+        self.live = isinstance(source, int) if live is None else live
+        if start_frame > 0 and self.opened:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+        self.prefetch = max(0, prefetch)
+        self.dropped = 0 # Кадров камеры, отброшенных из-за отставания обработки
+        self._queue: "queue.Queue[Optional[np.ndarray]]" = queue.Queue(maxsize=max(1, self.prefetch))
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __iter__(self) -> Generator[np.ndarray, None, None]:
+        if not self.opened:
+            return
+        if self.prefetch == 0: # Без упреждения: декодирование в вызывающем потоке
+            while not self._stop.is_set():
+                ok, frame = self.cap.read()
+                if not ok:
+                    break
+                yield frame
+            return
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._decode, name="frame-decoder", daemon=True)
+            self._thread.start()
+        while True:
+            frame = self._queue.get()
+            if frame is _END:
+                break
+            yield frame
+
+    def _put(self, item: Optional[np.ndarray]) -> bool:
+        """Помещает кадр в буфер; возвращает False, если источник закрывается."""
+        if self.live and item is not _END:
+            while True:
+                try:
+                    self._queue.put_nowait(item)
+                    return True
+                except queue.Full: # Обработка не успевает: самый старый кадр заменяется новым
+                    try:
+                        self._queue.get_nowait()
+                        self.dropped += 1
+                    except queue.Empty:
+                        pass
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=PREFETCH_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _decode(self) -> None:
+        """Поток декодирования: читает кадры до конца источника или закрытия."""
+        try:
+            while not self._stop.is_set():
+                ok, frame = self.cap.read()
+                if not ok or not self._put(frame):
+                    break
+        except Exception:
+            logging.exception(f"Ошибка декодирования источника {self.source}")
+        finally:
+            self._put(_END)
+
+    def close(self) -> None:
+        """Останавливает декодирование и закрывает источник."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.cap.release()
+        if self.dropped:
+            logging.info(f"Источник {self.source}: отброшено {self.dropped} кадров камеры из-за отставания обработки")
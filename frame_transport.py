@@ -0,0 +1,197 @@
+import time
+import asyncio
+import multiprocessing
+from multiprocessing import shared_memory
+from typing import Any, Optional, Tuple
+
+# --- Параметры кольцевого буфера по умолчанию ---
+DEFAULT_SLOTS = 8 # Количество слотов кадров в кольце
+DEFAULT_SLOT_SIZE = 4 * 1024 * 1024 # Размер одного слота в байтах (с запасом для JPEG 1080p)
+FREE_SLOT_POLL_INTERVAL = 0.05 # Период проверки stop_event при ожидании свободного слота (сек.)
+
+INLINE_SLOT = -1 # Признак кадра, переданного через канал управления (не поместился в слот)
+
+
+class SharedFrameRing:
+    """
+    Транспорт кадров между процессом-воркером и обработчиком WebSocket.
+
+    Байты кадров записываются в фиксированное кольцо слотов в разделяемой памяти
+    (`multiprocessing.shared_memory`), а через канал управления (`multiprocessing.Pipe`)
+    передаются только небольшие сообщения: индекс слота, длина данных и метаданные кадра.
+    Освобожденные потребителем слоты возвращаются производителю по второму каналу.
+
+    Рассчитан на одного производителя (воркер) и одного потребителя (эндпоинт).
+    Объект создается в родительском процессе и передается в воркер через аргументы `Process`.
+    """
+
+    def __init__(self, slots: int = DEFAULT_SLOTS, slot_size: int = DEFAULT_SLOT_SIZE):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._shm = shared_memory.SharedMemory(create=True, size=slots * slot_size)
+        # Канал готовых кадров: воркер -> эндпоинт
+        self._ready_reader, self._ready_writer = multiprocessing.Pipe(duplex=False)
+        # Канал освобожденных слотов: эндпоинт -> воркер
+        self._free_reader, self._free_writer = multiprocessing.Pipe(duplex=False)
+        self._free_slots = list(range(slots)) # Свободные слоты на стороне производителя
+        self._owner = True # Только создатель удаляет сегмент разделяемой памяти
+        self._ended = False # Потребитель уже получил сигнал конца потока при вычитывании свежих кадров
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_owner'] = False
+        return state
+
+    # --- Сторона производителя (воркер) ---
+    def _acquire_slot(self, stop_event: Any = None) -> Optional[int]:
+        """Возвращает индекс свободного слота, ожидая его освобождения потребителем."""
+        while self._free_reader.poll():
+            self._free_slots.append(self._free_reader.recv())
+        while not self._free_slots:
+            if stop_event is not None and stop_event.is_set():
+                return None
+            if self._free_reader.poll(FREE_SLOT_POLL_INTERVAL):
+                self._free_slots.append(self._free_reader.recv())
+        return self._free_slots.pop()
+
+    def put(self, meta: Any, payload: Any, stop_event: Any = None) -> bool:
+        """
+        Записывает байты кадра (`bytes`, `memoryview` или массив NumPy) в свободный слот
+        и отправляет потребителю его индекс вместе с метаданными.
+        Возвращает False, если ожидание слота было прервано через stop_event.
+        """
+        view = memoryview(payload).cast('B')
+        size = view.nbytes
+        if size > self.slot_size: # Слишком большой кадр передается через канал управления
+            self._ready_writer.send((INLINE_SLOT, size, meta, view.tobytes()))
+            return True
+        slot = self._acquire_slot(stop_event)
+        if slot is None:
+            return False
+        offset = slot * self.slot_size
+        self._shm.buf[offset:offset + size] = view
+        self._ready_writer.send((slot, size, meta, None))
+        return True
+
+    def close_stream(self) -> None:
+        """Сигнализирует потребителю о завершении потока кадров."""
+        self._ready_writer.send(None)
+
+    def writable(self) -> bool:
+        """Есть ли свободный слот: put не будет ждать потребителя (для отбрасывания кадров до кодирования)."""
+        while self._free_reader.poll():
+            self._free_slots.append(self._free_reader.recv())
+        return bool(self._free_slots)
+
+    def in_flight(self) -> int:
+        """Кадров, переданных потребителю и еще не освобожденных им (глубина очереди кольца)."""
+        while self._free_reader.poll():
+            self._free_slots.append(self._free_reader.recv())
+        return self.slots - len(self._free_slots)
+
+    # --- Сторона потребителя (эндпоинт) ---
+    def _release(self, message: Tuple[int, int, Any, Optional[bytes]]) -> None:
+        """Возвращает слот сообщения производителю без чтения кадра."""
+        if message[0] != INLINE_SLOT:
+            self._free_writer.send(message[0])
+
+    def _take(self, message: Optional[Tuple[int, int, Any, Optional[bytes]]]) -> Optional[Tuple[Any, bytes]]:
+        """Копирует кадр сообщения из слота и освобождает слот."""
+        if message is None:
+            return None
+        slot, size, meta, inline = message
+        if slot == INLINE_SLOT:
+            return meta, inline
+        offset = slot * self.slot_size
+        payload = bytes(self._shm.buf[offset:offset + size])
+        self._free_writer.send(slot)
+        return meta, payload
+
+    def _read_message(self) -> Optional[Tuple[Any, bytes]]:
+        """Читает одно готовое сообщение, копирует кадр из слота и освобождает слот."""
+        return self._take(self._ready_reader.recv())
+
+    def recv(self) -> Optional[Tuple[Any, bytes]]:
+        """Блокирующее получение кадра. Возвращает (meta, bytes) или None в конце потока."""
+        return self._read_message()
+
+    def pending(self) -> bool:
+        """Есть ли в канале управления сообщения, еще не прочитанные потребителем."""
+        return self._ready_reader.poll()
+
+    def drain(self, timeout: float) -> bool:
+        """
+        Вычитывает и освобождает оставшиеся кадры до сигнала завершения потока.
+        Возвращает False, если сигнал не пришел за timeout секунд.
+        """
+        if self._ended: # Сигнал конца потока уже вычитан recv_latest_async
+            return True
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._ready_reader.poll(remaining):
+                return False
+            message = self._ready_reader.recv()
+            if message is None:
+                return True
+            self._release(message) # Кадр не нужен: слот освобождается без копирования
+
+    async def recv_async(self) -> Optional[Tuple[Any, bytes]]:
+        """
+        Неблокирующее получение кадра для цикла событий asyncio.
+        Ожидание готовности канала выполняется через `loop.add_reader`, без потоков
+        исполнителя; если цикл этого не поддерживает (Windows), используется исполнитель.
+        """
+        await self._wait_readable()
+        return self._read_message()
+
+    async def recv_latest_async(self) -> Tuple[Optional[Tuple[Any, bytes]], int]:
+        """
+        Получение самого свежего кадра (политика latest-frame-wins): ждет хотя бы одно
+        сообщение, затем вычитывает все уже готовые и возвращает последний кадр.
+        Слоты более старых кадров освобождаются без копирования.
+        Возвращает (кадр или None в конце потока, число отброшенных кадров).
+        """
+        if self._ended:
+            return None, 0
+        await self._wait_readable()
+        message = self._ready_reader.recv()
+        dropped = 0
+        while message is not None and self._ready_reader.poll():
+            newer = self._ready_reader.recv()
+            if newer is None: # Конец потока: отдаем последний кадр, а None - при следующем вызове
+                self._ended = True
+                break
+            self._release(message)
+            message = newer
+            dropped += 1
+        return self._take(message), dropped
+
+    async def _wait_readable(self) -> None:
+        """Ожидает готовности канала кадров, не блокируя цикл событий."""
+        if self._ready_reader.poll():
+            return
+        loop = asyncio.get_running_loop()
+        fd = self._ready_reader.fileno()
+        ready = loop.create_future()
+        try:
+            loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        except NotImplementedError:
+            await loop.run_in_executor(None, self._ready_reader.poll, None)
+            return
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+
+    def reset(self) -> None:
+        """Подготавливает потребителя к новой сессии в том же кольце."""
+        self._ended = False
+
+    def close(self) -> None:
+        """Закрывает каналы и отсоединяет разделяемую память (создатель также удаляет сегмент)."""
+        for conn in (self._ready_reader, self._ready_writer, self._free_reader, self._free_writer):
+            conn.close()
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
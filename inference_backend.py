@@ -0,0 +1,211 @@
+import os
+import shutil
+import hashlib
+import importlib.util
+import logging
+import tempfile
+from typing import Any, Callable, List, Tuple
+
+# --- Бэкенд инференса (переопределяется переменными окружения) ---
+MODEL_WEIGHTS = os.environ.get("MODEL_WEIGHTS", "yolo-coco/best.pt") # Исходные веса модели (PyTorch)
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "torch") # "torch", "onnx" (ONNX Runtime) или "openvino"
+INFERENCE_INT8 = os.environ.get("INFERENCE_INT8", "0") == "1" # Квантованный int8-вариант экспортированной модели
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", "0")) # Потоки внутри операции (0 - по умолчанию библиотеки)
+INFERENCE_IMGSZ = int(os.environ.get("INFERENCE_IMGSZ", "640")) # Размер входа модели (экспорт фиксирует его)
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR", "yolo-coco/exports") # Кэш экспортированных моделей
+INT8_CALIBRATION_DATA = os.environ.get("INT8_CALIBRATION_DATA", "") # data.yaml для калибровки int8 OpenVINO (пусто - набор Ultralytics по умолчанию)
+BACKENDS = ("torch", "onnx", "openvino")
+DIGEST_LENGTH = 16 # Символов SHA-256 весов в имени экспортированной модели
+BACKEND_REQUIREMENTS = "requirements-backends.txt" # Необязательные зависимости onnx и openvino
+RUNTIME_MODULES = {"onnx": ("onnxruntime",), "openvino": ("openvino",)} # Нужны для инференса
+EXPORT_MODULES = {"onnx": ("onnx", "onnxslim"), "openvino": ("openvino",)} # Нужны для экспорта
+INT8_MODULES = {"onnx": ("onnx", "onnxruntime"), "openvino": ("nncf",)} # Нужны для квантования
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS") # Размер пулов потоков OpenMP и BLAS
+
+
+def weights_digest(weights: str) -> str:
+    """SHA-256 содержимого весов: при замене best.pt экспорт выполняется заново."""
+    digest = hashlib.sha256()
+    with open(weights, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:DIGEST_LENGTH]
+
+
+def artifact_path(weights: str, backend: str, int8: bool = False, imgsz: int = INFERENCE_IMGSZ,
+                  cache_dir: str = EXPORT_CACHE_DIR) -> str:
+    """
+    Путь экспортированной модели в кэше. Имя содержит хэш весов, размер входа и признак int8;
+    каталог OpenVINO оканчивается на _openvino_model - по суффиксу Ultralytics определяет формат.
+    """
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    name = f"{stem}-{weights_digest(weights)}-{imgsz}" + ("-int8" if int8 else "")
+    if backend == "onnx":
+        return os.path.join(cache_dir, name + ".onnx")
+    return os.path.join(cache_dir, name + "_openvino_model")
+
+
+def require_modules(modules: Tuple[str, ...], purpose: str) -> None:
+    """Проверяет, что пакеты установлены; иначе ImportError со ссылкой на BACKEND_REQUIREMENTS."""
+    missing = [name for name in modules if importlib.util.find_spec(name) is None]
+    if missing:
+        raise ImportError(f"Для {purpose} не установлены пакеты {', '.join(missing)}: "
+                          f"pip install -r {BACKEND_REQUIREMENTS}")
+
+
+def quantize_onnx(source: str, target: str) -> str:
+    """
+    Динамическое int8-квантование ONNX-модели (экспорт Ultralytics в ONNX не квантует).
+    quantize_dynamic заранее квантует только веса (QUInt8); активации остаются fp32 и
+    квантуются на лету по каждому входу без калибровки, поэтому выигрыш в скорости меньше,
+    чем у статического int8 OpenVINO, а точность нужно сверять с fp32-вариантом
+    (benchmarks/backend_compare.py, сравнение onnx:int8 с onnx).
+    Метаданные Ultralytics (классы, шаг, размер входа) переносятся в квантованную модель.
+    """
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    quantize_dynamic(source, target, weight_type=QuantType.QUInt8)
+    original, quantized = onnx.load(source), onnx.load(target)
+    if not quantized.metadata_props:
+        quantized.metadata_props.extend(original.metadata_props)
+        onnx.save(quantized, target)
+    return target
+
+
+def export_model(weights: str = MODEL_WEIGHTS, backend: str = INFERENCE_BACKEND, int8: bool = INFERENCE_INT8,
+                 imgsz: int = INFERENCE_IMGSZ, cache_dir: str = EXPORT_CACHE_DIR) -> str:
+    """
+    Возвращает путь экспортированной модели, при отсутствии в кэше экспортирует ее.
+    Экспорт выполняется во временном каталоге рядом с кэшем и переносится на место через os.replace;
+    файловая блокировка не дает воркерам, запущенным одновременно, экспортировать одну модель дважды.
+    """
+    from filelock import FileLock
+    path = artifact_path(weights, backend, int8, imgsz, cache_dir)
+    if os.path.exists(path):
+        return path
+    require_modules(EXPORT_MODULES[backend] + (INT8_MODULES[backend] if int8 else ()), f"экспорта модели в {backend}")
+    os.makedirs(cache_dir, exist_ok=True)
+    with FileLock(path + ".lock"):
+        if os.path.exists(path): # Экспортировал другой процесс, пока ждали блокировку
+            return path
+        logging.info(f"Экспорт модели {weights} в {backend}{' int8' if int8 else ''} (imgsz={imgsz})")
+        from ultralytics import YOLO
+        with tempfile.TemporaryDirectory(dir=cache_dir) as tmp:
+            local = shutil.copy2(weights, tmp) # Ultralytics пишет результат рядом с весами
+            if backend == "onnx":
+                exported = YOLO(local).export(format="onnx", imgsz=imgsz, simplify=True)
+                if int8:
+                    exported = quantize_onnx(exported, os.path.join(tmp, "quantized.onnx"))
+            else:
+                options = {"data": INT8_CALIBRATION_DATA} if int8 and INT8_CALIBRATION_DATA else {}
+                exported = YOLO(local).export(format="openvino", imgsz=imgsz, int8=int8, **options)
+            os.replace(exported, path)
+    return path
+
+
+def limit_threads(threads: int) -> None:
+    """
+    Ограничивает число потоков внутри операции в torch и библиотеках OpenMP/BLAS. Переменные
+    OMP_NUM_THREADS, MKL_NUM_THREADS и OPENBLAS_NUM_THREADS задаются (если не заданы), пока пулы
+    потоков не созданы. Пред- и постобработка (letterbox, NMS) идут в torch при любом бэкенде,
+    поэтому его число потоков задается и явно. Пулы ONNX Runtime и OpenVINO ограничивает
+    limit_runtime_threads.
+    """
+    if threads <= 0:
+        return
+    for name in THREAD_ENV_VARS:
+        os.environ.setdefault(name, str(threads))
+    import torch
+    torch.set_num_threads(threads)
+
+
+def onnx_session(path: str, threads: int, providers: Any) -> Any:
+    """Сессия ONNX Runtime с threads потоками внутри операции."""
+    import onnxruntime
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1 # Граф YOLO выполняется последовательно
+    return onnxruntime.InferenceSession(path, sess_options=options, providers=providers)
+
+
+def openvino_compiled_model(path: str, threads: int, device: str = "AUTO", hint: str = "LATENCY") -> Any:
+    """Модель OpenVINO из каталога экспорта, скомпилированная с threads потоками инференса на CPU."""
+    import openvino as ov
+    xml = path if path.endswith(".xml") else next(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".xml"))
+    core = ov.Core()
+    core.set_property("CPU", {"INFERENCE_NUM_THREADS": threads}) # Действует и на устройство AUTO, выбравшее CPU
+    ov_model = core.read_model(model=xml, weights=os.path.splitext(xml)[0] + ".bin")
+    if ov_model.get_parameters()[0].get_layout().empty:
+        ov_model.get_parameters()[0].set_layout(ov.Layout("NCHW"))
+    return core.compile_model(ov_model, device_name=device, config={"PERFORMANCE_HINT": hint})
+
+
+def rebind_onnx_outputs(backend_model: Any) -> None:
+    """Привязывает выходы новой сессии к буферам AutoBackend (вариант с фиксированной формой входа)."""
+    import numpy as np
+    import torch
+    io = backend_model.session.io_binding()
+    for output, tensor in zip(backend_model.session.get_outputs(), backend_model.bindings):
+        io.bind_output(name=output.name, device_type=tensor.device.type, device_id=tensor.device.index or 0,
+                       element_type=np.float16 if tensor.dtype == torch.float16 else np.float32,
+                       shape=tuple(tensor.shape), buffer_ptr=tensor.data_ptr())
+    backend_model.io = io
+
+
+def runtime_threads_callback(backend: str, path: str, threads: int) -> Callable[[Any], None]:
+    """
+    Обработчик on_predict_start Ultralytics: один раз заменяет сессию ONNX Runtime или модель
+    OpenVINO, созданную AutoBackend без параметров потоков, на такую же с threads потоками.
+    """
+    bound: List[Any] = [] # AutoBackend, в котором рантайм уже заменен
+
+    def on_predict_start(predictor: Any) -> None:
+        backend_model = predictor.model
+        if bound and bound[0] is backend_model:
+            return
+        if backend == "onnx":
+            backend_model.session = onnx_session(path, threads, backend_model.session.get_providers())
+            if getattr(backend_model, "io", None) is not None:
+                rebind_onnx_outputs(backend_model)
+        else:
+            backend_model.ov_compiled_model = openvino_compiled_model(
+                path, threads, getattr(backend_model, "device_name", "AUTO"), getattr(backend_model, "inference_mode", "LATENCY"))
+        bound[:] = [backend_model]
+        logging.info(f"Рантайм {backend}: {threads} потоков внутри операции")
+    return on_predict_start
+
+
+def limit_runtime_threads(model: Any, backend: str, path: str, threads: int) -> None:
+    """
+    Ограничивает пулы потоков ONNX Runtime (SessionOptions.intra_op_num_threads) и OpenVINO
+    (INFERENCE_NUM_THREADS). Ultralytics создает сессию при первом вызове predict/track и не
+    передает в нее параметры потоков, поэтому рантайм заменяется в обработчике on_predict_start
+    (model.add_callback) до первого прохода по кадрам; прогрев выполняется исходной сессией.
+    """
+    if threads <= 0 or backend == "torch":
+        return
+    model.add_callback("on_predict_start", runtime_threads_callback(backend, path, threads))
+
+
+def load_model(weights: str = MODEL_WEIGHTS, backend: str = INFERENCE_BACKEND, int8: bool = INFERENCE_INT8,
+               threads: int = INFERENCE_THREADS, imgsz: int = INFERENCE_IMGSZ, cache_dir: str = EXPORT_CACHE_DIR) -> Any:
+    """
+    Загружает модель YOLO на выбранном бэкенде. Экспортированная модель открывается через
+    ultralytics.YOLO, поэтому track (BoT-SORT, persist=True), predict и формат результатов
+    (boxes.xyxy, cls, id) не зависят от бэкенда.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Неизвестный бэкенд инференса {backend!r}, допустимы: {', '.join(BACKENDS)}")
+    if backend != "torch":
+        require_modules(RUNTIME_MODULES[backend], f"бэкенда инференса {backend}")
+    limit_threads(threads) # До импорта Ultralytics и рантаймов
+    from ultralytics import YOLO
+    if backend == "torch":
+        if int8:
+            logging.warning("int8 поддерживается только для onnx и openvino, загружается исходная модель")
+        return YOLO(weights)
+    path = export_model(weights, backend, int8, imgsz, cache_dir)
+    logging.info(f"Модель загружается из {path}")
+    model = YOLO(path, task="detect")
+    limit_runtime_threads(model, backend, path, threads)
+    return model
@@ -0,0 +1,181 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from frame_source import FrameSource
+from inference_backend import INFERENCE_IMGSZ
+
+# --- Конфигурация пакетного инференса (переопределяется переменными окружения) ---
+INFERENCE_MAX_BATCH_SIZE = int(os.environ.get("INFERENCE_MAX_BATCH_SIZE", "8")) # Максимум кадров в одном прямом проходе
+INFERENCE_MAX_WAIT = float(os.environ.get("INFERENCE_MAX_WAIT", "0.02")) # Максимальное ожидание добора пакета (сек.)
+TRACKER_CONFIG = "botsort.yaml" # Конфигурация трекера, как в model.track
+STOP_POLL_INTERVAL = 0.1 # Период проверки флага остановки сервиса (сек.)
+
+
+def load_tracker_config(tracker: str = TRACKER_CONFIG) -> Any:
+    """Загружает конфигурацию трекера Ultralytics (поиск файла как в model.track)."""
+    import yaml
+    from ultralytics.utils import IterableSimpleNamespace
+    from ultralytics.utils.checks import check_yaml
+    with open(check_yaml(tracker), encoding="utf-8") as f:
+        return IterableSimpleNamespace(**yaml.safe_load(f))
+
+
+def create_tracker(cfg: Any, frame_rate: int = 30) -> Any:
+    """Создает отдельный экземпляр трекера (BoT-SORT или ByteTrack) для одного потока."""
+    from ultralytics.trackers.bot_sort import BOTSORT
+    from ultralytics.trackers.byte_tracker import BYTETracker
+    tracker_cls = BOTSORT if cfg.tracker_type == "botsort" else BYTETracker
+    return tracker_cls(args=cfg, frame_rate=frame_rate)
+
+
+def apply_tracker(tracker: Any, result: Any) -> Any:
+    """
+    Обновляет трекер детекциями кадра и возвращает результат с ID треков,
+    повторяя обработку Ultralytics после model.track (on_predict_postprocess_end).
+    """
+    import torch
+    det = result.boxes.cpu().numpy()
+    tracks = tracker.update(det, result.orig_img, getattr(result, "feats", None))
+    if len(tracks) == 0: # Треков нет: как и в model.track, остаются детекции без ID
+        return result
+    idx = tracks[:, -1].astype(int)
+    tracked = result[idx]
+    tracked.update(boxes=torch.as_tensor(tracks[:, :-1]))
+    return tracked
+
+
+class BatchedInferenceService:
+    """
+    Сервис пакетного инференса для нескольких потоков одного процесса.
+
+    Сессии `process_video` передают кадры через `track(stream_id, frame)`; фоновый поток
+    собирает кадры всех активных потоков в пакет (не более max_batch_size кадров и не дольше
+    max_wait секунд ожидания) и выполняет один прямой проход модели. Трекер BoT-SORT
+    у каждого потока свой, результаты возвращаются вызвавшему потоку через Future.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        max_batch_size: int = INFERENCE_MAX_BATCH_SIZE,
+        max_wait: float = INFERENCE_MAX_WAIT,
+        tracker: str = TRACKER_CONFIG
+    ):
+        self.model = model
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._tracker_cfg = load_tracker_config(tracker)
+        self._trackers: Dict[Any, Any] = {} # Трекеры по идентификатору потока
+        self._requests: "queue.Queue[Tuple[Any, np.ndarray, Future]]" = queue.Queue()
+        self._closed = threading.Event()
+        self._submit_lock = threading.Lock() # Постановка кадра и остановка сервиса не пересекаются
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Запускает поток пакетного инференса."""
+        self._thread = threading.Thread(target=self._run, name="batched-inference", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Останавливает поток инференса. Кадры, оставшиеся в очереди, завершаются ошибкой
+        RuntimeError, чтобы ожидающие результата потоки не зависли при остановке.
+        """
+        with self._submit_lock:
+            self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        error = RuntimeError("Сервис пакетного инференса остановлен")
+        while True:
+            try:
+                _, _, future = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if not future.done():
+                future.set_exception(error)
+
+    def open_stream(self, stream_id: Any, frame_rate: int = 30) -> None:
+        """Регистрирует поток с новым трекером (состояние предыдущих сессий не переносится)."""
+        self._trackers[stream_id] = create_tracker(self._tracker_cfg, frame_rate)
+
+    def close_stream(self, stream_id: Any) -> None:
+        """Удаляет трекер завершившегося потока."""
+        self._trackers.pop(stream_id, None)
+
+    def track(self, stream_id: Any, frame: np.ndarray) -> Any:
+        """Отправляет кадр в очередь пакетного инференса и ждет результат с ID треков."""
+        future: Future = Future()
+        with self._submit_lock:
+            if self._closed.is_set():
+                raise RuntimeError("Сервис пакетного инференса остановлен")
+            self._requests.put((stream_id, frame, future))
+        return future.result()
+
+    def _collect_batch(self) -> List[Tuple[Any, np.ndarray, Future]]:
+        """Ждет первый кадр, затем добирает пакет до max_batch_size или до истечения max_wait."""
+        try:
+            batch = [self._requests.get(timeout=STOP_POLL_INTERVAL)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        """Основной цикл: сбор пакета, прямой проход модели и трекинг по потокам."""
+        while not self._closed.is_set():
+            batch = self._collect_batch()
+            if not batch:
+                continue
+            try:
+                results = self.model.predict([frame for _, frame, _ in batch], imgsz=INFERENCE_IMGSZ, verbose=False)
+            except Exception as e:
+                logging.exception("Ошибка пакетного инференса")
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            # Кадры одного потока в пакете не пересекаются: поток ждет результат перед следующим кадром
+            for (stream_id, _, future), result in zip(batch, results):
+                try:
+                    tracker = self._trackers.get(stream_id)
+                    future.set_result(apply_tracker(tracker, result) if tracker is not None else result)
+                except Exception as e:
+                    future.set_exception(e)
+
+
+class BatchedStream:
+    """
+    Источник результатов трекинга одного потока через BatchedInferenceService
+    вместо собственного вызова model.track. Видео открывается один раз и декодируется
+    с упреждением (FrameSource), FPS источника доступен до начала итерации.
+    """
+
+    def __init__(self, service: BatchedInferenceService, stream_id: Any, source: Any, start_frame: int = 0):
+        self.service = service
+        self.stream_id = stream_id
+        self.source = FrameSource(source, start_frame=start_frame)
+        self.fps: Optional[float] = self.source.fps
+        service.open_stream(stream_id, frame_rate=int(round(self.fps)) if self.fps and self.fps > 0 else 30)
+
+    def __iter__(self):
+        for frame in self.source:
+            yield self.service.track(self.stream_id, frame)
+
+    def close(self) -> None:
+        """Закрывает источник и удаляет трекер потока."""
+        self.source.close()
+        self.service.close_stream(self.stream_id)
@@ -0,0 +1,403 @@
+import os
+import time
+import uuid
+import queue
+import logging
+import datetime
+import threading
+import multiprocessing
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import cv2
+
+from worker_pool import WORKER_START_METHOD
+from segments import SEGMENT_WORKERS, process_video_segments
+from result_cache import result_cache
+
+# --- Конфигурация фоновых заданий (переопределяется переменными окружения) ---
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", "1")) # Одновременно выполняемых заданий (процессов)
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "100")) # Предел очереди ожидающих заданий
+JOB_HISTORY_LIMIT = int(os.environ.get("JOB_HISTORY_LIMIT", "1000")) # Сколько завершенных заданий хранить
+JOB_PROGRESS_INTERVAL = 1.0 # Период отправки прогресса из процесса задания (сек.)
+OUTPUT_DIR = "output" # Директория обработанных видео (туда же возвращается видео из кэша)
+
+# Состояния задания
+QUEUED, RUNNING, COMPLETED, CANCELLED, FAILED = "queued", "running", "completed", "cancelled", "failed"
+FINISHED_STATES = (COMPLETED, CANCELLED, FAILED)
+
+
+class JobQueueFull(Exception):
+    """Очередь заданий заполнена."""
+
+
+def cached_result(video_path: str, options: Dict[str, Any], compute: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Итог задания из кэша результатов (result_cache), если файл с тем же содержимым уже обработан
+    при тех же параметрах конвейера; для save_output обработанное видео возвращается в output/.
+    compute - вычислить SHA-256 файла, если он не записан при загрузке.
+    """
+    save_output = bool(options.get("save_output", False))
+    entry = result_cache.find(video_path, options.get("detect_every", 1), need_video=save_output, compute=compute)
+    if entry is None:
+        return None
+    return {
+        **entry["result"],
+        "fps": 0.0,
+        "duration": 0.0,
+        "output_path": result_cache.restore_outputs(entry, OUTPUT_DIR) if save_output else None,
+        "cached": True,
+        "cache_key": entry["key"]
+    }
+
+
+def run_job(conn, video_path: str, options: Dict[str, Any], stop_event) -> None:
+    """
+    Выполняет одно задание в процессе воркера: process_video без отрисовки, кодирования
+    и передачи кадров. Прогресс отправляется в conn не чаще JOB_PROGRESS_INTERVAL,
+    по завершении отправляются итоговые счетчики. Если результат уже есть в кэше (например,
+    тот же файл обработало задание, ожидавшее в очереди раньше), он возвращается сразу;
+    иначе результат обработки сохраняется в кэш. Ошибка посреди файла передается в job_worker,
+    и задание завершается со статусом failed, а не completed со счетчиками по части кадров.
+    """
+    from yolo8_video import process_video
+    result = cached_result(video_path, options, compute=True)
+    if result is not None:
+        send_result(conn, result, stop_event)
+        return
+    save_output = bool(options.get("save_output", False))
+    segment_workers = int(options.get("segments") or SEGMENT_WORKERS)
+    if segment_workers > 1 and save_output:
+        logging.warning("Видео с разметкой сохраняется только при последовательной обработке, сегменты не используются")
+    elif segment_workers > 1:
+        run_segmented_job(conn, video_path, options, stop_event, segment_workers)
+        return
+    recorder = result_cache.recorder(video_path, options.get("detect_every", 1), compute=True)
+    cap = cv2.VideoCapture(video_path)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) if cap.isOpened() else 0
+    cap.release()
+    frames = 0
+    frame_data: Dict[str, Any] = {}
+    started = time.perf_counter()
+    last_report = started
+    for frame_data in process_video(
+        video_path,
+        save_output=save_output,
+        draw=save_output, # Рамки рисуются только для сохраняемого видео
+        stop_event=stop_event,
+        detect_every=options.get("detect_every", 1),
+        recorder=recorder,
+        raise_errors=True # Сбой посреди файла - ошибка задания, а не итог по части кадров
+    ):
+        frames += 1
+        now = time.perf_counter()
+        if now - last_report >= JOB_PROGRESS_INTERVAL:
+            conn.send(("progress", {"frames_processed": frames, "total_frames": total_frames, "fps": frames / (now - started)}))
+            last_report = now
+    elapsed = time.perf_counter() - started
+    result = {
+        "frames_processed": frames,
+        "total_frames": total_frames,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "duration": elapsed,
+        "total_crossings": frame_data.get("total_crossings", 0),
+        "red_light_violations": frame_data.get("red_light_violations", 0),
+        "output_path": frame_data.get("output_path"),
+        "cached": False,
+        "cache_key": recorder.key if recorder is not None and recorder.committed else None
+    }
+    send_result(conn, result, stop_event)
+
+
+def run_segmented_job(conn, video_path: str, options: Dict[str, Any], stop_event, workers: int) -> None:
+    """Выполняет задание параллельно по сегментам файла (segments.py) в workers процессах."""
+    def on_progress(frames: int, total_frames: int) -> None:
+        elapsed = time.perf_counter() - started
+        conn.send(("progress", {"frames_processed": frames, "total_frames": total_frames, "fps": frames / elapsed if elapsed > 0 else 0.0}))
+
+    started = time.perf_counter()
+    # Кадры в процессах сегментов в кэш не пишутся: сохраняются счетчики и нарушения после сшивки
+    recorder = result_cache.recorder(video_path, options.get("detect_every", 1), compute=True, frames=False)
+    try:
+        result = process_video_segments(
+            video_path,
+            workers,
+            detect_every=options.get("detect_every", 1),
+            stop_event=stop_event,
+            on_progress=on_progress,
+            recorder=recorder
+        )
+    finally:
+        if recorder is not None:
+            recorder.finish(False) # Ошибка сегмента: временная запись удаляется (после finish ничего не делает)
+    result.update(cached=False, cache_key=recorder.key if recorder is not None and recorder.committed else None)
+    send_result(conn, result, stop_event)
+
+
+def send_result(conn, result: Dict[str, Any], stop_event) -> None:
+    """Отправляет итог задания: отменено, ошибка чтения видео или выполнено."""
+    if stop_event.is_set():
+        conn.send(("cancelled", result))
+    elif result["frames_processed"] == 0:
+        conn.send(("failed", {"error": "Не удалось прочитать кадры видео", **result}))
+    else:
+        conn.send(("completed", result))
+
+
+def job_worker(conn, stop_event) -> None:
+    """
+    Основной цикл процесса заданий: модель загружается один раз, затем процесс
+    выполняет задания (video_path, options), получаемые по conn. None завершает процесс.
+    """
+    import yolo8_video # noqa: F401 Загрузка модели один раз на весь срок жизни процесса
+    while True:
+        command = conn.recv()
+        if command is None:
+            break
+        video_path, options = command
+        try:
+            run_job(conn, video_path, options, stop_event)
+        except Exception as e:
+            logging.exception("Ошибка выполнения задания")
+            conn.send(("failed", {"error": str(e)}))
+
+
+class Job:
+    """Задание пакетной обработки одного видеофайла и его состояние."""
+
+    def __init__(self, video_path: str, options: Dict[str, Any]):
+        self.id = str(uuid.uuid4())
+        self.video_path = video_path
+        self.options = options
+        self.status = QUEUED
+        self.created_at = datetime.datetime.now()
+        self.started_at: Optional[datetime.datetime] = None
+        self.finished_at: Optional[datetime.datetime] = None
+        self.frames_processed = 0
+        self.total_frames = 0
+        self.fps = 0.0 # Скорость обработки (кадров в секунду)
+        self.result: Optional[Dict[str, Any]] = None # Итоговые счетчики
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        progress = self.frames_processed / self.total_frames if self.total_frames else None
+        if self.status == COMPLETED:
+            progress = 1.0
+        return {
+            "id": self.id,
+            "video_path": self.video_path,
+            "options": self.options,
+            "status": self.status,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "frames_processed": self.frames_processed,
+            "total_frames": self.total_frames,
+            "progress": min(progress, 1.0) if progress is not None else None,
+            "fps": round(self.fps, 2),
+            "result": self.result,
+            "error": self.error
+        }
+
+
+class JobSlot:
+    """
+    Исполнитель заданий: поток в процессе API и долгоживущий процесс с моделью.
+    Процесс запускается при первом задании и перезапускается, если завершился. Процесс не
+    демонический: задание по сегментам запускает в нем пул процессов, а демоническому процессу
+    дочерние процессы создавать нельзя. Поэтому процессы останавливает JobManager.shutdown.
+    """
+
+    def __init__(self, manager: "JobManager", index: int):
+        self.manager = manager
+        self.index = index
+        self.stop_event = manager._ctx.Event() # Отмена текущего задания
+        self.conn: Any = None
+        self.process: Any = None
+        self.job: Optional[Job] = None
+        self.thread = threading.Thread(target=self._run, name=f"job-slot-{index}", daemon=True)
+
+    def _ensure_process(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            return
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = self.manager._ctx.Process(target=job_worker, args=(child_conn, self.stop_event), daemon=False)
+        self.process.start()
+        child_conn.close()
+
+    def _run(self) -> None:
+        while True:
+            job = self.manager._queue.get()
+            if job is None:
+                break
+            with self.manager._lock:
+                if job.status != QUEUED: # Отменено, пока ждало в очереди
+                    continue
+                self.stop_event.clear() # До публикации задания: отмена сразу после нее не теряется
+                job.status = RUNNING
+                job.started_at = datetime.datetime.now()
+                self.job = job
+            try:
+                self._ensure_process()
+                self.conn.send((job.video_path, job.options))
+                self._wait(job)
+            except (EOFError, OSError) as e:
+                logging.error(f"Процесс заданий завершился во время задания {job.id}: {e}")
+                self._finish(job, FAILED, {"error": "Процесс обработки завершился аварийно"})
+                self.terminate()
+            with self.manager._lock:
+                self.job = None
+
+    def _wait(self, job: Job) -> None:
+        """Принимает сообщения о прогрессе задания до его завершения."""
+        while True:
+            event, payload = self.conn.recv()
+            if event == "progress":
+                with self.manager._lock:
+                    job.frames_processed = payload["frames_processed"]
+                    job.total_frames = payload["total_frames"]
+                    job.fps = payload["fps"]
+                continue
+            self._finish(job, event, payload)
+            return
+
+    def _finish(self, job: Job, status: str, payload: Dict[str, Any]) -> None:
+        with self.manager._lock:
+            job.status = status
+            job.finished_at = datetime.datetime.now()
+            job.error = payload.pop("error", None)
+            if "frames_processed" in payload:
+                job.frames_processed = payload["frames_processed"]
+                job.total_frames = payload["total_frames"]
+                job.fps = payload["fps"]
+                job.result = payload
+        logging.info(f"Задание {job.id} ({job.video_path}): {status}")
+
+    def terminate(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+        self.process = None
+
+
+class JobManager:
+    """
+    Очередь заданий пакетной (headless) обработки видео.
+    Задания ставятся в ограниченную очередь (max_queue) и выполняются не более чем
+    concurrency штук одновременно, каждое в отдельном процессе с загруженной моделью.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = JOB_CONCURRENCY,
+        max_queue: int = JOB_QUEUE_SIZE,
+        history_limit: int = JOB_HISTORY_LIMIT,
+        start_method: str = WORKER_START_METHOD
+    ):
+        self.history_limit = history_limit
+        self._ctx = multiprocessing.get_context(start_method)
+        self._queue: "queue.Queue[Optional[Job]]" = queue.Queue(maxsize=max(1, max_queue))
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict() # Задания в порядке поступления
+        self._lock = threading.Lock()
+        self._slots = [JobSlot(self, i) for i in range(max(1, concurrency))]
+
+    def start(self) -> None:
+        """Запускает исполнителей заданий (процессы создаются при первом задании)."""
+        for slot in self._slots:
+            slot.thread.start()
+
+    def submit(self, video_path: str, options: Optional[Dict[str, Any]] = None) -> Job:
+        """Ставит задание в очередь; выбрасывает JobQueueFull, если очередь заполнена."""
+        job = Job(video_path, options or {})
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise JobQueueFull(f"В очереди уже {self._queue.maxsize} заданий")
+            self._jobs[job.id] = job
+            self._trim_history()
+        return job
+
+    def complete(self, video_path: str, options: Dict[str, Any], result: Dict[str, Any]) -> Job:
+        """Добавляет задание, сразу выполненное без очереди (результат из кэша результатов)."""
+        job = Job(video_path, options)
+        job.status = COMPLETED
+        job.started_at = job.finished_at = datetime.datetime.now()
+        job.frames_processed = result["frames_processed"]
+        job.total_frames = result["total_frames"]
+        job.result = result
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim_history()
+        logging.info(f"Задание {job.id} ({video_path}): результат из кэша {result.get('cache_key')}")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, status: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Состояния заданий, новые первыми."""
+        with self._lock:
+            return [job.to_dict() for job in reversed(self._jobs.values()) if status is None or job.status == status]
+
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job is not None else None
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        Отменяет задание: ожидающее сразу помечается отмененным, выполняющемуся
+        посылается сигнал остановки (статус обновится, когда процесс завершит обработку).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job.status == QUEUED:
+                job.status = CANCELLED
+                job.finished_at = datetime.datetime.now()
+            elif job.status == RUNNING:
+                slot = next((s for s in self._slots if s.job is job), None)
+                if slot is not None:
+                    slot.stop_event.set()
+            return job
+
+    def _trim_history(self) -> None:
+        """Удаляет самые старые завершенные задания сверх history_limit."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.status in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.history_limit)]:
+            del self._jobs[job_id]
+
+    def shutdown(self) -> None:
+        """
+        Отменяет ожидающие и выполняющиеся задания, останавливает процессы и потоки исполнителей:
+        каждый поток получает из очереди None.
+        """
+        while True: # Очередь ограничена: освобождается место для None
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            with self._lock:
+                if job is not None and job.status == QUEUED:
+                    job.status = CANCELLED
+                    job.finished_at = datetime.datetime.now()
+        for slot in self._slots:
+            if slot.thread.is_alive():
+                self._queue.put(None)
+            slot.stop_event.set()
+            if slot.conn is not None:
+                try:
+                    slot.conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for slot in self._slots:
+            if slot.process is not None:
+                slot.process.join(timeout=5)
+            slot.terminate()
+        for slot in self._slots:
+            if slot.thread.is_alive():
+                slot.thread.join(timeout=5)
+        logging.info("Обработка заданий остановлена")
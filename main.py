@@ -1,35 +1,85 @@
 import os
+import json
+import time
 import uuid
+import hashlib
 import cv2
 import asyncio
 import logging
 import numpy as np
-import multiprocessing
-from contextlib import contextmanager
-from typing import Any, Dict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, BinaryIO, Dict, List, Optional, Tuple, Union
 
-from fastapi import FastAPI, UploadFile, File, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, UploadFile, File, Form, WebSocket, WebSocketDisconnect, Query, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse, StreamingResponse, Response
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 
 from models import Violation
-from db import SessionLocal
+from db import SessionLocal, run_db, shutdown_db
+from worker_pool import WorkerPool
+from jobs import JobManager, JobQueueFull, cached_result
+from result_cache import result_cache
+from stream_control import ConnectionStats
+from stream_hub import StreamHub, Subscriber
+from metrics import CONTENT_TYPE, METRICS_ENABLED, render_metrics
+from violation_feed import SUMMARY_DIMENSIONS, ViolationFeed, violation_to_dict
+from wire_protocol import DELTA_PROTOCOL, DELTA_VERSION, METADATA_PROTOCOL, DeltaEncoder, negotiate_protocol
+
+# --- Пул процессов обработки видео ---
+worker_pool = WorkerPool() # Воркеры с заранее загруженной моделью (размер задается WORKER_POOL_SIZE)
+stream_hub = StreamHub(worker_pool) # Один конвейер обработки на источник, кадры раздаются всем зрителям
+job_manager = JobManager() # Очередь фоновых заданий (параллельность задается JOB_CONCURRENCY)
+violation_feed = ViolationFeed() # Лента новых нарушений и сводки (один опрос БД на все панели)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Запускает пул воркеров, обработку заданий и ленту нарушений при старте приложения и останавливает при завершении."""
+    worker_pool.start()
+    job_manager.start()
+    violation_feed.start()
+    yield
+    await violation_feed.stop()
+    job_manager.shutdown()
+    worker_pool.shutdown()
+    shutdown_db()
 
 # --- Настройка приложения FastAPI ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Разрешить все источники
     allow_credentials=True, # Разрешить учетные данные
     allow_methods=["*"],  # Разрешить все методы
     allow_headers=["*"],  # Разрешить все заголовки
+    expose_headers=["X-Next-Cursor", "Content-Range", "Accept-Ranges", "ETag"], # Заголовки, доступные клиенту
 )
 
 UPLOAD_DIR = "uploaded_videos"  # Директория для загруженных видео
 os.makedirs(UPLOAD_DIR, exist_ok=True) # Создать директорию, если она не существует
+OUTPUT_DIR = "output" # Директория обработанных видео
+MAX_UPLOAD_SIZE = int(os.environ.get("MAX_UPLOAD_SIZE", str(8 * 1024 ** 3))) # Максимальный размер загружаемого файла (байт)
+UPLOAD_CHUNK_SIZE = 1024 * 1024 # Размер блока при записи загружаемого файла на диск
+
+# --- Выдача списка нарушений ---
+VIOLATIONS_PAGE_SIZE = int(os.environ.get("VIOLATIONS_PAGE_SIZE", "100")) # Размер страницы /violations по умолчанию
+VIOLATIONS_MAX_PAGE_SIZE = int(os.environ.get("VIOLATIONS_MAX_PAGE_SIZE", "1000")) # Максимальный размер страницы
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", "1000")) # Строк в одном запросе к БД при выгрузке
+VIOLATION_STREAM_KEEPALIVE = 15.0 # Период комментария-keepalive в /violations/stream без новых нарушений (сек.)
 
 # --- Состояние многопроцессорной обработки ---
-processes: Dict[int, Any] = {} # Словарь для хранения активных процессов обработки видео
+processes: Dict[int, Subscriber] = {} # Подписки активных WebSocket-соединений на источники
+connections: Dict[int, Tuple[ConnectionStats, Subscriber]] = {} # Статистика активных соединений
+
+class JobRequest(BaseModel):
+    """Параметры задания пакетной обработки видеофайла."""
+    file_path: str # Путь к видеофайлу на сервере (из ответа /process_video_file)
+    save_output: bool = False # Сохранить обработанное видео с разметкой
+    detect_every: Union[int, str] = 1 # Детекция каждые N кадров или "auto"
+    segments: Optional[int] = None # Процессов для параллельной обработки сегментов (None - SEGMENT_WORKERS)
 
 # --- Вспомогательные функции ---
 def get_file_path(directory: str, filename: str) -> str:
@@ -50,6 +100,125 @@ def to_python_type(obj: Any) -> Any:
         return obj.tolist()
     return obj
 
+def save_upload(source: BinaryIO, file_path: str, expected_sha256: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Копирует загружаемый файл на диск блоками по UPLOAD_CHUNK_SIZE, считая размер и SHA-256.
+    Файл пишется во временный `.part` и переименовывается только после успешной проверки,
+    поэтому обработка никогда не видит недописанный файл. При превышении MAX_UPLOAD_SIZE
+    или несовпадении контрольной суммы частичный файл удаляется и выбрасывается HTTPException.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    part_path = file_path + ".part"
+    try:
+        with open(part_path, "wb") as f:
+            while True:
+                chunk = source.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_SIZE:
+                    raise HTTPException(status_code=413, detail=f"Файл больше {MAX_UPLOAD_SIZE} байт")
+                digest.update(chunk)
+                f.write(chunk)
+        sha256 = digest.hexdigest()
+        if expected_sha256 and expected_sha256.strip().lower() != sha256:
+            raise HTTPException(status_code=400, detail="Контрольная сумма SHA-256 не совпадает")
+        os.replace(part_path, file_path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+    return {"size": size, "sha256": sha256}
+
+def register_upload(file_path: str, sha256: str) -> Optional[str]:
+    """
+    Запоминает SHA-256 загруженного файла для кэша результатов (воркерам не нужно читать файл
+    повторно) и возвращает ключ уже сохраненных результатов этого содержимого или None.
+    """
+    result_cache.register_source(file_path, sha256)
+    entry = result_cache.find(file_path)
+    return entry["key"] if entry is not None else None
+
+def uploaded_video_url(video_path: Any) -> Optional[str]:
+    """URL файла для воспроизведения клиентом (/uploaded_videos), если файл лежит в UPLOAD_DIR, иначе None."""
+    if isinstance(video_path, int):
+        return None
+    path = os.path.realpath(video_path)
+    if os.path.dirname(path) != os.path.realpath(UPLOAD_DIR): # Эндпоинт отдает только файлы UPLOAD_DIR
+        return None
+    return f"/uploaded_videos/{os.path.basename(path)}"
+
+def select_protocol(requested: Any, video_path: Any) -> Tuple[str, Optional[str]]:
+    """
+    Протокол /ws/video_feed для источника и video_url для протокола metadata. Файл клиент
+    воспроизводит сам, только если он доступен по /uploaded_videos; для других файлов
+    (например, videos/*.mp4) выбирается следующий протокол клиента с кадрами сервера.
+    """
+    protocol = negotiate_protocol(requested)
+    if protocol != METADATA_PROTOCOL or isinstance(video_path, int): # Камера: кадры без разметки идут в потоке
+        return protocol, None
+    video_url = uploaded_video_url(video_path)
+    if video_url is None:
+        return negotiate_protocol(requested, unavailable=(METADATA_PROTOCOL,)), None
+    return protocol, video_url
+
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Проверяет условные заголовки If-None-Match / If-Modified-Since запроса."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None: # If-None-Match имеет приоритет над If-Modified-Since
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def video_file_response(request: Request, file_path: str, filename: str, media_type: str) -> Response:
+    """
+    Отдает видеофайл с поддержкой перемотки: ETag и Last-Modified, ответ 304 на условные
+    запросы, частичные ответы 206 на заголовок Range (и If-Range) средствами FileResponse.
+    """
+    if not os.path.isfile(file_path):
+        raise HTTPException(status_code=404, detail="Файл не найден")
+    stat_result = os.stat(file_path)
+    response = FileResponse(path=file_path, filename=filename, media_type=media_type, stat_result=stat_result)
+    if is_not_modified(request, response.headers["etag"], stat_result.st_mtime):
+        headers = {name: response.headers[name] for name in ("etag", "last-modified")}
+        return Response(status_code=304, headers=headers)
+    return response
+
+def violations_query(
+    session: Any,
+    before_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    original_video_path: Optional[str] = None,
+    processed_video_path: Optional[str] = None,
+    vehicle_id: Optional[str] = None
+) -> Any:
+    """
+    Запрос нарушений с фильтрами, упорядоченный по убыванию id.
+    before_id — курсор пагинации по ключу: выбираются записи с id меньше указанного.
+    """
+    query = session.query(Violation)
+    if before_id is not None:
+        query = query.filter(Violation.id < before_id)
+    if since is not None:
+        query = query.filter(Violation.timestamp >= since)
+    if until is not None:
+        query = query.filter(Violation.timestamp < until)
+    if original_video_path is not None:
+        query = query.filter(Violation.original_video_path == original_video_path)
+    if processed_video_path is not None:
+        query = query.filter(Violation.processed_video_path == processed_video_path)
+    if vehicle_id is not None:
+        query = query.filter(Violation.vehicle_id == vehicle_id)
+    return query.order_by(Violation.id.desc())
+
 @contextmanager
 def get_session():
     """Контекстный менеджер для получения сессии базы данных."""
@@ -59,43 +228,41 @@ def get_session():
     finally:
         session.close()
 
-# --- Воркер для обработки видео/камеры в отдельном процессе ---
-def camera_worker(video_path, queue, stop_event):
+def fetch_violations(limit: int, *filters: Any) -> List[Dict[str, Any]]:
     """
-    Обрабатывает кадры видео/камеры и отправляет результаты через очередь (queue)
-    до тех пор, пока не будет установлено событие остановки (stop_event).
+    Читает до limit нарушений (аргументы фильтров - как у violations_query) в виде словарей.
+    Выполняется в пуле потоков БД (run_db), сессия закрывается до возврата в цикл событий.
     """
-    from yolo8_video import process_video # Импорт внутри функции для корректной работы multiprocessing
-    for frame_data, frame in process_video(video_path, return_frame=True, stop_event=stop_event):
-        if stop_event.is_set(): # Проверка флага остановки
-            break
-        ret, jpeg = cv2.imencode('.jpg', frame) # Кодирование кадра в JPEG
-        if not ret:
-            continue
-        queue.put((frame_data, jpeg.tobytes())) # Отправка данных кадра и байтов JPEG в очередь
-    queue.put(None)  # Сигнал о завершении обработки
+    with get_session() as session:
+        return [violation_to_dict(v) for v in violations_query(session, *filters).limit(limit).all()]
 
 # --- Эндпоинты API ---
 @app.post("/process_video_file")
-async def upload_video(file: UploadFile = File(...)):
-    """Загружает видеофайл и возвращает путь к нему на сервере."""
+async def upload_video(file: UploadFile = File(...), sha256: Optional[str] = Form(None)):
+    """
+    Загружает видеофайл и возвращает путь к нему на сервере.
+    Файл записывается на диск блоками в отдельном потоке; если передан sha256,
+    содержимое проверяется по нему. cache_key - ключ результатов обработки того же
+    содержимого, если они уже есть в кэше (повторная загрузка), иначе null.
+    """
     file_id = str(uuid.uuid4()) # Генерация уникального ID для файла
-    file_path = get_file_path(UPLOAD_DIR, f"{file_id}_{file.filename}")
-    with open(file_path, "wb") as f:
-        f.write(await file.read()) # Сохранение файла на диск
-    return {"file_id": file_id, "file_path": file_path}
+    file_path = get_file_path(UPLOAD_DIR, f"{file_id}_{os.path.basename(file.filename or 'video')}")
+    info = await run_in_threadpool(save_upload, file.file, file_path, sha256) # Сохранение файла на диск
+    cache_key = await run_in_threadpool(register_upload, file_path, info["sha256"])
+    return {"file_id": file_id, "file_path": file_path, **info, "cache_key": cache_key}
 
 @app.websocket("/ws/video_feed")
 async def video_feed(websocket: WebSocket):
     """
-    Осуществляет потоковую передачу обработанных видеокадров через WebSocket,
-    используя отдельный процесс для обработки видео/камеры.
+    Осуществляет потоковую передачу обработанных видеокадров через WebSocket.
+    Соединения с одним источником подписываются на общий конвейер обработки (stream_hub),
+    который выполняется в слоте пула процессов обработки видео/камеры.
+    При протоколе metadata клиент рисует рамки сам: для файла передаются только метаданные
+    (видео клиент воспроизводит по video_url), для камеры - еще и редкие кадры без разметки.
     """
     await websocket.accept()
     ws_id = id(websocket) # Уникальный идентификатор для WebSocket соединения
-    queue = multiprocessing.Queue() # Очередь для обмена данными с процессом-воркером
-    stop_event = multiprocessing.Event() # Событие для сигнализации об остановке воркера
-    processes[ws_id] = (queue, stop_event) # Сохранение очереди и события в глобальном словаре
+    subscriber = None # Подписка соединения на конвейер источника
     try:
         data = await websocket.receive_json() # Получение JSON-сообщения от клиента
         video_path = data.get("file_path")
@@ -107,16 +274,39 @@ async def video_feed(websocket: WebSocket):
             await websocket.send_json({"error": "Неверный или отсутствующий file_path"})
             return
 
-        # Запуск процесса обработки видео
-        process = multiprocessing.Process(target=camera_worker, args=(video_path, queue, stop_event))
-        process.start()
-        try:
-            # Цикл получения и отправки данных клиенту
-            while True:
-                item = await asyncio.get_event_loop().run_in_executor(None, queue.get) # Асинхронное получение из очереди
-                if item is None: # Сигнал о завершении от воркера
-                    break
-                frame_data, jpeg_bytes = item
+        # Согласование протокола: без поля "protocol" используется прежний (JSON + JPEG)
+        protocol, video_url = select_protocol(data.get("protocol"), video_path)
+        encoder = DeltaEncoder() if protocol == DELTA_PROTOCOL else None
+        metadata_only = protocol == METADATA_PROTOCOL
+        if "protocol" in data: # Подтверждение выбранного протокола клиенту, который его запросил
+            reply = {"type": "protocol", "protocol": protocol, "version": DELTA_VERSION if encoder else None}
+            if video_url is not None: # Исходный файл клиент воспроизводит сам
+                reply["video_url"] = video_url
+            await websocket.send_json(reply)
+
+        # Подписка на конвейер источника (запускается в слоте пула для первого зрителя)
+        subscriber = stream_hub.subscribe(video_path, needs_frames=not metadata_only)
+        processes[ws_id] = subscriber # Сохранение подписки в глобальном словаре
+        stats = ConnectionStats(data.get("file_path"), protocol) # Статистика соединения
+        connections[ws_id] = (stats, subscriber)
+        viewer_metrics = stream_hub.metrics.viewer(subscriber.channel.key) if METRICS_ENABLED else None
+        # Цикл получения и отправки данных клиенту
+        while True:
+            item, dropped = await subscriber.recv() # Самый свежий кадр (или каждый при FRAME_DROP_POLICY=block)
+            if item is None: # Сигнал о завершении от воркера
+                break
+            (frame_data, produced_at), jpeg_bytes = item
+            if not jpeg_bytes and not metadata_only: # Кадр без изображения (только для зрителей metadata)
+                continue
+            send_started = time.time()
+            if metadata_only:
+                await websocket.send_json({"type": "frame_data", "data": to_python_type(frame_data)})
+                if jpeg_bytes: # Кадр камеры без разметки
+                    await websocket.send_bytes(jpeg_bytes)
+            elif encoder is not None:
+                # Одно бинарное сообщение: изменения метаданных и JPEG
+                await websocket.send_bytes(encoder.encode(frame_data, jpeg_bytes))
+            else:
                 # Отправка метаданных кадра
                 await websocket.send_json({
                     "type": "frame_data",
@@ -124,52 +314,238 @@ async def video_feed(websocket: WebSocket):
                 })
                 # Отправка байтов изображения кадра
                 await websocket.send_bytes(jpeg_bytes)
-        except (WebSocketDisconnect, Exception):
-            # Обработка отключения WebSocket или других исключений во внутреннем цикле
-            stop_event.set() # Сигнализировать воркеру об остановке
-        finally:
-            # Гарантированная остановка и очистка ресурсов
-            stop_event.set()
-            process.join() # Ожидание завершения процесса-воркера
-            queue.close()
-            processes.pop(ws_id, None) # Удаление информации о процессе из словаря
+            sent_at = time.time()
+            lag = sent_at - produced_at # Задержка от готовности кадра в воркере до отправки клиенту
+            stats.record(len(jpeg_bytes), lag, dropped, subscriber.worker_dropped)
+            if viewer_metrics is not None: # Ожидание кадра после готовности в воркере и отправка
+                viewer_metrics.observe("queue", send_started - produced_at)
+                viewer_metrics.observe("send", sent_at - send_started)
+                stream_hub.metrics.add_dropped(subscriber.channel.key, "viewer", dropped)
+            subscriber.record_latency(lag) # Качество и масштаб JPEG по задержке клиента
     except WebSocketDisconnect:
-        stop_event.set() # Установка события остановки при отключении клиента
         logging.info("WebSocket отключен")
     except Exception as e:
-        stop_event.set() # Установка события остановки при других исключениях
         logging.exception("Ошибка WebSocket")
     finally:
-        # Гарантированная очистка, если соединение было установлено, но произошла ошибка до основного try/finally
-        stop_event.set()
+        # Отписка от источника; после ухода последнего зрителя воркер возвращается в пул
         processes.pop(ws_id, None)
+        connection = connections.pop(ws_id, None)
+        if connection is not None:
+            logging.info(f"Соединение {ws_id} завершено: {connection[0].to_dict(connection[1].encoding)}")
+        if subscriber is not None:
+            stream_hub.unsubscribe(subscriber)
+
+@app.get("/video_feed/stats")
+async def video_feed_stats():
+    """
+    Статистика активных соединений /ws/video_feed: отправленные и отброшенные кадры,
+    задержка от готовности кадра до отправки, нужные клиенту качество и масштаб JPEG.
+    В "sources" - общие конвейеры источников с числом зрителей.
+    """
+    return {
+        "connections": [
+            {"connection_id": ws_id, "subscribers": len(subscriber.channel.subscribers), **stats.to_dict(subscriber.encoding)}
+            for ws_id, (stats, subscriber) in list(connections.items())
+        ],
+        "sources": stream_hub.sources()
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Метрики в текстовом формате Prometheus: гистограммы длительности этапов по источникам
+    (декодирование, инференс, постобработка, отрисовка, JPEG, ожидание в очереди, отправка),
+    длительность записи нарушений в БД, глубина очередей, отброшенные кадры,
+    активные соединения и воркеры, память процессов.
+    """
+    return PlainTextResponse(render_metrics(stream_hub, worker_pool, len(processes)), media_type=CONTENT_TYPE)
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """
+    Ставит видеофайл в очередь пакетной обработки без потоковой передачи кадров.
+    Возвращает состояние задания; при заполненной очереди — 429. Если файл с тем же
+    содержимым уже обработан при тех же параметрах, задание сразу выполнено (result.cached).
+    """
+    if not os.path.isfile(request.file_path):
+        raise HTTPException(status_code=404, detail="Видеофайл не найден")
+    options = {"save_output": request.save_output, "detect_every": request.detect_every, "segments": request.segments}
+    result = await run_in_threadpool(cached_result, request.file_path, options)
+    if result is not None:
+        return job_manager.complete(request.file_path, options, result).to_dict()
+    try:
+        job = job_manager.submit(request.file_path, options)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    return job.to_dict()
+
+@app.get("/jobs")
+async def list_jobs(status: Optional[str] = None):
+    """Возвращает список заданий (новые первыми), при необходимости с фильтром по статусу."""
+    return job_manager.list(status)
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Возвращает состояние задания: статус, прогресс, скорость обработки и итоговые счетчики."""
+    job = job_manager.status(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job
+
+@app.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """Отменяет ожидающее или выполняющееся задание."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задание не найдено")
+    return job_manager.status(job_id)
+
+@app.get("/results/{cache_key}")
+async def get_cached_result(cache_key: str):
+    """
+    Запись кэша результатов: итоговые счетчики, нарушения, параметры конвейера и файлы
+    обработанного видео. Ключ возвращают /process_video_file и результат задания.
+    """
+    entry = await run_in_threadpool(result_cache.get, cache_key)
+    if entry is None:
+        raise HTTPException(status_code=404, detail="Результат не найден в кэше")
+    return entry
+
+@app.get("/results/{cache_key}/frames")
+async def get_cached_frames(cache_key: str):
+    """Детекции по кадрам из кэша результатов: frame_data каждого кадра строкой JSON (NDJSON)."""
+    entry = await run_in_threadpool(result_cache.get, cache_key)
+    if entry is None or not entry["frames"]:
+        raise HTTPException(status_code=404, detail="Детекции по кадрам не найдены в кэше")
+    return StreamingResponse(result_cache.frame_lines(cache_key), media_type="application/x-ndjson")
 
 @app.get("/violations")
-async def get_violations():
-    """Возвращает список всех зарегистрированных нарушений."""
-    with get_session() as session:
-        violations = session.query(Violation).order_by(Violation.id.desc()).all()
-        result = [
-            {
-                "id": v.id,
-                "vehicle_id": v.vehicle_id,
-                "timestamp": v.timestamp.isoformat() if v.timestamp else None,
-                "video_second": v.video_second,
-                "processed_video_path": v.processed_video_path,
-                "original_video_path": v.original_video_path
-            }
-            for v in violations
-        ]
-    return JSONResponse(content=result)
+async def get_violations(
+    limit: int = Query(VIOLATIONS_PAGE_SIZE, ge=1, le=VIOLATIONS_MAX_PAGE_SIZE),
+    before_id: Optional[int] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    original_video_path: Optional[str] = None,
+    processed_video_path: Optional[str] = None,
+    vehicle_id: Optional[str] = None
+):
+    """
+    Возвращает страницу зарегистрированных нарушений (новые первыми) с фильтрами.
+    Курсор следующей страницы передается в заголовке X-Next-Cursor
+    (значение для параметра before_id); на последней странице заголовка нет.
+    Запрос выполняется в пуле потоков БД и не задерживает потоковую передачу кадров.
+    """
+    violations = await run_db( # Лишняя запись показывает, есть ли следующая страница
+        fetch_violations, limit + 1, before_id, since, until, original_video_path, processed_video_path, vehicle_id
+    )
+    result = violations[:limit]
+    headers = {}
+    if len(violations) > limit:
+        headers["X-Next-Cursor"] = str(result[-1]["id"])
+    return JSONResponse(content=result, headers=headers)
+
+@app.get("/violations/export")
+async def export_violations(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    original_video_path: Optional[str] = None,
+    processed_video_path: Optional[str] = None,
+    vehicle_id: Optional[str] = None
+):
+    """
+    Выгружает все нарушения, подходящие под фильтры, одним JSON-массивом.
+    Ответ формируется потоково: записи читаются из БД пакетами по EXPORT_BATCH_SIZE
+    с пагинацией по id, поэтому таблица целиком в памяти не держится.
+    """
+    async def generate() -> AsyncIterator[str]:
+        before_id = None
+        first = True
+        yield "["
+        while True:
+            rows = await run_db( # Соединение не удерживается между пакетами
+                fetch_violations, EXPORT_BATCH_SIZE, before_id, since, until, original_video_path, processed_video_path, vehicle_id
+            )
+            if not rows:
+                break
+            chunk = ",".join(json.dumps(row, ensure_ascii=False) for row in rows)
+            yield chunk if first else "," + chunk
+            first = False
+            before_id = rows[-1]["id"]
+            if len(rows) < EXPORT_BATCH_SIZE:
+                break
+        yield "]"
+
+    return StreamingResponse(
+        generate(),
+        media_type="application/json",
+        headers={"Content-Disposition": 'attachment; filename="violations.json"'}
+    )
+
+def sse_event(row: Dict[str, Any]) -> str:
+    """Событие Server-Sent Events с нарушением; id события - id нарушения (для Last-Event-ID)."""
+    return f"id: {row['id']}\nevent: violation\ndata: {json.dumps(row, ensure_ascii=False)}\n\n"
+
+@app.get("/violations/stream")
+async def stream_violations(request: Request, after_id: Optional[int] = None):
+    """
+    Лента новых нарушений (Server-Sent Events, событие "violation"): каждое нарушение
+    отправляется после записи в БД. Возобновление - с after_id или с заголовка Last-Event-ID
+    (EventSource передает его при переподключении): сначала отправляются пропущенные записи.
+    Без них лента начинается с новых записей. Все подписчики получают записи из одного опроса БД.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        after_id = int(last_event_id)
+
+    async def events() -> AsyncIterator[str]:
+        await violation_feed.wait_ready()
+        subscription = violation_feed.subscribe()
+        try:
+            if after_id is not None: # Записи, пропущенные клиентом до подписки
+                async for row in violation_feed.backlog(after_id, subscription.start_id):
+                    yield sse_event(row)
+            while True:
+                try:
+                    row = await asyncio.wait_for(subscription.get(), VIOLATION_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n" # Комментарий SSE: соединение не закрывается прокси по простою
+                    continue
+                if row is None: # Подписка закрыта (клиент не успевал): EventSource переподключится
+                    break
+                yield sse_event(row)
+        finally:
+            violation_feed.unsubscribe(subscription)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/violations/summary")
+async def violations_summary():
+    """
+    Сводка нарушений: всего, по источникам, часам и классам ТС. Счетчики хранятся в памяти
+    и обновляются лентой нарушений, запрос к БД не выполняется. ready=false - таблица еще читается.
+    """
+    return {"ready": violation_feed.ready, "last_id": violation_feed.last_id, **violation_feed.summary.to_dict()}
+
+@app.get("/violations/summary/{dimension}")
+async def violations_summary_by(dimension: str):
+    """Сводка нарушений по одному измерению: source, hour или class."""
+    if dimension not in SUMMARY_DIMENSIONS:
+        raise HTTPException(status_code=404, detail=f"Измерение сводки: {', '.join(SUMMARY_DIMENSIONS)}")
+    return {"ready": violation_feed.ready, "last_id": violation_feed.last_id, **violation_feed.summary.to_dict(dimension)}
 
 @app.get("/uploaded_videos/{filename}")
-async def get_uploaded_video(filename: str):
-    """Предоставляет доступ к загруженному видеофайлу."""
-    file_path = get_file_path("uploaded_videos", filename)
-    return FileResponse(path=file_path, filename=filename, media_type='video/mp4')
+async def get_uploaded_video(filename: str, request: Request):
+    """Предоставляет доступ к загруженному видеофайлу (с поддержкой Range и ETag)."""
+    file_path = get_file_path(UPLOAD_DIR, os.path.basename(filename))
+    return video_file_response(request, file_path, filename, 'video/mp4')
 
 @app.get("/download_processed_video")
-async def download_processed_video(filename: str):
-    """Предоставляет доступ к обработанному видеофайлу для скачивания."""
-    file_path = get_file_path("output", filename)
-    return FileResponse(path=file_path, filename=filename, media_type='video/x-msvideo')
+async def download_processed_video(filename: str, request: Request):
+    """Предоставляет доступ к обработанному видеофайлу для скачивания (с поддержкой Range и ETag)."""
+    file_path = get_file_path(OUTPUT_DIR, os.path.basename(filename))
+    media_type = 'video/mp4' if file_path.endswith('.mp4') else 'video/x-msvideo' # H.264 (ffmpeg) или MJPG (OpenCV)
+    return video_file_response(request, file_path, filename, media_type)
@@ -0,0 +1,269 @@
+import os
+import time
+import ctypes
+import bisect
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import psutil
+
+# --- Метрики Prometheus (переопределяются переменными окружения) ---
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1") == "1" # Замер этапов в воркерах и эндпоинте /metrics
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0) # Границы корзин задержек (сек.)
+WORKER_STAGES = ( # Этапы сессии воркера: process_video (timings), кодирование и передача кадра, запись в БД
+    "decode", "inference", "postprocess", "crosswalk", "draw", "output", "encode", "publish", "db_flush"
+)
+WORKER_GAUGES = ("ring_depth",) # Глубина очередей сессии: кадры в кольце, еще не забранные эндпоинтом
+VIEWER_STAGES = ("queue", "send") # Этапы эндпоинта: ожидание кадра после готовности в воркере, отправка клиенту
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8" # Текстовый формат экспозиции Prometheus
+
+
+def histograms_size(stages: Sequence[str], gauges: Sequence[str] = ()) -> int:
+    """Число значений double в буфере StageHistograms."""
+    return len(stages) * (len(LATENCY_BUCKETS) + 3) + len(gauges)
+
+
+class StageHistograms:
+    """
+    Гистограммы задержек этапов и значения датчиков в плоском массиве double.
+
+    Буфер может находиться в общей памяти (`multiprocessing.RawArray` слота воркера): воркер
+    пишет в него без блокировок, основной процесс читает при запросе /metrics. Для каждого
+    этапа хранятся счетчики корзин LATENCY_BUCKETS и +Inf, сумма и число замеров.
+    Запись в один этап выполняет один поток, поэтому блокировка не нужна, а чтение
+    во время записи дает расхождение не больше одного замера.
+
+    Отметки lap суммируются по этапам в пределах кадра и учитываются в гистограммах
+    при end_frame (один замер этапа на кадр); observe учитывает замер сразу.
+    """
+
+    def __init__(self, stages: Sequence[str], gauges: Sequence[str] = (), buffer: Any = None):
+        self.stages = tuple(stages)
+        self.gauges = tuple(gauges)
+        self._index = {stage: i * (len(LATENCY_BUCKETS) + 3) for i, stage in enumerate(self.stages)}
+        self._gauge_base = len(self.stages) * (len(LATENCY_BUCKETS) + 3)
+        size = histograms_size(self.stages, self.gauges)
+        self.buffer = buffer if buffer is not None else (ctypes.c_double * size)()
+        self._last = time.perf_counter()
+        self._frame: Dict[str, float] = {} # Время этапов текущего кадра
+
+    def observe(self, stage: str, seconds: float) -> None:
+        """Учитывает длительность этапа stage."""
+        base = self._index[stage]
+        buffer = self.buffer
+        buffer[base + bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        buffer[base + len(LATENCY_BUCKETS) + 1] += seconds
+        buffer[base + len(LATENCY_BUCKETS) + 2] += 1
+
+    def lap(self, stage: str) -> None:
+        """Добавляет время с предыдущей отметки к этапу stage текущего кадра (интерфейс timings process_video)."""
+        now = time.perf_counter()
+        self._frame[stage] = self._frame.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def end_frame(self) -> None:
+        """Учитывает время этапов завершенного кадра."""
+        for stage, seconds in self._frame.items():
+            self.observe(stage, seconds)
+        self._frame.clear()
+
+    def set_gauge(self, name: str, value: float) -> None:
+        self.buffer[self._gauge_base + self.gauges.index(name)] = value
+
+    def gauge(self, name: str) -> float:
+        return self.buffer[self._gauge_base + self.gauges.index(name)]
+
+    def reset(self) -> None:
+        """Обнуляет гистограммы и датчики (перед новой сессией слота)."""
+        ctypes.memset(self.buffer, 0, ctypes.sizeof(self.buffer))
+        self._last = time.perf_counter()
+        self._frame.clear()
+
+    def add(self, other: "StageHistograms") -> None:
+        """Прибавляет гистограммы other (датчики не суммируются)."""
+        self.buffer[:self._gauge_base] = [a + b for a, b in zip(self.buffer[:self._gauge_base], other.buffer[:self._gauge_base])]
+
+    def series(self, stage: str) -> Tuple[List[float], float, float]:
+        """Накопительные счетчики корзин (включая +Inf), сумма и число замеров этапа."""
+        base = self._index[stage]
+        values = self.buffer[base:base + len(LATENCY_BUCKETS) + 3]
+        cumulative, total = [], 0.0
+        for count in values[:len(LATENCY_BUCKETS) + 1]:
+            total += count
+            cumulative.append(total)
+        return cumulative, values[-2], values[-1]
+
+
+class StreamMetrics:
+    """
+    Метрики источников в основном процессе: этапы эндпоинта и итоги завершенных сессий воркеров.
+    Гистограммы слота обнуляются при каждой новой сессии, поэтому при ее завершении они
+    прибавляются к итогам источника; /metrics выводит итоги вместе с текущими сессиями,
+    и счетчики источника не убывают, пока работает его конвейер. Метрики ведутся только для
+    открытых источников (open) и удаляются вместе с сериями /metrics после остановки конвейера
+    (remove): загруженные файлы и адреса камер не накапливаются в памяти и в Prometheus.
+    Используется только из цикла событий.
+    """
+
+    def __init__(self):
+        self._sources: Set[str] = set() # Источники с работающим конвейером
+        self._viewer: Dict[str, StageHistograms] = {} # Этапы эндпоинта по источникам
+        self._worker: Dict[str, StageHistograms] = {} # Итоги завершенных сессий воркеров по источникам
+        self._dropped: Dict[Tuple[str, str], float] = {} # Отброшенные кадры (источник, где) - итоги
+        self._lanes: Dict[str, List[Any]] = {} # Слоты воркеров с текущими сессиями источников
+
+    def open(self, key: str) -> None:
+        """Источник key запущен: его метрики ведутся до remove."""
+        self._sources.add(key)
+
+    def remove(self, key: str) -> None:
+        """Удаляет метрики и серии источника key после остановки его конвейера."""
+        self._sources.discard(key)
+        self._viewer.pop(key, None)
+        self._worker.pop(key, None)
+        self._lanes.pop(key, None)
+        for dropped_key in [k for k in self._dropped if k[0] == key]:
+            del self._dropped[dropped_key]
+
+    def viewer(self, key: str) -> StageHistograms:
+        """Гистограммы этапов эндпоинта для источника key (для остановленного - без сохранения)."""
+        if key not in self._sources:
+            return StageHistograms(VIEWER_STAGES)
+        if key not in self._viewer:
+            self._viewer[key] = StageHistograms(VIEWER_STAGES)
+        return self._viewer[key]
+
+    def add_dropped(self, key: str, where: str, count: int) -> None:
+        if count and key in self._sources:
+            self._dropped[(key, where)] = self._dropped.get((key, where), 0) + count
+
+    def start_session(self, key: str, lane: Any) -> None:
+        """Слот lane начал сессию источника key (его метрики уже обнулены)."""
+        self._lanes.setdefault(key, []).append(lane)
+
+    def finish_session(self, key: str, lane: Any) -> None:
+        """Переносит метрики завершенной сессии слота в итоги источника."""
+        lanes = self._lanes.get(key, [])
+        if lane not in lanes:
+            return
+        lanes.remove(lane)
+        if not lanes:
+            del self._lanes[key]
+        if key not in self._worker:
+            self._worker[key] = StageHistograms(WORKER_STAGES)
+        self._worker[key].add(lane.metrics)
+        self.add_dropped(key, "worker", lane.dropped.value)
+
+    def lanes(self, key: str) -> List[Any]:
+        return list(self._lanes.get(key, ()))
+
+    def worker(self, key: str) -> StageHistograms:
+        """Итоги сессий воркеров источника вместе с текущими сессиями."""
+        merged = StageHistograms(WORKER_STAGES)
+        if key in self._worker:
+            merged.add(self._worker[key])
+        for lane in self._lanes.get(key, ()):
+            merged.add(lane.metrics)
+        return merged
+
+    def keys(self) -> List[str]:
+        return sorted(set(self._viewer) | set(self._worker) | set(self._lanes) | {key for key, _ in self._dropped})
+
+    def dropped(self, key: str, where: str) -> float:
+        """Отброшенные кадры источника, включая текущие сессии воркеров."""
+        count = self._dropped.get((key, where), 0)
+        if where == "worker":
+            count += sum(lane.dropped.value for lane in self._lanes.get(key, ()))
+        return count
+
+
+# --- Текстовый формат Prometheus ---
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(labels: Dict[str, Any]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class MetricsText:
+    """Сборка ответа /metrics: образцы группируются по семействам с заголовками HELP и TYPE."""
+
+    def __init__(self):
+        self._families: Dict[str, Tuple[str, str, List[str]]] = {}
+
+    def _family(self, name: str, kind: str, help_text: str) -> List[str]:
+        if name not in self._families:
+            self._families[name] = (kind, help_text, [])
+        return self._families[name][2]
+
+    def sample(self, name: str, kind: str, help_text: str, value: float, **labels: Any) -> None:
+        self._family(name, kind, help_text).append(f"{name}{_labels(labels)} {_number(value)}")
+
+    def histogram(self, name: str, help_text: str, histograms: StageHistograms, series: str, **labels: Any) -> None:
+        """Гистограмма этапа series из histograms с метками labels."""
+        lines = self._family(name, "histogram", help_text)
+        cumulative, total, count = histograms.series(series)
+        for bound, value in zip(LATENCY_BUCKETS + (float("inf"),), cumulative):
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': le})} {_number(value)}")
+        lines.append(f"{name}_sum{_labels(labels)} {_number(total)}")
+        lines.append(f"{name}_count{_labels(labels)} {_number(count)}")
+
+    def render(self) -> str:
+        out = []
+        for name, (kind, help_text, lines) in self._families.items():
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        return "\n".join(out) + "\n"
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """Резидентная память процесса (байт) или None, если процесс уже завершился."""
+    try:
+        return psutil.Process(pid).memory_info().rss
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return None
+
+
+def render_metrics(hub: Any, pool: Any, active_connections: int) -> str:
+    """Формирует ответ /metrics по конвейерам источников (hub), пулу воркеров и соединениям."""
+    text = MetricsText()
+    subscribers = {channel.key: len(channel.subscribers) for channel in hub.channels()}
+    for key in sorted(set(hub.metrics.keys()) | set(subscribers)):
+        worker = hub.metrics.worker(key)
+        for stage in WORKER_STAGES:
+            if stage == "db_flush":
+                text.histogram("traffic_db_flush_seconds", "Длительность пакетной вставки нарушений в БД.", worker, stage, stream=key)
+            else:
+                text.histogram("traffic_stage_seconds", "Длительность этапа обработки кадра.", worker, stage, stream=key, stage=stage)
+        viewer = hub.metrics.viewer(key)
+        for stage in VIEWER_STAGES:
+            text.histogram("traffic_stage_seconds", "Длительность этапа обработки кадра.", viewer, stage, stream=key, stage=stage)
+        for where in ("worker", "viewer"):
+            text.sample("traffic_frames_dropped_total", "counter", "Кадры, отброшенные воркером до кодирования или эндпоинтом до отправки.",
+                        hub.metrics.dropped(key, where), stream=key, where=where)
+        text.sample("traffic_stream_subscribers", "gauge", "Зрители источника.", subscribers.get(key, 0), stream=key)
+        lanes = hub.metrics.lanes(key)
+        if lanes:
+            for gauge in WORKER_GAUGES:
+                text.sample("traffic_queue_depth", "gauge", "Глубина очереди сессии воркера.",
+                            sum(lane.metrics.gauge(gauge) for lane in lanes), stream=key, queue=gauge)
+    text.sample("traffic_active_connections", "gauge", "Активные соединения /ws/video_feed.", active_connections)
+    text.sample("traffic_worker_sessions", "gauge", "Слоты воркеров, занятые сессиями.", pool.active_sessions())
+    workers = pool.workers()
+    text.sample("traffic_workers", "gauge", "Процессы пула воркеров.", len(workers))
+    for pid in [os.getpid()] + [pid for pid, _ in workers]:
+        rss = process_rss(pid)
+        if rss is not None:
+            text.sample("traffic_process_resident_memory_bytes", "gauge", "Резидентная память процесса.",
+                        rss, pid=pid, role="main" if pid == os.getpid() else "worker")
+    for pid, busy in workers:
+        text.sample("traffic_worker_busy_lanes", "gauge", "Занятые слоты воркера.", busy, pid=pid)
+    return text.render()
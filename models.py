@@ -12,21 +12,32 @@ class Violation(Base):
     Отражает структуру таблицы 'violations' в базе данных.
     """
     __tablename__ = 'violations' # Имя таблицы в базе данных
+    # Индексы по фильтруемым полям используются вместе с пагинацией по id
+    # (во вторичных индексах InnoDB первичный ключ хранится неявно)
 
     # Уникальный идентификатор записи о нарушении (первичный ключ, автоинкремент)
     id: int = Column(Integer, primary_key=True, autoincrement=True)
     
     # Идентификатор транспортного средства, совершившего нарушение (полученный от трекера)
-    vehicle_id: str = Column(String(64))
+    vehicle_id: str = Column(String(64), index=True)
     
     # Временная метка нарушения (для случаев обработки с веб-камеры)
-    timestamp: Optional[datetime] = Column(DateTime, nullable=True)
+    timestamp: Optional[datetime] = Column(DateTime, nullable=True, index=True)
     
     # Секунда видеофайла, на которой зафиксировано нарушение (для случаев обработки видеофайлов)
     video_second: Optional[int] = Column(Integer, nullable=True)
     
     # Путь к сохраненному обработанному видеофайлу с визуализацией нарушения
-    processed_video_path: Optional[str] = Column(String(256), nullable=True)
+    processed_video_path: Optional[str] = Column(String(256), nullable=True, index=True)
     
     # Путь к оригинальному видеофайлу, на котором было зафиксировано нарушение
-    original_video_path: Optional[str] = Column(String(256), nullable=True)
+    original_video_path: Optional[str] = Column(String(256), nullable=True, index=True)
+    
+    # Путь к видеофрагменту с моментами до и после нарушения (из буфера последних кадров)
+    evidence_clip_path: Optional[str] = Column(String(256), nullable=True)
+
+    # Класс транспортного средства по модели YOLO (например, "car")
+    vehicle_class: Optional[str] = Column(String(32), nullable=True)
+
+    # Время записи нарушения в БД (заполняется при вставке, в том числе пакетной)
+    created_at: Optional[datetime] = Column(DateTime, nullable=True, default=datetime.now)
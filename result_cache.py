@@ -0,0 +1,393 @@
+import os
+import gzip
+import json
+import time
+import shutil
+import hashlib
+import logging
+import datetime
+import threading
+import functools
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from inference_backend import INFERENCE_BACKEND, INFERENCE_IMGSZ, INFERENCE_INT8, MODEL_WEIGHTS, weights_digest
+from frame_skipping import DETECT_EVERY, MAX_DETECT_INTERVAL, parse_detect_every
+from track_state import TRACK_STATE_TTL
+from utils import CROSSWALK_MAX_WIDTH, CROSSWALK_RETRY_MAX
+
+# --- Кэш результатов обработки по содержимому видео (переопределяется переменными окружения) ---
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR", "cache/results") # Пустая строка отключает кэш
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(20 * 1024 ** 3))) # Предел размера кэша на диске (байт)
+CACHE_FORMAT = 1 # Версия формата записи и логики конвейера: при изменении прежние записи не используются
+KEY_LENGTH = 32 # Символов SHA-256 в ключе записи
+HASH_CHUNK_SIZE = 1024 * 1024 # Блок чтения при вычислении SHA-256 файла
+TMP_MAX_AGE = 24 * 3600 # Незавершенные записи старше N сек. (процесс завершился аварийно) удаляются
+SOURCES_INDEX = "sources.json" # SHA-256 содержимого файлов-источников
+SOURCES_LOCK = "sources.json.lock" # Файловая блокировка изменения sources.json процессами воркеров и заданий
+RESULT_FILE = "result.json" # Счетчики, нарушения и параметры записи; время изменения - последнее использование
+FRAMES_FILE = "frames.jsonl.gz" # frame_data по кадрам, по строке JSON на кадр
+RUNTIME_FIELDS = ("output_path", "drawn") # Поля frame_data, зависящие от сессии, в кэш не попадают
+
+
+def json_default(obj: Any) -> Any:
+    """Сериализация типов NumPy и datetime в json.dump."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    raise TypeError(f"Тип {type(obj).__name__} не сериализуется в JSON")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def model_digest(weights: str = MODEL_WEIGHTS) -> Optional[str]:
+    """SHA-256 весов модели (один раз на процесс); None, если файл весов недоступен."""
+    try:
+        return weights_digest(weights)
+    except OSError:
+        logging.warning(f"Веса {weights} недоступны, кэш результатов не используется")
+        return None
+
+
+def pipeline_config(detect_every: Any = DETECT_EVERY) -> Optional[Dict[str, Any]]:
+    """
+    Параметры конвейера, от которых зависят детекции, счетчики и нарушения: веса и бэкенд
+    модели, размер входа, частота детекции, поиск перехода и срок жизни треков.
+    Калибровка перехода (calibration.crosswalk_cache) в ключ не входит: ее находит сама обработка
+    по содержимому файла и параметрам поиска перехода, которые уже есть в ключе, а при записи
+    в кэш калибровки после первой обработки ключ повторной загрузки должен остаться прежним.
+    Отрисовка, кодирование и запись видео на результат не влияют и в ключ не входят.
+    """
+    weights = model_digest(MODEL_WEIGHTS)
+    if weights is None:
+        return None
+    detect_every = parse_detect_every(detect_every)
+    return {
+        "format": CACHE_FORMAT,
+        "weights": weights,
+        "backend": INFERENCE_BACKEND,
+        "int8": INFERENCE_INT8 and INFERENCE_BACKEND != "torch",
+        "imgsz": INFERENCE_IMGSZ,
+        "detect_every": detect_every,
+        "max_detect_interval": MAX_DETECT_INTERVAL if detect_every == "auto" else None,
+        "crosswalk_max_width": CROSSWALK_MAX_WIDTH,
+        "crosswalk_retry_max": CROSSWALK_RETRY_MAX,
+        "track_state_ttl": TRACK_STATE_TTL,
+    }
+
+
+def cache_key(source_sha256: str, config: Dict[str, Any]) -> str:
+    """Ключ записи: SHA-256 содержимого видео вместе с параметрами конвейера."""
+    payload = json.dumps({"source": source_sha256, **config}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:KEY_LENGTH]
+
+
+class ResultRecorder:
+    """
+    Запись результатов одной обработки в кэш. Кадры пишутся сразу в сжатый файл во временном
+    каталоге, поэтому память не растет с длиной видео. finish(completed=True) переносит каталог
+    на место записи (os.replace), иначе временный каталог удаляется: незавершенная обработка
+    в кэш не попадает.
+    """
+
+    def __init__(self, cache: "ResultCache", key: str, source_sha256: str, config: Dict[str, Any], frames: bool = True):
+        self.cache = cache
+        self.key = key
+        self.source_sha256 = source_sha256
+        self.config = config
+        self.tmp_dir = os.path.join(cache.directory, f".tmp-{key}-{os.getpid()}-{threading.get_ident()}")
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._frames = gzip.open(os.path.join(self.tmp_dir, FRAMES_FILE), "wt", encoding="utf-8") if frames else None
+        self.frame_count = 0
+        self.last_frame: Dict[str, Any] = {}
+        self.violations: List[Dict[str, Any]] = []
+        self.outputs: List[str] = [] # Файлы обработанного видео в порядке кадров
+        self.failed = False # Ошибка записи кадров (например, диск заполнен): запись не сохраняется
+        self.finished = False
+        self.committed = False
+
+    def add_frame(self, frame_data: Dict[str, Any]) -> None:
+        self.frame_count += 1
+        self.last_frame = frame_data
+        output_path = frame_data.get("output_path")
+        if output_path and (not self.outputs or self.outputs[-1] != output_path):
+            self.outputs.append(output_path)
+        if self._frames is not None and not self.failed:
+            record = {k: v for k, v in frame_data.items() if k not in RUNTIME_FIELDS}
+            try: # Ошибка кэша не должна прерывать обработку
+                self._frames.write(json.dumps(record, default=json_default, separators=(",", ":")) + "\n")
+            except (OSError, TypeError, ValueError):
+                logging.exception(f"Ошибка записи кадров в кэш результатов {self.key}, запись не будет сохранена")
+                self.failed = True
+
+    def add_violation(self, row: Dict[str, Any]) -> None:
+        self.violations.append(row)
+
+    def finish(self, completed: bool, result: Optional[Dict[str, Any]] = None) -> bool:
+        """
+        Завершает запись: при completed сохраняет ее в кэш. Возвращает True, если запись с этим
+        ключом есть в кэше. result - итоговые счетчики; без него они берутся из последнего кадра.
+        Повторный вызов ничего не делает.
+        """
+        if self.finished:
+            return self.committed
+        self.finished = True
+        try:
+            if self._frames is not None:
+                self._frames.close()
+            if completed and not self.failed and (self.frame_count or result):
+                self._commit(result)
+        except (OSError, TypeError, ValueError):
+            logging.exception(f"Не удалось сохранить результат {self.key} в кэш")
+        finally:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        return self.committed
+
+    def _commit(self, result: Optional[Dict[str, Any]]) -> None:
+        if result is None:
+            result = {
+                "frames_processed": self.frame_count,
+                "total_frames": self.frame_count,
+                "total_crossings": self.last_frame.get("total_crossings", 0),
+                "red_light_violations": self.last_frame.get("red_light_violations", 0),
+            }
+        outputs = []
+        for path in self.outputs: # Видео остается в output/, в кэше - жесткая ссылка (копия на другом разделе)
+            name = os.path.basename(path)
+            link_or_copy(path, os.path.join(self.tmp_dir, name))
+            outputs.append(name)
+        entry = {
+            "key": self.key,
+            "source_sha256": self.source_sha256,
+            "config": self.config,
+            "created_at": datetime.datetime.now().isoformat(),
+            "result": {k: result[k] for k in ("frames_processed", "total_frames", "total_crossings", "red_light_violations")},
+            "frames": self._frames is not None,
+            "outputs": outputs,
+            "violations": self.violations,
+        }
+        with open(os.path.join(self.tmp_dir, RESULT_FILE), "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, default=json_default)
+        self.committed = self.cache._install(self.tmp_dir, entry)
+        self.cache.evict()
+
+
+def link_or_copy(source: str, target: str) -> None:
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+class ResultCache:
+    """
+    Кэш результатов обработки видеофайлов по содержимому (content-addressed).
+
+    Ключ записи - SHA-256 содержимого видео и параметры конвейера (pipeline_config), поэтому
+    повторная загрузка того же файла под новым именем находит результаты первой обработки.
+    Запись - каталог <ключ> с result.json (счетчики, нарушения), frames.jsonl.gz (frame_data
+    по кадрам) и файлами обработанного видео. Размер кэша ограничен max_bytes: при превышении
+    удаляются записи, дольше всех не использованные (время изменения result.json).
+    SHA-256 файлов-источников хранится в sources.json: загрузка считает его при записи на диск,
+    воркерам не нужно читать файл повторно. Записи создаются в других процессах (воркеры,
+    задания), поэтому каталог записи появляется атомарно переименованием, а sources.json
+    изменяется под файловой блокировкой (filelock) и заменяется целиком (os.replace).
+    """
+
+    def __init__(self, directory: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    # --- SHA-256 источников ---
+    def _load_sources(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.directory, SOURCES_INDEX), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError):
+            logging.warning(f"Не удалось прочитать {SOURCES_INDEX} кэша результатов, он будет перезаписан")
+            return {}
+
+    def register_source(self, path: str, sha256: str) -> None:
+        """Запоминает SHA-256 файла (с размером и временем изменения для проверки актуальности)."""
+        if not self.enabled:
+            return
+        from filelock import FileLock
+        stat = os.stat(path)
+        os.makedirs(self.directory, exist_ok=True)
+        index_path = os.path.join(self.directory, SOURCES_INDEX)
+        tmp_path = f"{index_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        # Чтение, изменение и запись индекса - под блокировкой файла: его меняют процессы воркеров и заданий
+        with self._lock, FileLock(os.path.join(self.directory, SOURCES_LOCK)):
+            sources = {p: s for p, s in self._load_sources().items() if os.path.exists(p)} # Удаленные файлы забываются
+            sources[os.path.abspath(path)] = {"sha256": sha256, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(sources, f, ensure_ascii=False)
+                os.replace(tmp_path, index_path)
+            except OSError:
+                logging.exception(f"Не удалось сохранить {index_path}")
+
+    def source_digest(self, path: str, compute: bool = False) -> Optional[str]:
+        """
+        SHA-256 содержимого файла из sources.json, если файл не менялся после записи.
+        Иначе при compute файл читается целиком и хэш запоминается, без compute - None.
+        """
+        if not self.enabled or not isinstance(path, str) or not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        with self._lock:
+            known = self._load_sources().get(os.path.abspath(path))
+        if known is not None and known["size"] == stat.st_size and known["mtime_ns"] == stat.st_mtime_ns:
+            return known["sha256"]
+        if not compute:
+            return None
+        sha256 = file_sha256(path)
+        self.register_source(path, sha256)
+        return sha256
+
+    # --- Записи ---
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.directory, os.path.basename(key))
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Запись по ключу (result.json) или None; время использования записи обновляется."""
+        if not self.enabled or not key.isalnum():
+            return None
+        result_path = os.path.join(self.entry_dir(key), RESULT_FILE)
+        try:
+            with open(result_path, encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(result_path) # Последнее использование для вытеснения LRU
+        except (OSError, ValueError): # Нет записи или ее удалило вытеснение в другом процессе
+            return None
+        return entry
+
+    def find(self, path: str, detect_every: Any = DETECT_EVERY, need_frames: bool = False,
+             need_video: bool = False, compute: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Запись для видеофайла path при текущих параметрах конвейера. need_frames и need_video
+        требуют, чтобы в записи были frame_data по кадрам и обработанное видео.
+        compute - вычислить SHA-256 файла, если его нет в sources.json.
+        """
+        key = self.key_for(path, detect_every, compute)
+        entry = self.get(key) if key is not None else None
+        if entry is None or (need_frames and not entry["frames"]) or (need_video and not entry["outputs"]):
+            return None
+        return entry
+
+    def key_for(self, path: str, detect_every: Any = DETECT_EVERY, compute: bool = False) -> Optional[str]:
+        sha256 = self.source_digest(path, compute)
+        config = pipeline_config(detect_every) if sha256 is not None else None
+        return cache_key(sha256, config) if config is not None else None
+
+    def recorder(self, path: str, detect_every: Any = DETECT_EVERY, compute: bool = False,
+                 frames: bool = True) -> Optional[ResultRecorder]:
+        """Запись результатов обработки файла path или None (кэш отключен, SHA-256 файла неизвестен)."""
+        sha256 = self.source_digest(path, compute)
+        config = pipeline_config(detect_every) if sha256 is not None else None
+        if config is None:
+            return None
+        try:
+            return ResultRecorder(self, cache_key(sha256, config), sha256, config, frames)
+        except OSError:
+            logging.exception("Не удалось создать запись кэша результатов")
+            return None
+
+    def _install(self, tmp_dir: str, entry: Dict[str, Any]) -> bool:
+        """
+        Переносит готовый каталог на место записи; True - запись с этим ключом есть в кэше.
+        Существующая запись заменяется, только если новая полнее (есть кадры или видео, которых
+        в ней нет): одновременные обработки одного файла не перезаписывают друг друга.
+        """
+        target = self.entry_dir(entry["key"])
+        existing = self.get(entry["key"])
+        if existing is not None:
+            richer = (entry["frames"] and not existing["frames"]) or (entry["outputs"] and not existing["outputs"])
+            if not richer:
+                return True
+            stale = f"{tmp_dir}.old"
+            try:
+                os.replace(target, stale)
+            except OSError: # Запись заменил или вытеснил другой процесс
+                return os.path.isdir(target)
+            shutil.rmtree(stale, ignore_errors=True)
+        try:
+            os.replace(tmp_dir, target)
+        except OSError: # Каталог записи успел создать другой процесс
+            return os.path.isdir(target)
+        logging.info(f"Результат сохранен в кэш: {entry['key']} ({entry['result']['frames_processed']} кадров)")
+        return True
+
+    def frame_lines(self, key: str) -> Iterator[str]:
+        """Строки JSON frame_data по кадрам записи."""
+        with gzip.open(os.path.join(self.entry_dir(key), FRAMES_FILE), "rt", encoding="utf-8") as f:
+            yield from f
+
+    def frames(self, key: str) -> Iterator[Dict[str, Any]]:
+        """frame_data по кадрам записи."""
+        for line in self.frame_lines(key):
+            yield json.loads(line)
+
+    def restore_outputs(self, entry: Dict[str, Any], output_dir: str = "output") -> Optional[str]:
+        """
+        Возвращает обработанное видео записи в output_dir (жесткой ссылкой, если файл оттуда
+        удален) и путь последнего файла - как output_path в frame_data.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        path = None
+        for name in entry["outputs"]:
+            path = os.path.join(output_dir, name)
+            if not os.path.exists(path):
+                link_or_copy(os.path.join(self.entry_dir(entry["key"]), name), path)
+        return path
+
+    def evict(self) -> None:
+        """Удаляет записи, дольше всех не использованные, пока размер кэша больше max_bytes."""
+        if not self.enabled or not os.path.isdir(self.directory):
+            return
+        entries = []
+        now = time.time()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not os.path.isdir(path):
+                continue
+            if name.startswith("."): # Незавершенная запись
+                if now - os.path.getmtime(path) > TMP_MAX_AGE:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            try:
+                used = os.path.getmtime(os.path.join(path, RESULT_FILE))
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            except OSError: # Запись удалена другим процессом
+                continue
+            entries.append((used, size, path))
+        total = sum(size for _, size, _ in entries)
+        for used, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            logging.info(f"Запись кэша результатов {os.path.basename(path)} вытеснена ({size} байт)")
+
+
+result_cache = ResultCache() # Общий кэш результатов процесса
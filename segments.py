@@ -0,0 +1,316 @@
+import os
+import time
+import logging
+import datetime
+import multiprocessing
+from concurrent.futures import FIRST_EXCEPTION, ProcessPoolExecutor, wait
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from frame_source import FrameSource
+from track_state import TrackStateStore
+from utils import box_iou, intersection_areas
+from worker_pool import WORKER_START_METHOD
+
+# --- Параллельная обработка сегментов видеофайла (переопределяется переменными окружения) ---
+SEGMENT_WORKERS = int(os.environ.get("SEGMENT_WORKERS", "0")) # Процессов для сегментов задания по умолчанию (0 или 1 - последовательно)
+SEGMENT_OVERLAP = float(os.environ.get("SEGMENT_OVERLAP", "2.0")) # Перекрытие соседних сегментов (сек.): разгон трекера и сшивка треков
+SEGMENT_MIN_SECONDS = float(os.environ.get("SEGMENT_MIN_SECONDS", "60")) # Минимальная длина сегмента (сек.): короткие файлы не делятся
+STITCH_IOU = 0.5 # Минимальный IoU рамок одного ТС в двух сегментах на кадре перекрытия
+STITCH_MIN_FRAMES = 3 # Минимум кадров перекрытия с совпадающими рамками для сшивки треков
+PROGRESS_INTERVAL = 1.0 # Период вызова on_progress (сек.)
+
+
+class Segment(NamedTuple):
+    """
+    Диапазон кадров одного сегмента. Кадры [lead_start, start) - перекрытие с предыдущим
+    сегментом: на них трекер набирает треки, пересечения там учитывает предыдущий сегмент.
+    Сегмент отвечает за кадры [start, end); end=None - до конца файла.
+    """
+    index: int
+    lead_start: int
+    start: int
+    end: Optional[int]
+
+
+class SegmentResult:
+    """
+    Детекции сегмента для сшивки: строки ТС (кадр, ID трека, рамка x1, y1, x2, y2, класс), признак
+    красного сигнала по кадрам и первый найденный сегментом переход. Передается из процесса
+    сегмента в родительский процесс, поэтому хранит только массивы NumPy.
+    """
+
+    def __init__(self, segment: Segment):
+        self.segment = segment
+        self.frames = np.zeros(0, dtype=np.int64) # Кадр строки (по возрастанию)
+        self.ids = np.zeros(0, dtype=np.int64) # Локальный ID трека (-1 - без трека)
+        self.boxes = np.zeros((0, 4), dtype=np.int64) # Рамки x1, y1, x2, y2
+        self.labels = np.zeros(0, dtype=str) # Классы ТС
+        self.red = np.zeros(0, dtype=bool) # Красный сигнал на кадрах lead_start, lead_start + 1, ...
+        self.crosswalk: Optional[Tuple[int, Tuple[int, int, int, int]]] = None # (кадр, рамка x, y, w, h)
+        self.completed = False # Сегмент дошел до своей границы или конца файла (не остановлен stop_event)
+
+    @property
+    def end(self) -> int:
+        """Кадр после последнего обработанного."""
+        return self.segment.lead_start + len(self.red)
+
+    def rows(self, frame_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        """ID треков и рамки ТС на кадре frame_idx."""
+        lo, hi = np.searchsorted(self.frames, [frame_idx, frame_idx + 1])
+        return self.ids[lo:hi], self.boxes[lo:hi]
+
+    def labels_at(self, frame_idx: int) -> np.ndarray:
+        """Классы ТС на кадре frame_idx (в порядке rows)."""
+        lo, hi = np.searchsorted(self.frames, [frame_idx, frame_idx + 1])
+        return self.labels[lo:hi]
+
+
+def plan_segments(total_frames: int, workers: int, overlap_frames: int, min_frames: int) -> List[Segment]:
+    """Делит файл на не более чем workers сегментов не короче min_frames; последний - до конца файла."""
+    count = max(1, min(workers, total_frames // max(1, min_frames)))
+    bounds = [round(i * total_frames / count) for i in range(count + 1)]
+    return [
+        Segment(i, max(0, bounds[i] - overlap_frames), bounds[i], bounds[i + 1] if i < count - 1 else None)
+        for i in range(count)
+    ]
+
+
+# --- Процесс сегмента ---
+_stop_event: Any = None # Отмена задания (общая для всех сегментов)
+_progress: Any = None # Счетчик кадров, обработанных всеми сегментами
+
+
+def init_segment_worker(stop_event: Any, progress: Any, threads: int) -> None:
+    """Инициализация процесса сегмента: ограничение потоков инференса и загрузка модели."""
+    global _stop_event, _progress
+    _stop_event, _progress = stop_event, progress
+    if threads > 0: # Процессы делят ядра: без лимита каждый займет все ядра
+        os.environ.setdefault("INFERENCE_THREADS", str(threads))
+    import yolo8_video  # noqa: F401 Загрузка модели один раз на процесс
+
+
+def process_segment(video_path: str, segment: Segment, detect_every: Any = 1) -> SegmentResult:
+    """
+    Обрабатывает кадры сегмента process_video без отрисовки, записи видео и нарушений
+    и собирает рамки ТС, сигнал светофора и найденный переход для сшивки.
+    """
+    from yolo8_video import process_video
+    frames: List[int] = []
+    ids: List[int] = []
+    boxes: List[List[int]] = []
+    labels: List[str] = []
+    red: List[bool] = []
+    crosswalk = None
+    frame_idx = segment.lead_start
+    for frame_data in process_video(
+        video_path,
+        save_output=False,
+        draw=False,
+        save_violations=False,
+        save_evidence=False,
+        stop_event=_stop_event,
+        detect_every=detect_every,
+        start_frame=segment.lead_start,
+        end_frame=segment.end,
+        raise_errors=True # Сбой сегмента - ошибка задания, а не сегмент, оборванный на середине
+    ):
+        for vehicle in frame_data['vehicles']:
+            frames.append(frame_idx)
+            ids.append(vehicle['id'])
+            boxes.append(vehicle['bbox'])
+            labels.append(vehicle['label'])
+        red.append(any(light['label'] == 'red_light' for light in frame_data['traffic_lights']))
+        if crosswalk is None and frame_data['crosswalk_bbox'] is not None:
+            crosswalk = (frame_idx, tuple(frame_data['crosswalk_bbox']))
+        if _progress is not None and frame_idx >= segment.start: # Кадры перекрытия учитывает предыдущий сегмент
+            with _progress.get_lock():
+                _progress.value += 1
+        frame_idx += 1
+    result = SegmentResult(segment)
+    result.frames = np.array(frames, dtype=np.int64)
+    result.ids = np.array(ids, dtype=np.int64)
+    result.boxes = np.array(boxes, dtype=np.int64).reshape(-1, 4)
+    result.labels = np.array(labels, dtype=str)
+    result.red = np.array(red, dtype=bool)
+    result.crosswalk = crosswalk
+    stopped = _stop_event is not None and _stop_event.is_set()
+    # Сегмент завершен, только если дошел до своей границы (последний - до конца файла)
+    result.completed = not stopped and (segment.end is None or result.end >= segment.end)
+    return result
+
+
+# --- Сшивка сегментов ---
+def stitch_tracks(prev: SegmentResult, cur: SegmentResult, iou_threshold: float = STITCH_IOU,
+                  min_frames: int = STITCH_MIN_FRAMES) -> Dict[int, int]:
+    """
+    Сопоставляет треки сегмента cur с треками предыдущего сегмента prev по кадрам перекрытия:
+    пара треков получает голос за каждый кадр, где их рамки совпадают с IoU >= iou_threshold.
+    Пары выбираются жадно по числу голосов (не меньше min_frames), каждый трек - не более одного раза.
+    Возвращает {локальный ID в cur: локальный ID в prev}.
+    """
+    votes: Dict[Tuple[int, int], int] = {}
+    for frame_idx in range(cur.segment.lead_start, min(cur.segment.start, prev.end)):
+        prev_ids, prev_boxes = prev.rows(frame_idx)
+        cur_ids, cur_boxes = cur.rows(frame_idx)
+        if not len(prev_ids) or not len(cur_ids):
+            continue
+        iou = box_iou(prev_boxes, cur_boxes)
+        for i, j in zip(*np.nonzero(iou >= iou_threshold)):
+            if prev_ids[i] != -1 and cur_ids[j] != -1:
+                pair = (int(prev_ids[i]), int(cur_ids[j]))
+                votes[pair] = votes.get(pair, 0) + 1
+    mapping: Dict[int, int] = {}
+    used = set()
+    for (prev_id, cur_id), count in sorted(votes.items(), key=lambda item: -item[1]):
+        if count < min_frames:
+            break
+        if cur_id in mapping or prev_id in used:
+            continue
+        mapping[cur_id] = prev_id
+        used.add(prev_id)
+    return mapping
+
+
+def global_track_ids(results: List[SegmentResult]) -> List[Dict[int, int]]:
+    """
+    Глобальные ID треков по сегментам: первый сегмент сохраняет свои ID, треки следующих
+    сегментов, сшитые с предыдущим, получают его глобальный ID, остальные - новые ID.
+    """
+    mappings: List[Dict[int, int]] = []
+    next_id = 1
+    for k, result in enumerate(results):
+        stitched = stitch_tracks(results[k - 1], result) if k else {}
+        mapping: Dict[int, int] = {}
+        for local_id in sorted(set(result.ids.tolist()) - {-1}):
+            if k == 0:
+                mapping[local_id] = local_id
+            elif local_id in stitched:
+                mapping[local_id] = mappings[k - 1][stitched[local_id]]
+            else:
+                mapping[local_id] = next_id
+                next_id += 1
+            next_id = max(next_id, mapping[local_id] + 1)
+        mappings.append(mapping)
+    return mappings
+
+
+def merge_segments(results: List[SegmentResult], fps: float, video_path: str,
+                   track_states: Optional[TrackStateStore] = None) -> Tuple[TrackStateStore, List[Dict[str, Any]]]:
+    """
+    Повторяет логику пересечений process_video по сшитым трекам в порядке кадров: каждый кадр
+    берется из сегмента, который за него отвечает, поэтому пересечения в перекрытии не дублируются,
+    а трек, пересекающий границу сегментов, учитывается один раз под своим глобальным ID.
+    Переход - первый найденный в порядке кадров. Возвращает счетчики и строки нарушений.
+    """
+    track_states = track_states if track_states is not None else TrackStateStore()
+    rows: List[Dict[str, Any]] = []
+    found = [result.crosswalk for result in results if result.crosswalk is not None]
+    crosswalk_frame, crosswalk_box = min(found) if found else (None, None)
+    mappings = global_track_ids(results)
+    for k, result in enumerate(results):
+        segment = result.segment
+        if k and segment.start > results[k - 1].end: # Предыдущий сегмент остановлен раньше: дальше пробел
+            break
+        for frame_idx in range(segment.start, result.end):
+            local_ids, xyxy = result.rows(frame_idx)
+            vehicle_ids = [mappings[k].get(tid, -1) for tid in local_ids.tolist()]
+            is_red = bool(result.red[frame_idx - segment.lead_start])
+            if crosswalk_frame is not None and frame_idx >= crosswalk_frame and len(vehicle_ids):
+                xywh = np.column_stack((xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2]))
+                inter_areas = intersection_areas(xywh, crosswalk_box)
+                veh_areas = xywh[:, 2] * xywh[:, 3]
+                for i in np.flatnonzero((veh_areas > 0) & (inter_areas > 0)):
+                    tid = vehicle_ids[i]
+                    if track_states.mark_crossed(tid, frame_idx, is_red) and is_red:
+                        rows.append({
+                            'vehicle_id': str(tid),
+                            'timestamp': None,
+                            'video_second': int((frame_idx + 1) / fps),
+                            'processed_video_path': None, # Видео с разметкой в этом режиме не сохраняется
+                            'original_video_path': video_path,
+                            'evidence_clip_path': None,
+                            'vehicle_class': str(result.labels_at(frame_idx)[i])
+                        })
+            track_states.touch(vehicle_ids, frame_idx)
+            track_states.evict(frame_idx)
+        if not result.completed:
+            break
+    return track_states, rows
+
+
+def process_video_segments(
+    video_path: str,
+    workers: int,
+    detect_every: Any = 1,
+    stop_event: Any = None,
+    save_violations: bool = True,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+    overlap: float = SEGMENT_OVERLAP,
+    min_seconds: float = SEGMENT_MIN_SECONDS,
+    start_method: str = WORKER_START_METHOD,
+    recorder: Any = None
+) -> Dict[str, Any]:
+    """
+    Обрабатывает видеофайл сегментами с перекрытием в пуле из workers процессов и сшивает
+    результат: треки на границах сегментов объединяются, пересечения в перекрытиях не дублируются,
+    нарушения записываются в БД одним набором строк после сшивки. on_progress(кадров, всего)
+    вызывается не чаще PROGRESS_INTERVAL. Видео с разметкой и фрагменты нарушений не сохраняются.
+    recorder (result_cache.ResultRecorder без кадров) получает строки нарушений и итоговые счетчики,
+    если все сегменты обработаны до конца. Ошибка в сегменте или сегмент, закончившийся раньше
+    своей границы без отмены задания, завершают вызов исключением.
+    """
+    from violation_writer import ViolationWriter
+    source = FrameSource(video_path, prefetch=0)
+    fps = source.fps if source.fps and source.fps > 0 else 30
+    total_frames = max(0, source.frame_count)
+    source.close()
+    segments = plan_segments(total_frames, workers, int(overlap * fps), int(min_seconds * fps))
+    logging.info(f"Обработка {video_path} сегментами: {len(segments)} по ~{total_frames // len(segments)} кадров, "
+                 f"перекрытие {int(overlap * fps)} кадров")
+    ctx = multiprocessing.get_context(start_method)
+    progress = ctx.Value('q', 0)
+    stop = stop_event if stop_event is not None else ctx.Event()
+    threads = max(1, (os.cpu_count() or 1) // len(segments))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=len(segments), mp_context=ctx,
+                             initializer=init_segment_worker, initargs=(stop, progress, threads)) as pool:
+        futures = [pool.submit(process_segment, video_path, segment, detect_every) for segment in segments]
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=PROGRESS_INTERVAL, return_when=FIRST_EXCEPTION)
+            if any(future.exception() is not None for future in done):
+                stop.set() # Остальные сегменты бессмысленны: задание завершится ошибкой
+                break
+            if on_progress is not None:
+                on_progress(progress.value, total_frames)
+        results = [future.result() for future in futures] # Ошибка сегмента передается заданию
+    short = [result.segment.index for result in results if not result.completed]
+    if short and not stop.is_set(): # Декодер закончил кадры раньше границы сегмента: итог был бы неполным
+        raise RuntimeError(f"Сегменты {short} файла {video_path} обработаны не до конца")
+    track_states, rows = merge_segments(results, fps, video_path)
+    if save_violations and rows:
+        writer = ViolationWriter().start()
+        for row in rows:
+            writer.add(row)
+        writer.close()
+    frames = sum(max(0, result.end - result.segment.start) for result in results)
+    elapsed = time.perf_counter() - started
+    logging.info(f"Сегменты {video_path} обработаны за {datetime.timedelta(seconds=int(elapsed))}: "
+                 f"{frames} кадров, пересечений {track_states.total_crossings}, нарушений {track_states.red_light_violations}")
+    summary = {
+        "frames_processed": frames,
+        "total_frames": total_frames,
+        "fps": frames / elapsed if elapsed > 0 else 0.0,
+        "duration": elapsed,
+        "segments": len(segments),
+        "total_crossings": track_states.total_crossings,
+        "red_light_violations": track_states.red_light_violations,
+        "output_path": None
+    }
+    if recorder is not None:
+        for row in rows:
+            recorder.add_violation(row)
+        recorder.finish(not short and not stop.is_set(), summary)
+    return summary
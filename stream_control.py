@@ -0,0 +1,131 @@
+import os
+import time
+from typing import Any, Dict, Optional
+
+# --- Управление потоком кадров для медленных клиентов (переопределяется переменными окружения) ---
+FRAME_DROP_POLICY = os.environ.get("FRAME_DROP_POLICY", "latest") # "latest" - отбрасывать устаревшие кадры, "block" - ждать клиента
+TARGET_SEND_LATENCY = float(os.environ.get("TARGET_SEND_LATENCY", "0.1")) # Допустимая задержка кадра до клиента (сек.)
+JPEG_MAX_QUALITY = int(os.environ.get("JPEG_MAX_QUALITY", "90")) # Начальное и максимальное качество JPEG
+JPEG_MIN_QUALITY = int(os.environ.get("JPEG_MIN_QUALITY", "40")) # Минимальное качество JPEG
+MIN_FRAME_SCALE = float(os.environ.get("MIN_FRAME_SCALE", "0.25")) # Минимальный масштаб кадра
+QUALITY_STEP = 10 # Шаг снижения качества JPEG при перегрузке
+SCALE_STEP = 0.75 # Множитель масштаба кадра при перегрузке, когда качество уже минимально
+RECOVERY_FRAMES = 30 # Кадров без перегрузки подряд до шага повышения качества
+ADJUST_COOLDOWN = 10 # Кадров после снижения параметров, в течение которых они не меняются (кадры в пути)
+LATENCY_SMOOTHING = 0.2 # Вес нового замера в экспоненциальном сглаживании задержки
+
+# --- Режим отрисовки источника (выбирается по зрителям, читается воркером на каждом кадре) ---
+RENDER_FULL = 2 # Рамки и счетчики рисуются на сервере, каждый кадр кодируется в JPEG
+RENDER_RAW = 1 # Без отрисовки; кадры камеры без разметки кодируются с частотой METADATA_CAMERA_FPS
+RENDER_NONE = 0 # Только метаданные: клиент воспроизводит исходный файл и рисует рамки сам
+METADATA_CAMERA_FPS = float(os.environ.get("METADATA_CAMERA_FPS", "5")) # Частота кадров камеры без разметки для зрителей metadata
+
+
+class AdaptiveEncoding:
+    """
+    Подбор качества и масштаба JPEG для одного клиента по измеренной задержке.
+
+    Задержка кадра - время от кодирования кадра в воркере до завершения его отправки
+    клиенту, сглаженное экспоненциально. При задержке выше target сначала снижается
+    качество JPEG, затем масштаб кадра; после recovery кадров с задержкой ниже target/2
+    параметры восстанавливаются в обратном порядке. Значения записываются в общие
+    `multiprocessing.Value` слота воркера и применяются к следующим кадрам.
+    """
+
+    def __init__(
+        self,
+        quality: Any, # multiprocessing.Value('i') - качество JPEG, читается воркером
+        scale: Any, # multiprocessing.Value('d') - масштаб кадра, читается воркером
+        target: float = TARGET_SEND_LATENCY,
+        max_quality: int = JPEG_MAX_QUALITY,
+        min_quality: int = JPEG_MIN_QUALITY,
+        min_scale: float = MIN_FRAME_SCALE
+    ):
+        self.quality = quality
+        self.scale = scale
+        self.target = target
+        self.max_quality = max_quality
+        self.min_quality = min(min_quality, max_quality)
+        self.min_scale = min_scale
+        self.latency: Optional[float] = None # Сглаженная задержка (сек.)
+        self._calm_frames = 0 # Кадров подряд с задержкой ниже target/2
+        self._cooldown = 0 # Оставшиеся кадры без изменений после снижения параметров
+        quality.value = max_quality
+        scale.value = 1.0
+
+    def record(self, latency: float) -> None:
+        """Учитывает задержку очередного кадра и при необходимости меняет параметры кодирования."""
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency
+        if self._cooldown > 0: # Кадры, закодированные до изменения параметров, еще в пути
+            self._cooldown -= 1
+            return
+        if self.latency > self.target:
+            self._calm_frames = 0
+            self._degrade()
+        elif self.latency < self.target / 2:
+            self._calm_frames += 1
+            if self._calm_frames >= RECOVERY_FRAMES:
+                self._calm_frames = 0
+                self._recover()
+        else:
+            self._calm_frames = 0
+
+    def _degrade(self) -> None:
+        if self.quality.value > self.min_quality:
+            self.quality.value = max(self.min_quality, self.quality.value - QUALITY_STEP)
+        elif self.scale.value > self.min_scale:
+            self.scale.value = max(self.min_scale, self.scale.value * SCALE_STEP)
+        self._cooldown = ADJUST_COOLDOWN
+
+    def _recover(self) -> None:
+        if self.scale.value < 1.0:
+            self.scale.value = min(1.0, self.scale.value / SCALE_STEP)
+        elif self.quality.value < self.max_quality:
+            self.quality.value = min(self.max_quality, self.quality.value + QUALITY_STEP)
+
+
+class ConnectionStats:
+    """Статистика одного соединения /ws/video_feed: отправленные и отброшенные кадры, задержка."""
+
+    def __init__(self, source: Any, protocol: str):
+        self.source = source
+        self.protocol = protocol
+        self.started_at = time.time()
+        self.frames_sent = 0
+        self.frames_dropped = 0 # Отброшено эндпоинтом (latest-frame-wins)
+        self.worker_dropped = 0 # Не закодировано воркером из-за заполненного буфера
+        self.bytes_sent = 0
+        self.lag: Optional[float] = None # Задержка последнего кадра: от кодирования до отправки (сек.)
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+
+    def record(self, size: int, lag: float, dropped: int, worker_dropped: int) -> None:
+        self.frames_sent += 1
+        self.frames_dropped += dropped
+        self.worker_dropped = worker_dropped
+        self.bytes_sent += size
+        self.lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        self._lag_total += lag
+
+    def to_dict(self, encoding: Optional[AdaptiveEncoding] = None) -> Dict[str, Any]:
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        result = {
+            "source": self.source,
+            "protocol": self.protocol,
+            "duration": round(elapsed, 1),
+            "frames_sent": self.frames_sent,
+            "frames_dropped": self.frames_dropped + self.worker_dropped,
+            "fps": round(self.frames_sent / elapsed, 2),
+            "bytes_sent": self.bytes_sent,
+            "lag": round(self.lag, 4) if self.lag is not None else None,
+            "avg_lag": round(self._lag_total / self.frames_sent, 4) if self.frames_sent else None,
+            "max_lag": round(self.max_lag, 4)
+        }
+        if encoding is not None:
+            result["jpeg_quality"] = encoding.quality.value
+            result["frame_scale"] = round(encoding.scale.value, 3)
+        return result
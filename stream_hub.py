@@ -0,0 +1,247 @@
+import os
+import ctypes
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from stream_control import FRAME_DROP_POLICY, JPEG_MAX_QUALITY, RENDER_FULL, RENDER_NONE, RENDER_RAW, AdaptiveEncoding
+from metrics import StreamMetrics
+
+
+def source_key(video_path: Any) -> str:
+    """Ключ источника: одинаков для всех зрителей одной камеры или одного файла."""
+    if isinstance(video_path, int):
+        return f"camera:{video_path}"
+    return f"file:{os.path.realpath(video_path)}"
+
+
+class Subscriber:
+    """
+    Зритель источника. Хранит один кадр, ожидающий отправки клиенту: более свежий кадр
+    заменяет неотправленный (счетчик dropped). Качество и масштаб JPEG, подобранные
+    по задержке этого клиента, хранятся локально; воркеру передается минимум по зрителям.
+    needs_frames=False - зритель рисует рамки сам и получает только метаданные кадров.
+    """
+
+    def __init__(self, channel: "SourceChannel", needs_frames: bool = True):
+        self.channel = channel
+        self.needs_frames = needs_frames # Нужны ли зрителю размеченные сервером кадры
+        self._item: Any = None # Кадр, ожидающий отправки
+        self._has_item = False
+        self._ended = False # Поток источника завершен
+        self._ready = asyncio.Event()
+        self.dropped = 0 # Кадров, замененных более свежими до отправки (с прошлого получения)
+        self.quality = ctypes.c_int(JPEG_MAX_QUALITY) # Качество JPEG, нужное этому клиенту
+        self.scale = ctypes.c_double(1.0) # Масштаб кадра, нужный этому клиенту
+        self.encoding = AdaptiveEncoding(self.quality, self.scale)
+
+    @property
+    def idle(self) -> bool:
+        """Клиент забрал последний кадр и ждет следующий."""
+        return not self._has_item
+
+    @property
+    def worker_dropped(self) -> int:
+        """Кадров источника, отброшенных воркером без кодирования."""
+        lane = self.channel.lane
+        return lane.dropped.value if lane is not None else 0
+
+    def offer(self, item: Any, dropped: int = 0) -> None:
+        """Передает зрителю кадр (None - конец потока); dropped - кадры, пропущенные до него."""
+        if item is None:
+            self._ended = True
+        else:
+            if self._has_item:
+                dropped += 1
+            self._item, self._has_item = item, True
+            self.dropped += dropped
+        self._ready.set()
+
+    async def recv(self) -> Tuple[Any, int]:
+        """Ожидает кадр. Возвращает ((meta, bytes) или None в конце потока, число отброшенных кадров)."""
+        while not self._has_item:
+            if self._ended:
+                return None, 0
+            self._ready.clear()
+            await self._ready.wait()
+        item, dropped = self._item, self.dropped
+        self._item, self._has_item, self.dropped = None, False, 0
+        self.channel.wakeup() # Конвейер может ждать освободившегося зрителя
+        return item, dropped
+
+    def record_latency(self, latency: float) -> None:
+        """Учитывает задержку отправленного кадра и обновляет параметры кодирования источника."""
+        self.encoding.record(latency)
+        self.channel.apply_encoding()
+
+
+class SourceChannel:
+    """
+    Один конвейер обработки источника (слот воркера пула) и его зрители.
+
+    Фоновая задача читает кадры из кольцевого буфера слота и раздает каждый кадр всем
+    зрителям без повторного кодирования. При FRAME_DROP_POLICY="latest" следующий кадр
+    читается, как только хотя бы один зритель готов его принять (остальным он заменяет
+    неотправленный); если не успевает никто, буфер заполняется и воркер отбрасывает кадры
+    до кодирования. При "block" конвейер ждет самого медленного зрителя.
+    """
+
+    def __init__(self, hub: "StreamHub", key: str, video_path: Any):
+        self.hub = hub
+        self.key = key
+        self.video_path = video_path
+        self.subscribers: List[Subscriber] = []
+        self.lane: Any = None # Слот воркера пула, назначается после запуска
+        self.frames = 0 # Кадров, полученных от воркера
+        self.closed = False # Зрителей не осталось, конвейер останавливается
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.get_running_loop().create_task(self._pump())
+
+    def wakeup(self) -> None:
+        self._wakeup.set()
+
+    def _can_send(self) -> bool:
+        idle = [s.idle for s in self.subscribers]
+        return any(idle) if FRAME_DROP_POLICY == "latest" else bool(idle) and all(idle)
+
+    def render_mode(self) -> int:
+        """
+        Режим отрисовки по зрителям: размеченные кадры, если они нужны хотя бы одному;
+        иначе для камеры - кадры без разметки с пониженной частотой (файл клиент воспроизводит сам).
+        """
+        if any(s.needs_frames for s in self.subscribers):
+            return RENDER_FULL
+        return RENDER_RAW if isinstance(self.video_path, int) else RENDER_NONE
+
+    def apply_encoding(self) -> None:
+        """Передает воркеру режим отрисовки и наименьшие качество и масштаб JPEG среди зрителей."""
+        if self.lane is None or not self.subscribers:
+            return
+        render = self.render_mode()
+        if self.lane.render.value != render:
+            self.lane.render.value = render
+        quality = min(s.quality.value for s in self.subscribers)
+        scale = min(s.scale.value for s in self.subscribers)
+        if self.lane.quality.value != quality:
+            self.lane.quality.value = quality
+        if self.lane.scale.value != scale:
+            self.lane.scale.value = scale
+
+    async def _pump(self) -> None:
+        """Назначает источник слоту воркера и раздает кадры зрителям до конца потока или ухода зрителей."""
+        stream_finished = False # Воркер сообщил о завершении потока кадров
+        try:
+            self.lane = await self.hub.pool.acquire(self.video_path)
+            self.hub.metrics.start_session(self.key, self.lane)
+            if self.closed: # Все зрители ушли, пока ожидался свободный воркер
+                return
+            self.apply_encoding()
+            ring = self.lane.ring
+            while True:
+                while not self.closed and not self._can_send():
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                if self.closed:
+                    break
+                if FRAME_DROP_POLICY == "latest": # Самый свежий кадр, устаревшие отбрасываются
+                    item, dropped = await ring.recv_latest_async()
+                else:
+                    item, dropped = await ring.recv_async(), 0
+                if item is None: # Сигнал о завершении от воркера
+                    stream_finished = True
+                    break
+                self.frames += 1
+                for subscriber in self.subscribers:
+                    subscriber.offer(item, dropped)
+        except Exception:
+            logging.exception(f"Ошибка конвейера источника {self.key}")
+        finally:
+            self.hub._remove(self)
+            for subscriber in self.subscribers:
+                subscriber.offer(None)
+            if self.lane is not None:
+                await self.hub.pool.release(self.lane, stream_finished)
+                self.hub.metrics.finish_session(self.key, self.lane) # Метрики сессии - в итоги источника
+            self.hub._drop_metrics(self.key)
+            logging.info(f"Конвейер источника {self.key} остановлен, кадров: {self.frames}")
+
+    def subscribe(self, needs_frames: bool = True) -> Subscriber:
+        subscriber = Subscriber(self, needs_frames)
+        self.subscribers.append(subscriber)
+        self.apply_encoding()
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        if subscriber in self.subscribers:
+            self.subscribers.remove(subscriber)
+        if not self.subscribers: # Последний зритель ушел: источник больше не обрабатывается
+            self.closed = True
+            self.hub._remove(self)
+            if self.lane is not None:
+                self.lane.stop_event.set() # Прерывает ожидание кадров от воркера
+        else:
+            self.apply_encoding()
+        self.wakeup()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "source": self.key,
+            "subscribers": len(self.subscribers),
+            "frames": self.frames,
+            "worker_dropped": self.lane.dropped.value if self.lane is not None else 0,
+            "jpeg_quality": self.lane.quality.value if self.lane is not None else None,
+            "frame_scale": round(self.lane.scale.value, 3) if self.lane is not None else None,
+            "render": self.render_mode()
+        }
+
+
+class StreamHub:
+    """
+    Публикация/подписка кадров по источникам для /ws/video_feed.
+    Первый зритель источника запускает конвейер в слоте пула воркеров, следующие
+    подключаются к нему же; после ухода последнего зрителя конвейер останавливается
+    и слот возвращается в пул. Используется только из цикла событий asyncio.
+    """
+
+    def __init__(self, pool: Any):
+        self.pool = pool
+        self.metrics = StreamMetrics() # Метрики источников для /metrics
+        self._channels: Dict[str, SourceChannel] = {}
+
+    def subscribe(self, video_path: Any, needs_frames: bool = True) -> Subscriber:
+        """
+        Подписывает зрителя на источник, при необходимости запуская его обработку.
+        needs_frames=False - зрителю достаточно метаданных (протокол metadata).
+        """
+        key = source_key(video_path)
+        channel = self._channels.get(key)
+        if channel is None:
+            channel = SourceChannel(self, key, video_path)
+            self._channels[key] = channel
+            self.metrics.open(key)
+            channel.start()
+            logging.info(f"Запущен конвейер источника {key}")
+        return channel.subscribe(needs_frames)
+
+    def unsubscribe(self, subscriber: Subscriber) -> None:
+        subscriber.channel.unsubscribe(subscriber)
+
+    def _remove(self, channel: SourceChannel) -> None:
+        """Убирает конвейер из реестра; новые зрители источника запустят новый."""
+        if self._channels.get(channel.key) is channel:
+            del self._channels[channel.key]
+
+    def _drop_metrics(self, key: str) -> None:
+        """Удаляет метрики остановленного источника, если новый зритель не запустил его снова."""
+        if key not in self._channels:
+            self.metrics.remove(key)
+
+    def channels(self) -> List[SourceChannel]:
+        return list(self._channels.values())
+
+    def sources(self) -> List[Dict[str, Any]]:
+        """Состояние активных конвейеров."""
+        return [channel.to_dict() for channel in list(self._channels.values())]
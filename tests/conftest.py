@@ -0,0 +1,13 @@
+"""
+Общие настройки тестов. Тесты проверяют чистые функции и классы без модели и внешней БД:
+модули импортируются из корня репозитория, БД по умолчанию - SQLite в памяти,
+постоянные кэши (калибровка, результаты) отключены, пока тест не задаст свой каталог.
+"""
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+os.environ.setdefault("CALIBRATION_CACHE_PATH", "")
+os.environ.setdefault("RESULT_CACHE_DIR", "")
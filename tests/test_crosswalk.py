@@ -0,0 +1,111 @@
+import json
+import multiprocessing
+
+import cv2
+import numpy as np
+import pytest
+
+from calibration import CalibrationCache
+from utils import cluster_centers, detect_crosswalk, valid_box
+
+LIGHT_BOX = (50, 50, 20, 40) # Светофор над переходом (x, y, w, h)
+
+
+def crosswalk_frame(stripe_tops, width: int = 640, height: int = 480) -> np.ndarray:
+    """Темный зашумленный кадр с белыми полосами зебры 25x60 с шагом 40 пикс. от x=200."""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(40, 80, (height, width, 3)).astype(np.uint8)
+    for i, top in enumerate(stripe_tops):
+        x = 200 + 40 * i
+        cv2.rectangle(frame, (x, top), (x + 25, top + 60), (255, 255, 255), -1)
+    return frame
+
+
+# --- cluster_centers ---
+def test_cluster_centers_empty():
+    assert cluster_centers(np.zeros((0, 2))).tolist() == []
+
+
+def test_cluster_centers_separates_distant_groups():
+    centers = np.array([[0, 0], [10, 5], [500, 500], [20, 0], [510, 490]])
+    assert cluster_centers(centers, max_distance=100).tolist() == [0, 0, 1, 0, 1]
+
+
+def test_cluster_centers_requires_all_members_close():
+    # Третий центр близок ко второму, но далек от первого: кластер не растягивается цепочкой
+    centers = np.array([[0, 0], [60, 0], [120, 0]])
+    assert cluster_centers(centers, max_distance=100).tolist() == [0, 0, 1]
+
+
+# --- detect_crosswalk ---
+def test_detect_crosswalk_spans_stripe_centers():
+    box = detect_crosswalk(crosswalk_frame([300, 310, 320]), LIGHT_BOX)
+    assert box == (0, 330, 640, 20) # По всей ширине кадра, по y - от верхнего до нижнего центра полос
+
+
+def test_detect_crosswalk_rejects_single_row_of_stripes():
+    # Центры всех полос в одной строке: рамка нулевой высоты не возвращается
+    assert detect_crosswalk(crosswalk_frame([300, 300, 300]), LIGHT_BOX) is None
+
+
+def test_detect_crosswalk_ignores_stripes_above_light():
+    assert detect_crosswalk(crosswalk_frame([300, 310, 320]), (50, 400, 20, 40)) is None
+
+
+def test_detect_crosswalk_without_stripes():
+    assert detect_crosswalk(crosswalk_frame([]), LIGHT_BOX) is None
+
+
+def test_valid_box():
+    assert valid_box((0, 10, 100, 20))
+    assert not valid_box((0, 10, 100, 0))
+    assert not valid_box((0, 10, 0, 20))
+    assert not valid_box(None)
+
+
+# --- CalibrationCache ---
+def test_calibration_roundtrip(tmp_path):
+    pytest.importorskip("filelock")
+    path = str(tmp_path / "calibration" / "crosswalk.json")
+    cache = CalibrationCache(path)
+    cache.put("file:a", (0, 200, 450, 60), (450, 360))
+    assert CalibrationCache(path).get("file:a", (450, 360)) == (0, 200, 450, 60)
+    assert cache.get("file:a", (640, 480)) is None # Другое разрешение
+    assert cache.get("file:b") is None
+
+
+def test_calibration_rejects_degenerate_box(tmp_path):
+    path = tmp_path / "crosswalk.json"
+    cache = CalibrationCache(str(path))
+    cache.put("file:a", (0, 201, 352, 0), (352, 288))
+    assert not path.exists()
+    # Вырожденная запись, сохраненная прежней версией, не используется: переход ищется заново
+    path.write_text(json.dumps({"file:a": {"crosswalk": [0, 201, 352, 0], "frame_size": [352, 288]}}))
+    assert cache.get("file:a", (352, 288)) is None
+
+
+def test_calibration_disabled():
+    cache = CalibrationCache("")
+    cache.put("file:a", (0, 200, 450, 60), (450, 360))
+    assert cache.get("file:a") is None
+
+
+def put_calibrations(path: str, worker: int, count: int) -> None:
+    """Процесс воркера: записывает count рамок в общий кэш калибровки."""
+    cache = CalibrationCache(path)
+    for i in range(count):
+        cache.put(f"file:{worker}-{i}", (0, 200, 450, 60 + i), (450, 360))
+
+
+def test_calibration_writes_from_processes_are_not_lost(tmp_path):
+    pytest.importorskip("filelock")
+    path = str(tmp_path / "crosswalk.json")
+    ctx = multiprocessing.get_context("spawn")
+    processes = [ctx.Process(target=put_calibrations, args=(path, worker, 20)) for worker in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+    with open(path, encoding="utf-8") as f:
+        assert len(json.load(f)) == 4 * 20
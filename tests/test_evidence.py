@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+
+from evidence import EvidenceRecorder
+
+FPS = 10.0
+
+
+def frame(i: int) -> np.ndarray:
+    return np.full((48, 64, 3), i * 10 % 256, dtype=np.uint8)
+
+
+def clip_frames(path: str) -> int:
+    cap = cv2.VideoCapture(path)
+    count = 0
+    while cap.read()[0]:
+        count += 1
+    cap.release()
+    return count
+
+
+def test_clip_contains_pre_and_post_frames(tmp_path, monkeypatch):
+    encoded = []
+    monkeypatch.setattr(cv2, "imencode", lambda *args: encoded.append(args) or (False, None))
+    recorder = EvidenceRecorder(str(tmp_path / "evidence"), FPS, pre_seconds=0.5, post_seconds=0.3, backend="opencv")
+    for i in range(20):
+        if i == 10:
+            path = recorder.trigger(i, "f10_id1")
+        recorder.add(frame(i), i)
+    recorder.close()
+    assert recorder.clips == [path]
+    assert clip_frames(path) == 5 + 4 # Кадры 5-9 из буфера, кадр нарушения и три после него
+    assert encoded == [] # Кадры в буфере не сжимаются в JPEG
+
+
+def test_violation_during_clip_extends_it(tmp_path):
+    recorder = EvidenceRecorder(str(tmp_path / "evidence"), FPS, pre_seconds=0.2, post_seconds=0.3, backend="opencv")
+    paths = []
+    for i in range(20):
+        if i in (5, 7):
+            paths.append(recorder.trigger(i, f"f{i}_id1"))
+        recorder.add(frame(i), i)
+    recorder.close()
+    assert paths[0] == paths[1] and recorder.clips == paths[:1]
+    assert clip_frames(paths[0]) == 2 + 6 # Кадры 3-4 из буфера и кадры 5-10
+
+
+def test_buffer_respects_memory_limit(tmp_path):
+    size = frame(0).nbytes
+    recorder = EvidenceRecorder(str(tmp_path / "evidence"), FPS, pre_seconds=1.0, post_seconds=0.0,
+                                buffer_mb=3 * size / 1024 / 1024, backend="opencv")
+    for i in range(10):
+        recorder.add(frame(i), i)
+    path = recorder.trigger(10, "f10_id1")
+    recorder.add(frame(10), 10)
+    recorder.close()
+    assert clip_frames(path) == 3 + 1 # В буфере помещаются только три последних кадра
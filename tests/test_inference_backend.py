@@ -0,0 +1,94 @@
+import sys
+import types
+from types import SimpleNamespace
+
+import pytest
+
+from inference_backend import limit_runtime_threads, runtime_threads_callback
+
+
+class FakeSessionOptions:
+    def __init__(self):
+        self.intra_op_num_threads = 0
+        self.inter_op_num_threads = 0
+
+
+class FakeSession:
+    def __init__(self, path, sess_options=None, providers=None):
+        self.path = path
+        self.sess_options = sess_options
+        self.providers = providers
+
+    def get_providers(self):
+        return self.providers
+
+
+class FakeCore:
+    instances = []
+
+    def __init__(self):
+        self.properties = {}
+        FakeCore.instances.append(self)
+
+    def set_property(self, device, properties):
+        self.properties[device] = properties
+
+    def read_model(self, model, weights):
+        parameter = SimpleNamespace(get_layout=lambda: SimpleNamespace(empty=False))
+        return SimpleNamespace(path=model, weights=weights, get_parameters=lambda: [parameter])
+
+    def compile_model(self, model, device_name, config):
+        return SimpleNamespace(model=model, device_name=device_name, config=config, core=self)
+
+
+@pytest.fixture
+def onnxruntime(monkeypatch):
+    module = types.ModuleType("onnxruntime")
+    module.SessionOptions = FakeSessionOptions
+    module.InferenceSession = FakeSession
+    monkeypatch.setitem(sys.modules, "onnxruntime", module)
+    return module
+
+
+@pytest.fixture
+def openvino(monkeypatch):
+    module = types.ModuleType("openvino")
+    module.Core = FakeCore
+    module.Layout = str
+    monkeypatch.setitem(sys.modules, "openvino", module)
+    FakeCore.instances.clear()
+    return module
+
+
+def test_onnx_session_gets_intra_op_threads(onnxruntime):
+    backend_model = SimpleNamespace(session=FakeSession("model.onnx", providers=["CPUExecutionProvider"]))
+    predictor = SimpleNamespace(model=backend_model)
+    callback = runtime_threads_callback("onnx", "model.onnx", 3)
+    callback(predictor)
+    session = backend_model.session
+    assert session.sess_options.intra_op_num_threads == 3
+    assert session.providers == ["CPUExecutionProvider"] # Провайдеры AutoBackend сохраняются
+    callback(predictor) # Повторный вызов predict/track сессию не пересоздает
+    assert backend_model.session is session
+
+
+def test_openvino_model_gets_inference_threads(openvino, tmp_path):
+    export_dir = tmp_path / "best_openvino_model"
+    export_dir.mkdir()
+    (export_dir / "best.xml").write_text("")
+    backend_model = SimpleNamespace(ov_compiled_model=None, device_name="AUTO", inference_mode="LATENCY")
+    runtime_threads_callback("openvino", str(export_dir), 2)(SimpleNamespace(model=backend_model))
+    compiled = backend_model.ov_compiled_model
+    assert compiled.core.properties["CPU"] == {"INFERENCE_NUM_THREADS": 2}
+    assert compiled.device_name == "AUTO" and compiled.config == {"PERFORMANCE_HINT": "LATENCY"}
+    assert compiled.model.path == str(export_dir / "best.xml")
+
+
+def test_limit_runtime_threads_registers_callback():
+    callbacks = []
+    model = SimpleNamespace(add_callback=lambda event, func: callbacks.append(event))
+    limit_runtime_threads(model, "torch", "best.pt", 2) # torch ограничивает limit_threads
+    limit_runtime_threads(model, "onnx", "model.onnx", 0)
+    assert callbacks == []
+    limit_runtime_threads(model, "onnx", "model.onnx", 2)
+    assert callbacks == ["on_predict_start"]
@@ -0,0 +1,84 @@
+import time
+import textwrap
+
+import cv2
+import numpy as np
+import pytest
+
+from jobs import CANCELLED, COMPLETED, FINISHED_STATES, JobManager
+
+FRAMES = 20
+FPS = 10.0
+
+# Заменяет yolo8_video в процессах задания и сегментов (модель не загружается): кадр без ТС и перехода
+FAKE_PIPELINE = textwrap.dedent('''
+    import cv2
+
+
+    def process_video(video_path, start_frame=0, end_frame=None, **kwargs):
+        cap = cv2.VideoCapture(video_path)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        for _ in range(start_frame, total if end_frame is None else min(end_frame, total)):
+            yield {"vehicles": [], "traffic_lights": [], "crosswalk_bbox": None,
+                   "total_crossings": 0, "red_light_violations": 0}
+''')
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = str(tmp_path / "video.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), FPS, (64, 48))
+    for i in range(FRAMES):
+        writer.write(np.full((48, 64, 3), i * 10, dtype=np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def fake_pipeline(tmp_path, monkeypatch):
+    """Модуль yolo8_video-заглушка; путь к нему и настройки сегментов наследуют процессы spawn."""
+    directory = tmp_path / "pipeline"
+    directory.mkdir()
+    (directory / "yolo8_video.py").write_text(FAKE_PIPELINE, encoding="utf-8")
+    monkeypatch.syspath_prepend(str(directory))
+    monkeypatch.setenv("SEGMENT_MIN_SECONDS", "0.5")
+    monkeypatch.setenv("SEGMENT_OVERLAP", "0.3")
+
+
+def wait_finished(manager: JobManager, job_id: str, timeout: float = 120.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = manager.status(job_id)
+        if status["status"] in FINISHED_STATES:
+            return status
+        time.sleep(0.1)
+    raise AssertionError(f"Задание {job_id} не завершилось за {timeout} сек.")
+
+
+def test_segmented_job_runs_in_job_process(fake_pipeline, video):
+    """Задание по сегментам запускает пул процессов из процесса задания (run_job -> run_segmented_job)."""
+    manager = JobManager(concurrency=1, start_method="spawn")
+    manager.start()
+    try:
+        job = manager.submit(video, {"segments": 2})
+        status = wait_finished(manager, job.id)
+    finally:
+        manager.shutdown()
+    assert status["status"] == COMPLETED, status["error"]
+    assert status["result"]["segments"] == 2
+    assert status["frames_processed"] == FRAMES
+
+
+def test_shutdown_stops_idle_slot_threads():
+    manager = JobManager(concurrency=2, max_queue=1, start_method="spawn")
+    manager.start()
+    manager.shutdown()
+    assert not any(slot.thread.is_alive() for slot in manager._slots)
+
+
+def test_shutdown_cancels_queued_jobs():
+    manager = JobManager(concurrency=1, start_method="spawn") # Исполнители не запущены: задание ждет в очереди
+    job = manager.submit("videos/test.mp4")
+    manager.shutdown()
+    assert manager.status(job.id)["status"] == CANCELLED
@@ -0,0 +1,54 @@
+import ctypes
+from types import SimpleNamespace
+
+from metrics import WORKER_STAGES, StageHistograms, StreamMetrics, render_metrics
+
+
+def lane(dropped: int = 0) -> SimpleNamespace:
+    """Слот воркера: гистограммы этапов и счетчик отброшенных кадров (как WorkerLane)."""
+    metrics = StageHistograms(WORKER_STAGES)
+    metrics.observe("inference", 0.02)
+    return SimpleNamespace(metrics=metrics, dropped=ctypes.c_int(dropped))
+
+
+def rendered(metrics: StreamMetrics) -> str:
+    hub = SimpleNamespace(metrics=metrics, channels=lambda: [])
+    pool = SimpleNamespace(active_sessions=lambda: 0, workers=lambda: [])
+    return render_metrics(hub, pool, 0)
+
+
+def test_session_totals_survive_until_source_removed():
+    metrics = StreamMetrics()
+    metrics.open("file:/a.mp4")
+    first = lane(dropped=2)
+    metrics.start_session("file:/a.mp4", first)
+    metrics.finish_session("file:/a.mp4", first)
+    second = lane()
+    metrics.start_session("file:/a.mp4", second)
+    assert metrics.worker("file:/a.mp4").series("inference")[2] == 2 # Итоги и текущая сессия
+    assert metrics.dropped("file:/a.mp4", "worker") == 2
+
+
+def test_remove_drops_source_series():
+    metrics = StreamMetrics()
+    for key in ("file:/a.mp4", "file:/b.mp4"):
+        metrics.open(key)
+        metrics.viewer(key).observe("send", 0.01)
+        metrics.add_dropped(key, "viewer", 3)
+        session = lane(dropped=1)
+        metrics.start_session(key, session)
+        metrics.finish_session(key, session)
+    metrics.remove("file:/a.mp4")
+    assert metrics.keys() == ["file:/b.mp4"]
+    text = rendered(metrics)
+    assert 'stream="file:/a.mp4"' not in text
+    assert 'stream="file:/b.mp4"' in text
+
+
+def test_stopped_source_is_not_recreated():
+    metrics = StreamMetrics()
+    metrics.open("camera:0")
+    metrics.remove("camera:0")
+    metrics.viewer("camera:0").observe("queue", 0.01) # Кадр, отправленный после остановки конвейера
+    metrics.add_dropped("camera:0", "viewer", 1)
+    assert metrics.keys() == []
@@ -0,0 +1,73 @@
+import ctypes
+from types import SimpleNamespace
+
+import pytest
+
+from stream_control import RENDER_FULL, RENDER_NONE, RENDER_RAW
+from stream_hub import SourceChannel
+from wire_protocol import LEGACY_PROTOCOL, METADATA_PROTOCOL, negotiate_protocol
+
+
+def lane():
+    """Слот воркера: общие значения, которые читает воркер (как WorkerLane)."""
+    return SimpleNamespace(render=ctypes.c_int(RENDER_FULL), quality=ctypes.c_int(90), scale=ctypes.c_double(1.0))
+
+
+@pytest.mark.parametrize("requested, expected", [
+    (["metadata", "legacy"], METADATA_PROTOCOL), # Клиент с флажком «Рамки на клиенте»
+    ("metadata", METADATA_PROTOCOL),
+    (["legacy"], LEGACY_PROTOCOL), # Клиент по умолчанию: размеченные сервером кадры
+    (None, LEGACY_PROTOCOL),
+])
+def test_metadata_protocol_is_opt_in(requested, expected):
+    assert negotiate_protocol(requested) == expected
+
+
+@pytest.mark.parametrize("source, metadata_only", [("videos/4.mp4", RENDER_NONE), (0, RENDER_RAW)])
+def test_render_mode_follows_subscribers(source, metadata_only):
+    channel = SourceChannel(None, "key", source)
+    channel.lane = lane()
+    viewer = channel.subscribe(needs_frames=False)
+    assert channel.render_mode() == metadata_only
+    assert channel.lane.render.value == metadata_only # Режим передан воркеру
+    legacy = channel.subscribe(needs_frames=True)
+    assert channel.lane.render.value == RENDER_FULL # Любой зритель legacy/delta возвращает отрисовку на сервере
+    channel.subscribers.remove(legacy)
+    channel.apply_encoding()
+    assert channel.lane.render.value == metadata_only
+    assert viewer.needs_frames is False
+
+
+# --- video_url для протокола metadata ---
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+    import main
+    directory = tmp_path / "uploaded_videos"
+    directory.mkdir()
+    monkeypatch.setattr(main, "UPLOAD_DIR", str(directory))
+    return directory
+
+
+def test_metadata_for_uploaded_file_has_video_url(upload_dir):
+    from main import select_protocol
+    video = upload_dir / "id_video.mp4"
+    video.write_bytes(b"")
+    assert select_protocol(["metadata", "legacy"], str(video)) == (METADATA_PROTOCOL, "/uploaded_videos/id_video.mp4")
+
+
+def test_file_outside_upload_dir_falls_back_to_server_frames(upload_dir, tmp_path):
+    from main import select_protocol
+    video = tmp_path / "videos" / "test.mp4" # Как videos/*.mp4: по /uploaded_videos недоступен
+    video.parent.mkdir()
+    video.write_bytes(b"")
+    assert select_protocol(["metadata", "legacy"], str(video)) == (LEGACY_PROTOCOL, None)
+    assert select_protocol(["metadata", "delta"], str(video)) == ("delta", None)
+    nested = upload_dir / "nested" / "video.mp4" # Эндпоинт отдает только файлы верхнего уровня UPLOAD_DIR
+    nested.parent.mkdir()
+    nested.write_bytes(b"")
+    assert select_protocol("metadata", str(nested)) == (LEGACY_PROTOCOL, None)
+
+
+def test_metadata_for_camera_has_no_video_url(upload_dir):
+    from main import select_protocol
+    assert select_protocol(["metadata", "legacy"], 0) == (METADATA_PROTOCOL, None)
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+
+import pytest
+
+import calibration
+import result_cache
+from calibration import source_fingerprint
+from result_cache import KEY_LENGTH, RESULT_FILE, TMP_MAX_AGE, ResultCache, ResultRecorder, cache_key, pipeline_config
+
+
+@pytest.fixture
+def weights(tmp_path, monkeypatch):
+    """Файл весов модели для pipeline_config; хэш весов вычисляется заново в каждом тесте."""
+    path = tmp_path / "best.pt"
+    path.write_bytes(b"weights")
+    monkeypatch.setattr(result_cache, "MODEL_WEIGHTS", str(path))
+    result_cache.model_digest.cache_clear()
+    yield path
+    result_cache.model_digest.cache_clear()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(str(tmp_path / "results"), max_bytes=1024 ** 2)
+
+
+def record(cache: ResultCache, key: str, frames: bool = True, count: int = 3) -> bool:
+    """Запись count кадров под ключом key; возвращает результат finish."""
+    recorder = ResultRecorder(cache, key, "sha", {"detect_every": 1}, frames)
+    for i in range(count):
+        recorder.add_frame({"frame": i, "total_crossings": i, "red_light_violations": 0, "drawn": True})
+    return recorder.finish(True)
+
+
+def make_entry(cache: ResultCache, key: str, size: int, used: float) -> str:
+    """Каталог записи размером около size байт, последнее использование - used."""
+    path = cache.entry_dir(key)
+    os.makedirs(path)
+    with open(os.path.join(path, "frames.jsonl.gz"), "wb") as f:
+        f.write(b"\0" * size)
+    result_path = os.path.join(path, RESULT_FILE)
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({"key": key}, f)
+    os.utime(result_path, (used, used))
+    return path
+
+
+# --- Ключ записи ---
+def test_cache_key_is_deterministic_and_config_sensitive():
+    key = cache_key("a" * 64, {"detect_every": 1, "imgsz": 640})
+    assert key == cache_key("a" * 64, {"imgsz": 640, "detect_every": 1}) # Порядок полей не важен
+    assert len(key) == KEY_LENGTH and key.isalnum()
+    assert key != cache_key("b" * 64, {"detect_every": 1, "imgsz": 640})
+    assert key != cache_key("a" * 64, {"detect_every": 2, "imgsz": 640})
+
+
+def test_pipeline_config_requires_weights(tmp_path, monkeypatch):
+    monkeypatch.setattr(result_cache, "MODEL_WEIGHTS", str(tmp_path / "missing.pt"))
+    result_cache.model_digest.cache_clear()
+    try:
+        assert pipeline_config(1) is None
+    finally:
+        result_cache.model_digest.cache_clear()
+
+
+def test_pipeline_config_depends_on_detect_every(weights):
+    assert pipeline_config(1)["detect_every"] == 1
+    assert pipeline_config("1") == pipeline_config(1)
+    assert pipeline_config(2) != pipeline_config(1)
+    assert pipeline_config("auto")["max_detect_interval"] is not None
+
+
+# --- Запись результатов ---
+def test_recorder_commits_completed_processing(cache):
+    assert record(cache, "abc")
+    entry = cache.get("abc")
+    assert entry["result"] == {"frames_processed": 3, "total_frames": 3, "total_crossings": 2, "red_light_violations": 0}
+    frames = list(cache.frames("abc"))
+    assert [frame["frame"] for frame in frames] == [0, 1, 2]
+    assert all("drawn" not in frame for frame in frames) # Поля сессии в кэш не попадают
+    assert not [name for name in os.listdir(cache.directory) if name.startswith(".")]
+
+
+def test_recorder_discards_incomplete_processing(cache):
+    recorder = ResultRecorder(cache, "abc", "sha", {}, frames=True)
+    recorder.add_frame({"frame": 0})
+    assert not recorder.finish(False)
+    assert cache.get("abc") is None
+    assert os.listdir(cache.directory) == []
+
+
+def test_install_replaces_entry_only_with_richer_one(cache):
+    assert record(cache, "abc", frames=False)
+    assert record(cache, "abc", frames=True) # Новая запись с кадрами заменяет прежнюю
+    assert cache.get("abc")["frames"]
+    assert record(cache, "abc", frames=False, count=5) # Запись без кадров прежнюю не заменяет
+    entry = cache.get("abc")
+    assert entry["frames"] and entry["result"]["frames_processed"] == 3
+
+
+def test_get_rejects_path_like_keys(cache):
+    assert record(cache, "abc")
+    assert cache.get("../abc") is None
+    assert cache.get("") is None
+
+
+def test_disabled_cache():
+    cache = ResultCache("")
+    assert not cache.enabled
+    assert cache.get("abc") is None
+    assert cache.source_digest(__file__, compute=True) is None
+
+
+# --- Вытеснение ---
+def test_evict_removes_least_recently_used(cache):
+    now = time.time()
+    cache.max_bytes = 2500
+    make_entry(cache, "old", 1000, now - 300)
+    make_entry(cache, "used", 1000, now - 200)
+    make_entry(cache, "new", 1000, now - 100)
+    cache.get("used") # Использование обновляет время записи
+    cache.evict()
+    assert sorted(os.listdir(cache.directory)) == ["new", "used"]
+
+
+def test_evict_keeps_cache_within_limit(cache):
+    now = time.time()
+    cache.max_bytes = 1500
+    for i in range(4):
+        make_entry(cache, f"entry{i}", 1000, now - 100 * (4 - i))
+    cache.evict()
+    assert os.listdir(cache.directory) == ["entry3"]
+
+
+def test_evict_removes_abandoned_tmp_dirs(cache):
+    now = time.time()
+    stale = os.path.join(cache.directory, ".tmp-old-1-1")
+    fresh = os.path.join(cache.directory, ".tmp-new-1-1")
+    os.makedirs(stale)
+    os.makedirs(fresh)
+    os.utime(stale, (now - TMP_MAX_AGE - 60, now - TMP_MAX_AGE - 60))
+    cache.evict()
+    assert not os.path.exists(stale)
+    assert os.path.isdir(fresh) # Запись, которую еще ведет другой процесс, не удаляется
+
+
+# --- SHA-256 источников ---
+def test_source_digest_tracks_file_changes(cache, tmp_path):
+    pytest.importorskip("filelock")
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"first")
+    assert cache.source_digest(str(video)) is None
+    digest = cache.source_digest(str(video), compute=True)
+    assert digest == result_cache.file_sha256(str(video))
+    assert cache.source_digest(str(video)) == digest # Из sources.json, без чтения файла
+    video.write_bytes(b"second version")
+    assert cache.source_digest(str(video)) is None # Файл изменился: прежний хэш не используется
+    assert cache.source_digest(str(video), compute=True) != digest
+
+
+def test_key_for_uses_registered_digest(cache, tmp_path, weights):
+    pytest.importorskip("filelock")
+    video = tmp_path / "video.mp4"
+    video.write_bytes(b"video")
+    assert cache.key_for(str(video)) is None
+    cache.register_source(str(video), "f" * 64)
+    assert cache.key_for(str(video), 1) == cache_key("f" * 64, pipeline_config(1))
+
+
+def test_repeat_upload_hits_after_calibration_write(cache, tmp_path, weights, monkeypatch):
+    """Первая обработка записывает калибровку перехода; повторная загрузка того же содержимого находит запись."""
+    pytest.importorskip("filelock")
+    crosswalks = calibration.crosswalk_cache # Общий кэш калибровки, который пишет process_video
+    monkeypatch.setattr(crosswalks, "path", str(tmp_path / "crosswalk.json"))
+    first = tmp_path / "upload-1.mp4"
+    first.write_bytes(b"video content")
+    recorder = cache.recorder(str(first), 1, compute=True)
+    crosswalks.put(source_fingerprint(str(first)), (0, 100, 640, 40), (640, 480)) # Переход найден обработкой
+    recorder.add_frame({"frame": 0, "total_crossings": 1, "red_light_violations": 0})
+    assert recorder.finish(True)
+    second = tmp_path / "upload-2.mp4"
+    second.write_bytes(b"video content")
+    assert cache.key_for(str(second), 1, compute=True) == recorder.key
+    entry = cache.find(str(second), 1)
+    assert entry is not None and entry["result"]["total_crossings"] == 1
@@ -0,0 +1,140 @@
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pytest
+
+from segments import Segment, SegmentResult, global_track_ids, merge_segments, plan_segments, stitch_tracks
+from track_state import TrackStateStore
+
+CROSSWALK = (0, 200, 640, 40) # Переход (x, y, w, h)
+FPS = 10.0
+Row = Tuple[int, int, Tuple[int, int, int, int]] # Кадр, ID трека, рамка x1, y1, x2, y2
+
+
+def make_result(segment: Segment, rows: Iterable[Row], end: int, red: bool = False,
+                crosswalk: Optional[Tuple[int, Tuple[int, int, int, int]]] = None,
+                completed: bool = True) -> SegmentResult:
+    """SegmentResult сегмента, обработанного с lead_start до кадра end (не включая)."""
+    rows = sorted(rows)
+    result = SegmentResult(segment)
+    result.frames = np.array([r[0] for r in rows], dtype=np.int64)
+    result.ids = np.array([r[1] for r in rows], dtype=np.int64)
+    result.boxes = np.array([r[2] for r in rows], dtype=np.int64).reshape(-1, 4)
+    result.labels = np.array(["car"] * len(rows), dtype=str)
+    result.red = np.full(end - segment.lead_start, red, dtype=bool)
+    result.crosswalk = crosswalk
+    result.completed = completed
+    return result
+
+
+def track(tid: int, frames: Iterable[int], y0: int = 100, step: int = 5) -> List[Row]:
+    """ТС, движущееся вниз на step пикс. за кадр (координата y зависит только от кадра)."""
+    return [(f, tid, (300, y0 + step * f, 340, y0 + step * f + 20)) for f in frames]
+
+
+# --- plan_segments ---
+def test_plan_segments_splits_with_overlap():
+    segments = plan_segments(1000, workers=4, overlap_frames=20, min_frames=100)
+    assert [(s.lead_start, s.start, s.end) for s in segments] == [
+        (0, 0, 250), (230, 250, 500), (480, 500, 750), (730, 750, None)
+    ]
+
+
+def test_plan_segments_respects_minimum_length():
+    assert len(plan_segments(250, workers=8, overlap_frames=20, min_frames=100)) == 2
+    short = plan_segments(50, workers=4, overlap_frames=20, min_frames=100)
+    assert short == [Segment(0, 0, 0, None)] # Короткий файл не делится
+
+
+# --- stitch_tracks ---
+def test_stitch_tracks_matches_by_overlap_iou():
+    prev = make_result(Segment(0, 0, 0, 10), track(5, range(0, 10)) + track(6, range(0, 10), y0=0), end=10)
+    cur = make_result(Segment(1, 6, 10, None), track(1, range(6, 15)) + track(2, range(6, 15), y0=0), end=15)
+    assert stitch_tracks(prev, cur) == {1: 5, 2: 6}
+
+
+def test_stitch_tracks_requires_min_frames():
+    prev = make_result(Segment(0, 0, 0, 10), track(5, range(0, 10)), end=10)
+    cur = make_result(Segment(1, 8, 10, None), track(1, range(8, 15)), end=15) # 2 кадра перекрытия
+    assert stitch_tracks(prev, cur, min_frames=3) == {}
+    assert stitch_tracks(prev, cur, min_frames=2) == {1: 5}
+
+
+def test_stitch_tracks_assigns_each_track_once():
+    # Два трека cur совпадают с одним треком prev: сшивается тот, у кого больше голосов
+    prev = make_result(Segment(0, 0, 0, 10), track(5, range(0, 10)), end=10)
+    cur = make_result(Segment(1, 4, 10, None), track(1, range(4, 9)) + track(2, range(6, 15)), end=15)
+    assert stitch_tracks(prev, cur) == {1: 5}
+
+
+def test_stitch_tracks_ignores_untracked_boxes():
+    prev = make_result(Segment(0, 0, 0, 10), track(-1, range(0, 10)), end=10)
+    cur = make_result(Segment(1, 5, 10, None), track(1, range(5, 15)), end=15)
+    assert stitch_tracks(prev, cur) == {}
+
+
+# --- global_track_ids ---
+def test_global_track_ids_keep_stitched_ids_and_allocate_new():
+    first = make_result(Segment(0, 0, 0, 10), track(5, range(0, 10)) + track(7, range(0, 3), y0=0), end=10)
+    second = make_result(Segment(1, 5, 10, 20), track(1, range(5, 20)) + track(2, range(12, 20), y0=0), end=20)
+    third = make_result(Segment(2, 15, 20, None), track(4, range(15, 30)) + track(1, range(22, 30), y0=0), end=30)
+    mappings = global_track_ids([first, second, third])
+    assert mappings[0] == {5: 5, 7: 7}
+    assert mappings[1] == {1: 5, 2: 8} # Новые ID - после наибольшего уже выданного
+    assert mappings[2] == {1: 9, 4: 5} # Трек 5 сшит через два сегмента
+
+
+# --- merge_segments ---
+def crossing_segments(completed: bool = True) -> List[SegmentResult]:
+    """ТС пересекает переход (y 200-240) около границы сегментов на кадре 20, затем появляется второе ТС."""
+    first = make_result(Segment(0, 0, 0, 20), track(5, range(10, 20), y0=120, step=10), end=20, red=True,
+                        crosswalk=(3, CROSSWALK))
+    second = make_result(Segment(1, 12, 20, None),
+                         track(1, range(12, 30), y0=120, step=10) + track(2, range(25, 30), y0=210, step=0),
+                         end=30, red=True, completed=completed)
+    return [first, second]
+
+
+def test_merge_segments_counts_boundary_track_once():
+    track_states, rows = merge_segments(crossing_segments(), FPS, "videos/test.mp4")
+    assert (track_states.total_crossings, track_states.red_light_violations) == (2, 2)
+    assert [row["vehicle_id"] for row in rows] == ["5", "6"] # Новый трек 2 получает глобальный ID 6
+    # Трек 5 появляется уже на переходе: кадр 10, y 220-240
+    assert rows[0]["video_second"] == int((10 + 1) / FPS)
+    assert rows[0]["original_video_path"] == "videos/test.mp4"
+
+
+def test_merge_segments_matches_sequential_processing():
+    """Итог по двум сегментам совпадает с одним сегментом на весь файл (тот же трек без сшивки)."""
+    whole = make_result(Segment(0, 0, 0, None),
+                        track(5, range(10, 30), y0=120, step=10) + track(2, range(25, 30), y0=210, step=0),
+                        end=30, red=True, crosswalk=(3, CROSSWALK))
+    sequential, sequential_rows = merge_segments([whole], FPS, "videos/test.mp4")
+    stitched, stitched_rows = merge_segments(crossing_segments(), FPS, "videos/test.mp4")
+    assert stitched.total_crossings == sequential.total_crossings
+    assert [r["video_second"] for r in stitched_rows] == [r["video_second"] for r in sequential_rows]
+
+
+def test_merge_segments_stops_after_incomplete_segment():
+    segments = crossing_segments()
+    segments[0].completed = False
+    segments[0].red = segments[0].red[:15] # Сегмент остановлен на кадре 15
+    track_states, rows = merge_segments(segments, FPS, "videos/test.mp4")
+    assert track_states.total_crossings == 1 and len(rows) == 1 # Кадры второго сегмента не учитываются
+
+
+def test_merge_segments_without_crosswalk():
+    segments = crossing_segments()
+    segments[0].crosswalk = None
+    track_states, rows = merge_segments(segments, FPS, "videos/test.mp4", TrackStateStore())
+    assert track_states.total_crossings == 0 and rows == []
+
+
+@pytest.mark.parametrize("red", [False, True])
+def test_merge_segments_violations_only_on_red(red):
+    segments = crossing_segments()
+    for result in segments:
+        result.red[:] = red
+    track_states, rows = merge_segments(segments, FPS, "videos/test.mp4")
+    assert track_states.total_crossings == 2
+    assert len(rows) == (2 if red else 0)
@@ -0,0 +1,55 @@
+from track_state import TrackStateStore
+
+
+def test_first_crossing_counts_once():
+    store = TrackStateStore(ttl=100)
+    assert store.mark_crossed(1, 0, on_red=False)
+    assert not store.mark_crossed(1, 5, on_red=True) # Повторное пересечение того же трека не считается
+    assert store.mark_crossed(2, 6, on_red=True)
+    assert (store.total_crossings, store.red_light_violations) == (2, 1)
+    assert store.snapshot() == {1: {"crossed": True, "crossed_on_red": False},
+                                2: {"crossed": True, "crossed_on_red": True}}
+
+
+def test_evicts_tracks_not_seen_for_ttl_frames():
+    store = TrackStateStore(ttl=10)
+    store.mark_crossed(1, 0, on_red=True)
+    store.mark_crossed(2, 0, on_red=False)
+    store.touch([2], 8)
+    assert store.evict(10) == 0 # Трек 1 виден последний раз на кадре 0: ровно ttl кадров назад
+    assert store.evict(11) == 1
+    assert 1 not in store and 2 in store
+    assert store.evict(19) == 1
+    assert len(store) == 0
+    # Счетчики накопительные и при удалении состояний не уменьшаются
+    assert (store.total_crossings, store.red_light_violations) == (2, 1)
+
+
+def test_touch_keeps_recently_seen_tracks():
+    store = TrackStateStore(ttl=5)
+    for tid in (1, 2, 3):
+        store.mark_crossed(tid, 0, on_red=False)
+    for frame_idx in range(1, 20):
+        store.touch([2, 99], frame_idx) # Трек без состояния (99) игнорируется
+        store.evict(frame_idx)
+    assert list(store.snapshot()) == [2]
+
+
+def test_zero_ttl_never_evicts():
+    store = TrackStateStore(ttl=0)
+    store.mark_crossed(1, 0, on_red=False)
+    assert store.evict(10 ** 6) == 0
+    assert 1 in store
+
+
+def test_snapshot_is_rebuilt_only_after_changes():
+    store = TrackStateStore(ttl=10)
+    store.mark_crossed(1, 0, on_red=False)
+    first = store.snapshot()
+    store.touch([1], 1)
+    assert store.snapshot() is first # Появление трека состояний не меняет
+    store.mark_crossed(2, 2, on_red=True)
+    second = store.snapshot()
+    assert second is not first and set(second) == {1, 2}
+    store.evict(20)
+    assert store.snapshot() == {}
@@ -0,0 +1,124 @@
+import time
+
+import pytest
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import violation_writer
+from models import Base, Violation
+from violation_writer import ViolationWriter
+
+
+@pytest.fixture
+def session_factory():
+    """SQLite в памяти, одно соединение на все потоки (поток записи и тест видят одну БД)."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(violation_writer, "RETRY_BACKOFF", 0.0)
+
+
+def row(i: int) -> dict:
+    return {"vehicle_id": str(i), "timestamp": None, "video_second": i, "processed_video_path": None,
+            "original_video_path": "videos/test.mp4", "evidence_clip_path": None, "vehicle_class": "car"}
+
+
+def count_rows(session_factory) -> int:
+    session = session_factory()
+    try:
+        return session.execute(select(func.count()).select_from(Violation)).scalar_one()
+    finally:
+        session.close()
+
+
+class CountingFactory:
+    """Фабрика сессий, считающая пакетные вставки; первые fail_first вставок завершаются ошибкой БД."""
+
+    def __init__(self, factory, fail_first: int = 0):
+        self.factory = factory
+        self.fail_first = fail_first
+        self.batches = []
+
+    def __call__(self):
+        session = self.factory()
+        execute = session.execute
+
+        def counted(statement, rows=None):
+            if self.fail_first > 0:
+                self.fail_first -= 1
+                raise OperationalError("INSERT", {}, Exception("database is down"))
+            self.batches.append(len(rows))
+            return execute(statement, rows)
+
+        session.execute = counted
+        return session
+
+
+def test_rows_are_written_in_batches(session_factory):
+    factory = CountingFactory(session_factory)
+    writer = ViolationWriter(factory, flush_size=3, flush_interval=10.0)
+    for i in range(7): # Строки ставятся до запуска потока: пакеты собираются из буфера
+        assert writer.add(row(i))
+    writer.start()
+    writer.close()
+    assert count_rows(session_factory) == 7
+    assert writer.written == 7 and writer.dropped == 0
+    assert factory.batches == [3, 3, 1]
+
+
+def test_flush_interval_writes_partial_batch(session_factory):
+    writer = ViolationWriter(session_factory, flush_size=100, flush_interval=0.05).start()
+    writer.add(row(1))
+    deadline = time.monotonic() + 5
+    while writer.written == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert writer.written == 1 # Записано по истечении интервала, до закрытия
+    writer.close()
+
+
+def test_failed_insert_is_retried(session_factory):
+    factory = CountingFactory(session_factory, fail_first=2)
+    writer = ViolationWriter(factory, flush_size=10, max_retries=3).start()
+    for i in range(4):
+        writer.add(row(i))
+    writer.close()
+    assert count_rows(session_factory) == 4
+    assert writer.written == 4 and writer.dropped == 0
+
+
+def test_rows_dropped_after_retries_exhausted(session_factory):
+    factory = CountingFactory(session_factory, fail_first=100)
+    writer = ViolationWriter(factory, flush_size=10, max_retries=3).start()
+    for i in range(4):
+        writer.add(row(i))
+    writer.close()
+    assert writer.written == 0 and writer.dropped == 4
+    assert count_rows(session_factory) == 0
+
+
+def test_full_buffer_drops_without_blocking(session_factory):
+    writer = ViolationWriter(session_factory, buffer_limit=2)
+    assert writer.add(row(1)) and writer.add(row(2))
+    assert not writer.add(row(3))
+    assert writer.dropped == 1
+
+
+def test_close_does_not_hang_on_unavailable_database(session_factory, monkeypatch):
+    monkeypatch.setattr(violation_writer, "RETRY_BACKOFF", 5.0) # Без прерывания пауз закрытие ждало бы минуты
+    factory = CountingFactory(session_factory, fail_first=1000)
+    writer = ViolationWriter(factory, flush_size=10, flush_interval=0.01, max_retries=5, close_timeout=0.2).start()
+    for i in range(25):
+        writer.add(row(i))
+    started = time.monotonic()
+    writer.close()
+    assert time.monotonic() - started < 2
+    writer._thread.join(2) # После истечения срока поток отбрасывает оставшиеся строки и завершается
+    assert not writer._thread.is_alive()
+    assert writer.written == 0 and writer.dropped == 25
@@ -0,0 +1,110 @@
+import json
+
+import numpy as np
+import pytest
+
+from wire_protocol import (
+    DELTA_HEADER, DELTA_PROTOCOL, LEGACY_PROTOCOL, METADATA_PROTOCOL, DeltaDecoder, DeltaEncoder, decode_delta,
+    negotiate_protocol
+)
+
+JPEG = b"\xff\xd8jpeg\xff\xd9"
+
+
+def frame_data(vehicles, states=None, red=0, lights=None):
+    return {
+        "vehicles": vehicles,
+        "traffic_lights": lights or [],
+        "crosswalk_bbox": [0, 300, 640, 40],
+        "total_crossings": len(states or {}),
+        "red_light_violations": red,
+        "frame_width": 640,
+        "frame_height": 480,
+        "output_path": None,
+        "vehicle_states": states or {},
+    }
+
+
+def vehicle(tid, bbox, label="car"):
+    return {"id": tid, "label": label, "bbox": bbox}
+
+
+def normalized(data):
+    """frame_data в сравнимом виде: ТС по ID, ключи состояний - строки (как после JSON)."""
+    return {
+        "vehicles": sorted((v["id"], v["label"], list(v["bbox"])) for v in data["vehicles"]),
+        "vehicle_states": {str(k): v for k, v in data["vehicle_states"].items()},
+        **{k: data[k] for k in ("traffic_lights", "crosswalk_bbox", "total_crossings", "red_light_violations",
+                                "frame_width", "frame_height", "output_path")},
+    }
+
+
+# --- negotiate_protocol ---
+@pytest.mark.parametrize("requested, expected", [
+    (None, LEGACY_PROTOCOL), # Прежние клиенты без поля protocol
+    ("delta", DELTA_PROTOCOL),
+    (["delta", "legacy"], DELTA_PROTOCOL),
+    (["future", "legacy"], LEGACY_PROTOCOL), # Неизвестные протоколы пропускаются
+    ("unknown", LEGACY_PROTOCOL),
+    ([], LEGACY_PROTOCOL),
+])
+def test_negotiate_protocol(requested, expected):
+    assert negotiate_protocol(requested) == expected
+
+
+def test_negotiate_protocol_skips_unavailable():
+    assert negotiate_protocol(["metadata", "delta"], unavailable=(METADATA_PROTOCOL,)) == DELTA_PROTOCOL
+    assert negotiate_protocol("metadata", unavailable=(METADATA_PROTOCOL,)) == LEGACY_PROTOCOL
+
+
+# --- delta ---
+def test_delta_roundtrip_restores_frame_data():
+    frames = [
+        frame_data([vehicle(1, [10, 10, 50, 50]), vehicle(2, [100, 100, 150, 160], "truck")]),
+        frame_data([vehicle(1, [12, 11, 52, 51]), vehicle(2, [100, 100, 150, 160], "truck")]),
+        frame_data([vehicle(1, [14, 12, 54, 52]), vehicle(-1, [300, 300, 320, 330])],
+                   states={1: {"crossed": True, "crossed_on_red": False}}),
+        frame_data([vehicle(3, [0, 0, 5, 5])], states={1: {"crossed": True, "crossed_on_red": True}}, red=1,
+                   lights=[{"label": "red_light", "bbox": [5, 5, 10, 20]}]),
+        frame_data([], states={}), # Состояние удалено хранилищем треков
+    ]
+    encoder, decoder = DeltaEncoder(), DeltaDecoder()
+    for data in frames:
+        decoded, jpeg = decoder.decode(encoder.encode(data, JPEG))
+        assert jpeg == JPEG
+        assert normalized(decoded) == normalized(data)
+
+
+def test_delta_unchanged_frame_sends_only_sequence():
+    encoder = DeltaEncoder()
+    data = frame_data([vehicle(1, [10, 10, 50, 50])], states={1: {"crossed": True, "crossed_on_red": False}})
+    first, _ = decode_delta(encoder.encode(data, JPEG))
+    second, _ = decode_delta(encoder.encode(data, JPEG))
+    assert first["seq"] == 0 and "vehicles_upsert" in first and "crosswalk_bbox" in first
+    assert second == {"seq": 1}
+
+
+def test_delta_reports_changes_only():
+    encoder = DeltaEncoder()
+    encoder.encode(frame_data([vehicle(1, [10, 10, 50, 50]), vehicle(2, [0, 0, 9, 9])]), JPEG)
+    meta, _ = decode_delta(encoder.encode(frame_data([vehicle(1, [11, 10, 51, 50])], red=1), JPEG))
+    assert meta["vehicles_upsert"] == [{"id": 1, "label": "car", "bbox": [11, 10, 51, 50]}]
+    assert meta["vehicles_removed"] == [2]
+    assert meta["red_light_violations"] == 1
+    assert "crosswalk_bbox" not in meta and "frame_width" not in meta
+
+
+def test_delta_serializes_numpy_values():
+    encoder = DeltaEncoder()
+    data = frame_data([vehicle(np.int64(7), np.array([1, 2, 3, 4]))])
+    data["total_crossings"] = np.int32(5)
+    meta, _ = decode_delta(encoder.encode(data, memoryview(JPEG)))
+    assert meta["vehicles_upsert"] == [{"id": 7, "label": "car", "bbox": [1, 2, 3, 4]}]
+    assert meta["total_crossings"] == 5
+
+
+def test_decode_delta_rejects_unknown_version():
+    payload = json.dumps({"seq": 0}).encode()
+    message = DELTA_HEADER.pack(99, len(payload)) + payload + JPEG
+    with pytest.raises(ValueError):
+        decode_delta(message)
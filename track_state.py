@@ -0,0 +1,93 @@
+import os
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+
+# --- Хранение состояний треков (переопределяется переменными окружения) ---
+TRACK_STATE_TTL = int(os.environ.get("TRACK_STATE_TTL", "900")) # Кадров без появления трека до удаления его состояния (0 - не удалять)
+
+
+class TrackState:
+    """Состояние одного ТС, пересекшего переход."""
+    __slots__ = ("crossed", "crossed_on_red", "last_seen")
+
+    def __init__(self, crossed_on_red: bool, last_seen: int):
+        self.crossed = True # Состояние создается при первом пересечении перехода
+        self.crossed_on_red = crossed_on_red
+        self.last_seen = last_seen # Индекс кадра, на котором трек был виден последний раз
+
+
+class TrackStateStore:
+    """
+    Ограниченное хранилище состояний ТС, пересекших переход, с накопительными счетчиками.
+
+    Состояния упорядочены по времени последнего появления трека (OrderedDict), поэтому
+    треки, не появлявшиеся ttl кадров, удаляются с начала за O(1) на трек. Счетчики
+    пересечений и нарушений увеличиваются только при появлении нового состояния и
+    не уменьшаются при удалении. ttl должен быть больше буфера трекера (track_buffer),
+    иначе вернувшийся после удаления трек будет посчитан повторно.
+    """
+
+    def __init__(self, ttl: int = TRACK_STATE_TTL):
+        self.ttl = ttl
+        self._states: "OrderedDict[int, TrackState]" = OrderedDict()
+        self.total_crossings = 0 # Общее количество пересечений перехода
+        self.red_light_violations = 0 # Количество пересечений на красный
+        self._snapshot: Optional[Dict[int, Dict[str, bool]]] = None # Кэш словаря состояний для frame_data
+
+    def __len__(self) -> int:
+        return len(self._states)
+
+    def __contains__(self, track_id: int) -> bool:
+        return track_id in self._states
+
+    def touch(self, track_ids: Iterable[int], frame_idx: int) -> None:
+        """Отмечает треки, присутствующие на кадре frame_idx."""
+        states = self._states
+        for track_id in track_ids:
+            state = states.get(track_id)
+            if state is not None and state.last_seen != frame_idx:
+                state.last_seen = frame_idx
+                states.move_to_end(track_id)
+
+    def mark_crossed(self, track_id: int, frame_idx: int, on_red: bool) -> bool:
+        """
+        Регистрирует пересечение перехода треком. Возвращает True, если трек пересек
+        переход впервые (тогда же обновляются счетчики), иначе False.
+        """
+        if track_id in self._states:
+            return False
+        self._states[track_id] = TrackState(on_red, frame_idx)
+        self.total_crossings += 1
+        if on_red:
+            self.red_light_violations += 1
+        self._snapshot = None
+        return True
+
+    def evict(self, frame_idx: int) -> int:
+        """Удаляет состояния треков, не появлявшихся больше ttl кадров; возвращает их число."""
+        if self.ttl <= 0:
+            return 0
+        states = self._states
+        limit = frame_idx - self.ttl
+        evicted = 0
+        while states:
+            track_id, state = next(iter(states.items()))
+            if state.last_seen >= limit:
+                break
+            del states[track_id]
+            evicted += 1
+        if evicted:
+            self._snapshot = None
+        return evicted
+
+    def snapshot(self) -> Dict[int, Dict[str, bool]]:
+        """
+        Состояния в формате frame_data['vehicle_states'] ({id: {crossed, crossed_on_red}}).
+        Словарь пересоздается только после изменений; получатели не должны его изменять.
+        """
+        if self._snapshot is None:
+            self._snapshot = {
+                track_id: {'crossed': state.crossed, 'crossed_on_red': state.crossed_on_red}
+                for track_id, state in self._states.items()
+            }
+        return self._snapshot
@@ -1,21 +1,92 @@
+import os
 import cv2
 import numpy as np
-from scipy.spatial import distance
-from typing import Optional, Tuple
+from typing import NamedTuple, Optional, Tuple
 
-def detect_crosswalk(frame: np.ndarray, light_box: Tuple[int, int, int, int]) -> Optional[Tuple[int, int, int, int]]:
+# --- Параметры детекции пешеходного перехода ---
+CROSSWALK_MAX_WIDTH = int(os.environ.get("CROSSWALK_MAX_WIDTH", "960")) # Более широкие кадры уменьшаются до этой ширины при поиске перехода
+ADAPTIVE_BLOCK_SIZE = 115 # Размер окна адаптивной бинаризации в исходном масштабе
+MIN_STRIPE_AREA = 800 # Минимальная площадь контура полосы зебры в исходном масштабе
+CROSSWALK_CLUSTER_DISTANCE = 100 # Максимальное расстояние между центрами полос одного перехода (пикс.)
+CROSSWALK_RETRY_MAX = int(os.environ.get("CROSSWALK_RETRY_MAX", "8")) # Предел интервала (кадров) между неудачными попытками поиска
+
+
+class Detections(NamedTuple):
+    """
+    Детекции одного кадра в виде массивов NumPy.
+    xyxy - координаты рамок (N, 4) типа int, cls - ID классов (N,),
+    ids - ID треков (N,), -1 для объектов без трека.
+    """
+    xyxy: np.ndarray
+    cls: np.ndarray
+    ids: np.ndarray
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(np.zeros((0, 4), dtype=int), np.zeros(0, dtype=int), np.zeros(0, dtype=int))
+
+
+def cluster_centers(centers: np.ndarray, max_distance: float = CROSSWALK_CLUSTER_DISTANCE) -> np.ndarray:
+    """
+    Жадная кластеризация центров прямоугольников: центр присоединяется к первому кластеру,
+    все члены которого ближе max_distance, иначе образует новый кластер.
+    Попарные расстояния считаются одной матрицей, проверка кластеров - через bincount.
+    Возвращает номер кластера для каждого центра.
+    """
+    n = len(centers)
+    labels = np.zeros(n, dtype=int)
+    if n == 0:
+        return labels
+    diff = centers[:, None, :] - centers[None, :, :]
+    far = np.hypot(diff[..., 0], diff[..., 1]) >= max_distance # Пары, которые не могут быть в одном кластере
+    clusters = 0
+    for i in range(n):
+        # Число "далеких" членов в каждом из уже созданных кластеров
+        conflicts = np.bincount(labels[:i], weights=far[i, :i], minlength=clusters)
+        fitting = np.flatnonzero(conflicts == 0)
+        if len(fitting):
+            labels[i] = fitting[0]
+        else:
+            labels[i] = clusters
+            clusters += 1
+    return labels
+
+
+def detect_crosswalk(
+    frame: np.ndarray,
+    light_box: Tuple[int, int, int, int],
+    scale: Optional[float] = None
+) -> Optional[Tuple[int, int, int, int]]:
     """
     Обнаруживает область пешеходного перехода под указанной ограничительной рамкой светофора.
+    Обрабатывается только полоса кадра ниже светофора (с запасом сверху на окно бинаризации),
+    уменьшенная в scale раз (по умолчанию - до ширины CROSSWALK_MAX_WIDTH, кадры уже нее
+    не уменьшаются); координаты возвращаются в масштабе исходного кадра.
     Возвращает ограничительную рамку (x, y, w, h) или None, если переход не найден.
     """
     xlight, ylight, wlight, hlight = light_box # Координаты рамки светофора
+    light_bottom = ylight + hlight # Учитываются только прямоугольники ниже этой строки
+    if scale is None:
+        scale = min(1.0, CROSSWALK_MAX_WIDTH / frame.shape[1])
+
+    # Параметры, пересчитанные под масштаб обработки
+    block_size = max(3, int(ADAPTIVE_BLOCK_SIZE * scale) | 1) # Нечетный размер окна бинаризации
+    min_area = MIN_STRIPE_AREA * scale * scale
+    # Полоса под светофором с запасом на окно бинаризации и морфологию: внутри полосы бинаризация совпадает с полнокадровой
+    margin = int(np.ceil((block_size // 2 + 4) / scale))
+    top = min(max(0, light_bottom - margin), frame.shape[0])
+    roi = frame[top:]
+    if roi.shape[0] == 0:
+        return None
+    if scale != 1.0:
+        roi = cv2.resize(roi, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
     # Преобразование в оттенки серого
-    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
     
     # Адаптивная бинаризация для выделения линий разметки
     th = cv2.adaptiveThreshold(
-        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 115, 1
+        gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, 1
     )
     
     # Морфологические операции для улучшения бинарного изображения
@@ -23,53 +94,50 @@ def detect_crosswalk(frame: np.ndarray, light_box: Tuple[int, int, int, int]) ->
     th = cv2.erode(th, kernel, iterations=1) # Эрозия для удаления шума
     th = cv2.dilate(th, kernel, iterations=2) # Дилатация для соединения разрывов
     
-    # Поиск контуров на бинарном изображении
-    contours, _ = cv2.findContours(th, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    # Поиск контуров на бинарном изображении (иерархия не используется, поэтому RETR_LIST)
+    contours, _ = cv2.findContours(th, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
     
     potential_crosswalks = [] # Список для потенциальных прямоугольников зебры
     for contour in contours:
         # Фильтрация контуров по площади
-        if cv2.contourArea(contour) > 800:
+        if cv2.contourArea(contour) > min_area:
             peri = cv2.arcLength(contour, True) # Периметр контура
             approx = cv2.approxPolyDP(contour, 0.04 * peri, True) # Аппроксимация контура полигоном
             
             # Рассматриваем только четырехугольные контуры
             if len(approx) == 4:
                 x, y, w, h = cv2.boundingRect(contour) # Описанный прямоугольник
+                if scale != 1.0: # Возврат к координатам исходного кадра
+                    x, y, w, h = (int(round(v / scale)) for v in (x, y, w, h))
+                y += top
                 # Учитываем только прямоугольники, расположенные ниже светофора
-                if y > ylight + hlight:
+                if y > light_bottom:
                     potential_crosswalks.append((x, y, w, h))
     
-    if potential_crosswalks:
-        # Кластеризация найденных прямоугольников для объединения линий одной зебры
-        clusters = []
-        for rect in potential_crosswalks:
-            x, y, w, h = rect
-            center = (x + w // 2, y + h // 2) # Центр прямоугольника
-            found_cluster = False
-            for cluster in clusters:
-                # Проверка, достаточно ли близок текущий прямоугольник к существующему кластеру
-                if all(distance.euclidean(center, (cx, cy)) < 100 for cx, cy in cluster):
-                    cluster.append(center)
-                    found_cluster = True
-                    break
-            if not found_cluster:
-                clusters.append([center]) # Создание нового кластера
-        
-        if not clusters: # Если кластеры не образовались
-            return None
-
-        # Выбор наибольшего кластера (предполагается, что это и есть пешеходный переход)
-        largest_cluster = max(clusters, key=len)
-        
-        # Определение вертикальных границ пешеходного перехода по крайним точкам кластера
-        min_y = min(cy for cx, cy in largest_cluster)
-        max_y = max(cy for cx, cy in largest_cluster)
-        
-        # Возвращаем рамку перехода: по всей ширине кадра, с вычисленными y-координатами
-        return (0, min_y, frame.shape[1], max_y - min_y)
+    if not potential_crosswalks:
+        return None # Пешеходный переход не найден
+
+    # Кластеризация центров найденных прямоугольников для объединения линий одной зебры
+    rects = np.array(potential_crosswalks, dtype=int)
+    centers = np.column_stack((rects[:, 0] + rects[:, 2] // 2, rects[:, 1] + rects[:, 3] // 2))
+    labels = cluster_centers(centers)
+
+    # Выбор наибольшего кластера (предполагается, что это и есть пешеходный переход);
+    # при равенстве размеров - созданного раньше
+    largest_cluster = centers[labels == np.argmax(np.bincount(labels))]
     
-    return None # Пешеходный переход не найден
+    # Определение вертикальных границ пешеходного перехода по крайним точкам кластера
+    min_y = int(largest_cluster[:, 1].min())
+    max_y = int(largest_cluster[:, 1].max())
+    if max_y <= min_y or frame.shape[1] <= 0:
+        return None # Все центры в одной строке: рамка нулевой высоты, пересечений с ней не будет
+
+    # Возвращаем рамку перехода: по всей ширине кадра, с вычисленными y-координатами
+    return (0, min_y, frame.shape[1], max_y - min_y)
+
+def valid_box(box: Optional[Tuple[int, int, int, int]]) -> bool:
+    """Проверяет, что рамка (x, y, w, h) задана и имеет положительные ширину и высоту."""
+    return box is not None and len(box) == 4 and box[2] > 0 and box[3] > 0
 
 def intersection_area(boxA: Tuple[int, int, int, int], boxB: Tuple[int, int, int, int]) -> float:
     """
@@ -91,3 +159,30 @@ def intersection_area(boxA: Tuple[int, int, int, int], boxB: Tuple[int, int, int
     
     # Расчет и возврат площади пересечения
     return (x2 - x1) * (y2 - y1)
+
+def intersection_areas(boxes: np.ndarray, box: Tuple[int, int, int, int]) -> np.ndarray:
+    """
+    Векторный вариант intersection_area: площади пересечения каждой рамки
+    из массива boxes (N, 4) с одной рамкой box. Рамки задаются как (x, y, ширина, высота).
+    """
+    Bx, By, Bw, Bh = box
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    x1 = np.maximum(boxes[:, 0], Bx)
+    y1 = np.maximum(boxes[:, 1], By)
+    x2 = np.minimum(boxes[:, 0] + boxes[:, 2], Bx + Bw)
+    y2 = np.minimum(boxes[:, 1] + boxes[:, 3], By + Bh)
+    # Для непересекающихся рамок ширина или высота пересечения отрицательна - площадь 0
+    return np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+
+def box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Матрица IoU рамок a (N, 4) и b (M, 4), заданных как (x1, y1, x2, y2)."""
+    a = np.asarray(a, dtype=float).reshape(-1, 4)
+    b = np.asarray(b, dtype=float).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
@@ -11,4 +11,7 @@ export interface DetectionData {
   frame_height?: number;
   vehicle_states?: { [id: string]: { crossed: boolean; crossed_on_red: boolean } };
   output_path?: string;
+  frame_idx?: number;
+  pts?: number; // Время кадра от начала видео (сек.) для сопоставления с воспроизводимым файлом
+  drawn?: boolean; // Рамки уже нарисованы на кадре сервером
 }
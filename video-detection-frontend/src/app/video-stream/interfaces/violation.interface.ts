@@ -8,4 +8,7 @@ export interface Violation {
   video_second: number;
   processed_video_path: string;
   original_video_path: string;
+  evidence_clip_path?: string;
+  vehicle_class?: string;
+  created_at?: string;
 }
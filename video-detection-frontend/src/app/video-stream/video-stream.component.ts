@@ -27,6 +27,7 @@ import {Violation} from './interfaces/violation.interface';
 export class VideoStreamComponent implements OnInit, OnDestroy {
   @ViewChild('overlayCanvas', { static: false }) overlayCanvas!: ElementRef<HTMLCanvasElement>;
   @ViewChild('videoImage', { static: false }) videoImage!: ElementRef<HTMLImageElement>;
+  @ViewChild('videoPlayer', { static: false }) videoPlayer!: ElementRef<HTMLVideoElement>;
 
   detectionData: DetectionData | null = null;
   filePath = '';
@@ -34,15 +35,24 @@ export class VideoStreamComponent implements OnInit, OnDestroy {
   processing = false;
   uploading = false;
   violations: Violation[] = [];
+  clientOverlay = false; // Рамки рисует браузер, сервер передает только метаданные (протокол metadata); включается переключателем
+  metadataMode = false; // Сервер подтвердил протокол metadata
+  videoUrl: string | null = null; // Исходный файл, воспроизводимый браузером в режиме metadata
 
   private ws: WebSocket | null = null;
+  private violationStream: EventSource | null = null; // Лента новых нарушений (Server-Sent Events)
+  private metadataBuffer: DetectionData[] = []; // Метаданные кадров впереди позиции воспроизведения
+  private metadataEnded = false; // Сервер обработал файл до конца
+  private waitingForMetadata = false; // Видео приостановлено до прихода метаданных
+  private animationFrame: number | null = null;
 
   /**
    * Хук жизненного цикла Angular. Вызывается один раз после инициализации компонента.
-   * Используется для начальной загрузки истории нарушений.
+   * Используется для начальной загрузки истории нарушений и подписки на новые нарушения.
    */
-  ngOnInit() {
-    this.loadViolations();
+  async ngOnInit() {
+    await this.loadViolations();
+    this.subscribeViolations();
   }
 
   /**
@@ -51,6 +61,8 @@ export class VideoStreamComponent implements OnInit, OnDestroy {
    */
   ngOnDestroy() {
     this.stopProcessing();
+    this.violationStream?.close();
+    this.violationStream = null;
   }
 
   /**
@@ -70,6 +82,23 @@ export class VideoStreamComponent implements OnInit, OnDestroy {
     }
   }
 
+  /**
+   * Подписывается на ленту новых нарушений вместо периодической загрузки списка.
+   * Лента возобновляется с последнего известного нарушения; при обрыве EventSource
+   * переподключается сам и передает серверу id последнего полученного события.
+   */
+  subscribeViolations() {
+    this.violationStream?.close();
+    const lastId = this.violations.length ? Math.max(...this.violations.map(v => v.id)) : null;
+    const query = lastId !== null ? `?after_id=${lastId}` : '';
+    this.violationStream = new EventSource(`http://localhost:8000/violations/stream${query}`);
+    this.violationStream.addEventListener('violation', (event) => {
+      const violation: Violation = JSON.parse((event as MessageEvent).data);
+      if (this.violations.some(v => v.id === violation.id)) return;
+      this.violations = [violation, ...this.violations].sort((a, b) => b.id - a.id); // Новый массив для mat-table
+    });
+  }
+
   /**
    * Обрабатывает событие выбора файла пользователем.
    * Вызывается при изменении значения элемента input type="file".
@@ -116,6 +145,12 @@ export class VideoStreamComponent implements OnInit, OnDestroy {
     return `http://localhost:8000/download_processed_video?filename=${filename}`;
   }
 
+  getEvidenceClipUrl(v: Violation): string {
+    if (!v.evidence_clip_path) return '';
+    const filename = v.evidence_clip_path.split(/[\\/]/).pop();
+    return `http://localhost:8000/download_processed_video?filename=${filename}`;
+  }
+
   getRedLightViolators(): (string | number)[] {
     if (!this.detectionData?.vehicle_states) return [];
     return Object.entries(this.detectionData.vehicle_states)
@@ -139,14 +174,39 @@ export class VideoStreamComponent implements OnInit, OnDestroy {
       this.ws.close();
       this.ws = null;
     }
+    if (this.animationFrame !== null) {
+      cancelAnimationFrame(this.animationFrame);
+      this.animationFrame = null;
+    }
+    this.videoUrl = null;
+    this.metadataBuffer = [];
     this.processing = false;
   }
 
+  onVideoEnded() {
+    if (this.metadataEnded) {
+      this.processing = false;
+    }
+  }
+
   private handleWebSocketMessage(event: MessageEvent) {
     if (typeof event.data === 'string') {
       const msg = JSON.parse(event.data);
-      if (msg.type === 'frame_data') {
-        this.detectionData = msg.data;
+      if (msg.type === 'protocol') {
+        this.metadataMode = msg.protocol === 'metadata';
+        if (this.metadataMode && msg.video_url) {
+          this.videoUrl = `http://localhost:8000${msg.video_url}`;
+          this.animationFrame = requestAnimationFrame(this.renderVideoFrame);
+        }
+      } else if (msg.type === 'frame_data') {
+        if (this.videoUrl) {
+          this.metadataBuffer.push(msg.data); // Будет показано, когда видео дойдет до кадра
+        } else {
+          this.detectionData = msg.data;
+          if (this.metadataMode) {
+            this.drawOverlay(this.videoImage?.nativeElement);
+          }
+        }
         if (msg.data.output_path) {
           this.processedVideoFilename = msg.data.output_path.split(/[\\/]/).pop();
         }
@@ -156,23 +216,64 @@ export class VideoStreamComponent implements OnInit, OnDestroy {
       const url = URL.createObjectURL(blob);
       const img = this.videoImage?.nativeElement;
       if (img) {
-        img.onload = () => URL.revokeObjectURL(url);
+        img.onload = () => {
+          URL.revokeObjectURL(url);
+          if (this.metadataMode) {
+            this.drawOverlay(img);
+          }
+        };
         img.src = url;
       }
     }
   }
 
+  /**
+   * Цикл отрисовки режима metadata для файла: показывает метаданные кадра, соответствующего
+   * текущей позиции видео (по pts), и приостанавливает видео, если обработка от него отстает.
+   */
+  private renderVideoFrame = () => {
+    const video = this.videoPlayer?.nativeElement;
+    if (video) {
+      const time = video.currentTime;
+      while (this.metadataBuffer.length > 1 && (this.metadataBuffer[1].pts ?? 0) <= time) {
+        this.metadataBuffer.shift(); // Кадры, которые видео уже прошло
+      }
+      const current = this.metadataBuffer[0];
+      if (current && current !== this.detectionData && (current.pts ?? 0) <= time) {
+        this.detectionData = current;
+        this.drawOverlay(video);
+      }
+      const latest = this.metadataBuffer[this.metadataBuffer.length - 1];
+      const behind = !this.metadataEnded && (!latest || (latest.pts ?? 0) < time);
+      if (behind && !video.paused) {
+        video.pause();
+        this.waitingForMetadata = true;
+      } else if (!behind && this.waitingForMetadata) {
+        this.waitingForMetadata = false;
+        video.play();
+      }
+    }
+    this.animationFrame = requestAnimationFrame(this.renderVideoFrame);
+  };
+
   private openWebSocket(source: string) {
     this.stopProcessing();
     this.processing = true;
+    this.metadataMode = false;
+    this.metadataEnded = false;
+    this.waitingForMetadata = false;
     this.ws = new WebSocket('ws://localhost:8000/ws/video_feed');
     this.ws.binaryType = 'arraybuffer';
     this.ws.onopen = () => {
-      this.ws?.send(JSON.stringify({ file_path: source }));
+      const protocol = this.clientOverlay ? ['metadata', 'legacy'] : ['legacy'];
+      this.ws?.send(JSON.stringify({ file_path: source, protocol }));
     };
     this.ws.onmessage = (event) => this.handleWebSocketMessage(event);
     this.ws.onclose = () => {
-      this.processing = false;
+      this.metadataEnded = true;
+      if (!this.videoUrl) { // Файл в режиме metadata продолжает воспроизводиться до конца
+        this.processing = false;
+      }
     };
     this.ws.onerror = (error) => {
         console.error("Ошибка WebSocket:", error);
@@ -185,19 +286,26 @@ export class VideoStreamComponent implements OnInit, OnDestroy {
     this.detectionData = null;
   }
 
-  private drawBoundingBoxes() {
-    if (!this.detectionData || !this.overlayCanvas?.nativeElement || !this.videoImage?.nativeElement) return;
+  /**
+   * Рисует рамки текущего кадра на canvas поверх изображения или видео (режим metadata).
+   * Если сервер уже нарисовал рамки на кадре (drawn), canvas очищается.
+   */
+  private drawOverlay(media: HTMLImageElement | HTMLVideoElement | undefined) {
+    if (!this.detectionData || !this.overlayCanvas?.nativeElement || !media) return;
     const canvas = this.overlayCanvas.nativeElement;
-    const img = this.videoImage.nativeElement;
-    const frameWidth = this.detectionData.frame_width || img.naturalWidth;
-    const frameHeight = this.detectionData.frame_height || img.naturalHeight;
-    canvas.width = img.width;
-    canvas.height = img.height;
-    const scaleX = img.width / frameWidth;
-    const scaleY = img.height / frameHeight;
+    const naturalWidth = media instanceof HTMLVideoElement ? media.videoWidth : media.naturalWidth;
+    const naturalHeight = media instanceof HTMLVideoElement ? media.videoHeight : media.naturalHeight;
+    const frameWidth = this.detectionData.frame_width || naturalWidth;
+    const frameHeight = this.detectionData.frame_height || naturalHeight;
+    if (!frameWidth || !frameHeight) return;
+    canvas.width = media.clientWidth;
+    canvas.height = media.clientHeight;
+    const scaleX = canvas.width / frameWidth;
+    const scaleY = canvas.height / frameHeight;
     const ctx = canvas.getContext('2d');
     if (!ctx) return;
     ctx.clearRect(0, 0, canvas.width, canvas.height);
+    if (this.detectionData.drawn) return;
     if (this.detectionData.vehicles) {
       ctx.strokeStyle = 'yellow';
       ctx.lineWidth = 2;
@@ -0,0 +1,207 @@
+import os
+import queue
+import shutil
+import logging
+import threading
+import subprocess
+from typing import Any, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# --- Запись обработанного видео (переопределяется переменными окружения) ---
+OUTPUT_BACKEND = os.environ.get("OUTPUT_BACKEND", "auto") # "auto" (ffmpeg, если установлен), "ffmpeg" или "opencv"
+OUTPUT_FORMAT = os.environ.get("OUTPUT_FORMAT", "fmp4") # Контейнер ffmpeg: "fmp4" (фрагментированный MP4) или "mp4"
+OUTPUT_FOURCC = os.environ.get("OUTPUT_FOURCC", "MJPG") # Кодек бэкенда opencv
+OUTPUT_SEGMENT_SECONDS = float(os.environ.get("OUTPUT_SEGMENT_SECONDS", "0")) # Длительность файла-сегмента (сек. видео), 0 - один файл
+OUTPUT_QUEUE_SIZE = int(os.environ.get("OUTPUT_QUEUE_SIZE", "64")) # Кадров в очереди потока записи
+FFMPEG_PATH = os.environ.get("FFMPEG_PATH", "ffmpeg") # Исполняемый файл ffmpeg
+FFMPEG_PRESET = os.environ.get("FFMPEG_PRESET", "veryfast") # Пресет libx264: скорость/размер
+FFMPEG_CRF = int(os.environ.get("FFMPEG_CRF", "28")) # Качество libx264 (больше - меньше файл)
+FFMPEG_MOVFLAGS = { # Флаги контейнера MP4
+    "fmp4": "+frag_keyframe+empty_moov+default_base_moof", # Файл читается во время записи и после аварийной остановки
+    "mp4": "+faststart" # Индекс в начале файла, записывается при закрытии
+}
+FOURCC_EXTENSIONS = {"mp4v": ".mp4", "avc1": ".mp4", "h264": ".mp4", "vp80": ".webm"} # Остальные кодеки - в AVI
+
+
+class OpenCVBackend:
+    """Запись через cv2.VideoWriter (по умолчанию MJPG в AVI, как раньше)."""
+
+    def __init__(self, path: str, fps: float, size: Tuple[int, int], fourcc: str = OUTPUT_FOURCC):
+        self.path = path
+        self._writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*fourcc), fps, size)
+        if not self._writer.isOpened():
+            raise RuntimeError(f"cv2.VideoWriter не открыл {path} (кодек {fourcc})")
+
+    @staticmethod
+    def extension(fourcc: str = OUTPUT_FOURCC) -> str:
+        return FOURCC_EXTENSIONS.get(fourcc.lower(), ".avi")
+
+    def write(self, frame: np.ndarray) -> None:
+        self._writer.write(frame)
+
+    def close(self) -> None:
+        self._writer.release()
+
+
+class FFmpegBackend:
+    """
+    Запись через внешний процесс ffmpeg: кадры BGR передаются в stdin, кодируются
+    в H.264 (libx264, yuv420p) и сохраняются в MP4 или фрагментированный MP4.
+    """
+
+    def __init__(self, path: str, fps: float, size: Tuple[int, int], output_format: str = OUTPUT_FORMAT):
+        self.path = path
+        width, height = size
+        command = [
+            FFMPEG_PATH, "-y", "-loglevel", "error",
+            "-f", "rawvideo", "-pix_fmt", "bgr24", "-s", f"{width}x{height}", "-r", f"{fps:g}", "-i", "-",
+            "-an", "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", # yuv420p требует четных размеров
+            "-c:v", "libx264", "-preset", FFMPEG_PRESET, "-crf", str(FFMPEG_CRF), "-pix_fmt", "yuv420p",
+            "-movflags", FFMPEG_MOVFLAGS.get(output_format, FFMPEG_MOVFLAGS["mp4"]),
+            "-f", "mp4", path
+        ]
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    @staticmethod
+    def extension() -> str:
+        return ".mp4"
+
+    def write(self, frame: np.ndarray) -> None:
+        self._process.stdin.write(memoryview(np.ascontiguousarray(frame)).cast('B'))
+
+    def close(self) -> None:
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = self._process.stderr.read() # Вывод ffmpeg мал (-loglevel error)
+        self._process.wait()
+        if self._process.returncode != 0:
+            logging.error(f"ffmpeg завершился с кодом {self._process.returncode} для {self.path}: {stderr.decode(errors='replace')}")
+
+
+def resolve_backend(name: str = OUTPUT_BACKEND) -> str:
+    """Выбирает бэкенд записи: "auto" - ffmpeg, если он найден в PATH, иначе opencv."""
+    if name == "auto":
+        return "ffmpeg" if shutil.which(FFMPEG_PATH) else "opencv"
+    if name not in ("ffmpeg", "opencv"):
+        raise ValueError(f"Неизвестный бэкенд записи видео: {name}")
+    return name
+
+
+def backend_extension(backend: str) -> str:
+    """Расширение файлов бэкенда записи (после resolve_backend)."""
+    return FFmpegBackend.extension() if backend == "ffmpeg" else OpenCVBackend.extension()
+
+
+def open_backend(backend: str, path: str, fps: float, size: Tuple[int, int]) -> Any:
+    """Открывает файл path для записи кадров размера size (ширина, высота) бэкендом backend."""
+    if os.path.exists(path): # Новый файл вместо перезаписи: жесткие ссылки кэша результатов сохраняют прежнее видео
+        os.remove(path)
+    if backend == "ffmpeg":
+        return FFmpegBackend(path, fps, size)
+    return OpenCVBackend(path, fps, size)
+
+
+def close_backend(writer: Any) -> None:
+    """Закрывает файл бэкенда, не пропуская исключения в поток записи."""
+    try:
+        writer.close()
+    except Exception:
+        logging.exception(f"Ошибка закрытия {writer.path}")
+
+
+class VideoOutput:
+    """
+    Асинхронная запись обработанного видео.
+
+    Цикл обработки кадров только ставит кадр в ограниченную очередь (`write`), а кодирование
+    и запись на диск выполняются отдельным потоком. Если запись стабильно медленнее обработки,
+    `write` ждет места в очереди (кадры не теряются), число таких ожиданий - stalls.
+    При segment_seconds > 0 видео делится на файлы по segment_seconds секунд видео
+    (base_path_000.mp4, base_path_001.mp4, ...). Путь текущего файла возвращает `write`.
+    """
+
+    def __init__(
+        self,
+        base_path: str, # Путь к файлу без расширения
+        fps: float,
+        backend: str = OUTPUT_BACKEND,
+        segment_seconds: float = OUTPUT_SEGMENT_SECONDS,
+        queue_size: int = OUTPUT_QUEUE_SIZE
+    ):
+        self.base_path = base_path
+        self.fps = fps
+        self.backend = resolve_backend(backend)
+        self.extension = backend_extension(self.backend)
+        self.segment_frames = int(round(segment_seconds * fps)) if segment_seconds > 0 else 0 # Кадров в сегменте
+        self._queue: "queue.Queue[Optional[Tuple[str, np.ndarray]]]" = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = threading.Thread(target=self._run, name="video-output", daemon=True)
+        self._thread.start()
+        self.frames = 0 # Кадров, поставленных в очередь
+        self.stalls = 0 # Ожиданий места в очереди (запись не успевает за обработкой)
+        self.failed = 0 # Кадров, не записанных из-за ошибки бэкенда
+
+    def path_for(self, number: int) -> str:
+        """Путь файла, в который попадет кадр с порядковым номером number среди записанных (с 0)."""
+        if not self.segment_frames:
+            return f"{self.base_path}{self.extension}"
+        return f"{self.base_path}_{number // self.segment_frames:03d}{self.extension}"
+
+    def next_path(self) -> str:
+        """Путь файла, в который попадет кадр следующего вызова write (тот же счетчик, что у write)."""
+        return self.path_for(self.frames)
+
+    def write(self, frame: np.ndarray) -> str:
+        """Ставит кадр в очередь записи и возвращает путь файла, в который он будет записан."""
+        path = self.next_path()
+        self.frames += 1
+        try:
+            self._queue.put_nowait((path, frame))
+        except queue.Full:
+            self.stalls += 1
+            self._queue.put((path, frame))
+        return path
+
+    def close(self) -> None:
+        """Дожидается записи всех кадров из очереди и закрывает текущий файл."""
+        self._queue.put(None)
+        self._thread.join()
+        if self.stalls:
+            logging.warning(f"Запись видео {self.base_path} не успевала за обработкой: ожиданий очереди {self.stalls}")
+
+    def _run(self) -> None:
+        """
+        Основной цикл потока записи: открывает файлы сегментов и кодирует кадры.
+        Ошибки бэкенда не останавливают поток, иначе write ждал бы очередь бесконечно.
+        """
+        writer = None
+        current_path = None
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            path, frame = item
+            if path != current_path: # Первый кадр или начало нового сегмента
+                if writer is not None:
+                    close_backend(writer)
+                writer, current_path = None, path
+                try:
+                    writer = open_backend(self.backend, path, self.fps, (frame.shape[1], frame.shape[0]))
+                    logging.info(f"Запись обработанного видео: {path} ({self.backend})")
+                except Exception:
+                    logging.exception(f"Не удалось открыть {path} для записи")
+            if writer is None:
+                self.failed += 1
+                continue
+            try:
+                writer.write(frame)
+            except Exception:
+                logging.exception(f"Ошибка записи кадра в {path}, дальнейшие кадры файла пропускаются")
+                self.failed += 1
+                close_backend(writer)
+                writer = None
+        if writer is not None:
+            close_backend(writer)
@@ -0,0 +1,212 @@
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set
+
+from sqlalchemy import or_
+
+from db import SessionLocal, run_db
+from models import Violation
+
+# --- Лента новых нарушений и сводки (переопределяются переменными окружения) ---
+VIOLATION_FEED_INTERVAL = float(os.environ.get("VIOLATION_FEED_INTERVAL", "0.5")) # Период опроса БД на новые записи (сек.)
+VIOLATION_FEED_BATCH = int(os.environ.get("VIOLATION_FEED_BATCH", "1000")) # Записей за один запрос к БД
+VIOLATION_FEED_HISTORY = int(os.environ.get("VIOLATION_FEED_HISTORY", "1000")) # Последних записей в памяти для возобновления без запроса к БД
+VIOLATION_FEED_QUEUE = int(os.environ.get("VIOLATION_FEED_QUEUE", "1000")) # Предел очереди подписчика; при переполнении подписка закрывается
+GAP_TIMEOUT = 30.0 # Сколько ждать запись с пропущенным id: транзакция могла зафиксироваться позже следующих (сек.)
+MAX_GAPS = 1000 # Предел отслеживаемых пропусков id
+RETRY_INTERVAL = 5.0 # Пауза после ошибки БД (сек.)
+CAMERA_SOURCE = "camera" # Источник в сводке для нарушений без исходного файла (веб-камера)
+UNKNOWN_CLASS = "unknown" # Класс в сводке для записей без vehicle_class
+SUMMARY_DIMENSIONS = ("source", "hour", "class")
+
+
+def violation_to_dict(v: Violation) -> Dict[str, Any]:
+    """Преобразует запись о нарушении в словарь для JSON-ответа."""
+    return {
+        "id": v.id,
+        "vehicle_id": v.vehicle_id,
+        "timestamp": v.timestamp.isoformat() if v.timestamp else None,
+        "video_second": v.video_second,
+        "processed_video_path": v.processed_video_path,
+        "original_video_path": v.original_video_path,
+        "evidence_clip_path": v.evidence_clip_path,
+        "vehicle_class": v.vehicle_class,
+        "created_at": v.created_at.isoformat() if v.created_at else None
+    }
+
+
+def fetch_new(after_id: int, gaps: List[int], limit: int, upto: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Записи с id больше after_id (не больше upto) и записи с id из gaps, по возрастанию id.
+    Выполняется в пуле потоков БД (run_db).
+    """
+    session = SessionLocal()
+    try:
+        condition = Violation.id > after_id
+        if gaps:
+            condition = or_(condition, Violation.id.in_(gaps))
+        query = session.query(Violation).filter(condition)
+        if upto is not None:
+            query = query.filter(Violation.id <= upto)
+        return [violation_to_dict(v) for v in query.order_by(Violation.id).limit(limit).all()]
+    finally:
+        session.close()
+
+
+class ViolationSummary:
+    """
+    Счетчики нарушений по источникам, часам и классам ТС. Обновляются на каждой новой
+    записи ленты, поэтому запросы сводки не обращаются к БД. Час - по времени нарушения
+    (timestamp, веб-камера) или, если его нет, по времени записи в БД (created_at).
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.counts: Dict[str, Dict[str, int]] = {dimension: {} for dimension in SUMMARY_DIMENSIONS}
+
+    def add(self, row: Dict[str, Any]) -> None:
+        self.total += 1
+        moment = row["timestamp"] or row["created_at"]
+        keys = {
+            "source": row["original_video_path"] or CAMERA_SOURCE,
+            "hour": moment[:13] + ":00" if moment else None, # ISO 8601 с точностью до часа
+            "class": row["vehicle_class"] or UNKNOWN_CLASS,
+        }
+        for dimension, key in keys.items():
+            if key is not None:
+                counts = self.counts[dimension]
+                counts[key] = counts.get(key, 0) + 1
+
+    def to_dict(self, dimension: Optional[str] = None) -> Dict[str, Any]:
+        if dimension is not None:
+            return {"total": self.total, dimension: dict(sorted(self.counts[dimension].items()))}
+        return {"total": self.total, **{d: dict(sorted(c.items())) for d, c in self.counts.items()}}
+
+
+class FeedSubscription:
+    """Подписка на новые нарушения: очередь строк; None - подписка закрыта (переполнение или остановка)."""
+
+    def __init__(self, start_id: int):
+        self.start_id = start_id # Последний id ленты на момент подписки: более ранние записи - через backlog
+        self.queue: "asyncio.Queue[Optional[Dict[str, Any]]]" = asyncio.Queue()
+
+    async def get(self) -> Optional[Dict[str, Any]]:
+        return await self.queue.get()
+
+
+class ViolationFeed:
+    """
+    Лента новых нарушений для всех панелей мониторинга.
+
+    Нарушения записывают воркеры в других процессах, поэтому одна фоновая задача опрашивает
+    БД раз в interval секунд (записи с id больше последнего известного) и раздает новые записи
+    подписчикам, обновляя сводку ViolationSummary. Нагрузка на БД не зависит от числа панелей.
+    При старте вся таблица читается пакетами для сводки (ready - после этого).
+    Пропуски id после догрузки ждут запись GAP_TIMEOUT секунд: транзакция с меньшим id может
+    зафиксироваться позже следующей. Последние history записей хранятся в памяти, и
+    возобновление с недавнего id не обращается к БД. Используется только из цикла событий.
+    """
+
+    def __init__(self, interval: float = VIOLATION_FEED_INTERVAL, batch: int = VIOLATION_FEED_BATCH,
+                 history: int = VIOLATION_FEED_HISTORY, queue_limit: int = VIOLATION_FEED_QUEUE):
+        self.interval = interval
+        self.batch = max(1, batch)
+        self.queue_limit = queue_limit
+        self.summary = ViolationSummary()
+        self.last_id = 0 # Наибольший прочитанный id
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=max(1, history))
+        self._gaps: Dict[int, float] = {} # Пропущенный id -> время обнаружения
+        self._subscribers: Set[FeedSubscription] = set()
+        self.ready = False # Таблица прочитана при старте, сводка полная
+        self._ready: Optional[asyncio.Event] = None # Создается в цикле событий приложения
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._ready = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        for subscription in list(self._subscribers):
+            self.unsubscribe(subscription)
+
+    async def wait_ready(self) -> None:
+        await self._ready.wait()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                gaps = sorted(self._gaps) if self.ready else []
+                rows = await run_db(fetch_new, self.last_id, gaps, self.batch)
+            except Exception:
+                logging.exception("Ошибка чтения новых нарушений из БД")
+                await asyncio.sleep(RETRY_INTERVAL)
+                continue
+            self._publish(rows)
+            if len(rows) < self.batch:
+                if not self.ready:
+                    logging.info(f"Лента нарушений готова: {self.summary.total} записей, последний id {self.last_id}")
+                    self.ready = True
+                    self._ready.set()
+                await asyncio.sleep(self.interval)
+
+    def _publish(self, rows: List[Dict[str, Any]]) -> None:
+        """Учитывает новые записи в сводке и истории и раздает их подписчикам."""
+        now = time.monotonic()
+        for row in rows:
+            row_id = row["id"]
+            if row_id in self._gaps: # Запись из пропуска: транзакция зафиксирована позже следующих
+                del self._gaps[row_id]
+            elif row_id <= self.last_id: # Уже учтена
+                continue
+            else:
+                if self.ready: # Пропуск id может заполниться позже (не для истории до старта)
+                    for missing in range(self.last_id + 1, min(row_id, self.last_id + 1 + MAX_GAPS)):
+                        self._gaps[missing] = now
+                self.last_id = row_id
+            self.summary.add(row)
+            self._history.append(row)
+            for subscription in list(self._subscribers):
+                if subscription.queue.qsize() >= self.queue_limit: # Клиент не успевает: переподключится с последнего id
+                    self.unsubscribe(subscription)
+                else:
+                    subscription.queue.put_nowait(row)
+        for missing, seen in list(self._gaps.items()):
+            if now - seen > GAP_TIMEOUT: # Откат транзакции или удаление: id не появится
+                del self._gaps[missing]
+
+    def subscribe(self) -> FeedSubscription:
+        """Подписывает на записи, прочитанные после вызова (более ранние - через backlog)."""
+        subscription = FeedSubscription(self.last_id)
+        self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: FeedSubscription) -> None:
+        if subscription in self._subscribers:
+            self._subscribers.discard(subscription)
+            subscription.queue.put_nowait(None)
+
+    async def backlog(self, after_id: int, upto: int) -> AsyncIterator[Dict[str, Any]]:
+        """Записи с after_id < id <= upto: из истории в памяти, если она их покрывает, иначе из БД пакетами."""
+        if after_id >= upto:
+            return
+        if self._history and self._history[0]["id"] <= after_id + 1:
+            for row in list(self._history):
+                if after_id < row["id"] <= upto:
+                    yield row
+            return
+        while after_id < upto:
+            rows = await run_db(fetch_new, after_id, [], self.batch, upto)
+            if not rows:
+                break
+            for row in rows:
+                yield row
+            after_id = rows[-1]["id"]
+
+    def subscribers(self) -> int:
+        return len(self._subscribers)
@@ -0,0 +1,150 @@
+import os
+import time
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import SessionLocal
+from models import Violation
+
+# --- Конфигурация фоновой записи нарушений (переопределяется переменными окружения) ---
+VIOLATION_FLUSH_SIZE = int(os.environ.get("VIOLATION_FLUSH_SIZE", "50")) # Записей в одной пакетной вставке
+VIOLATION_FLUSH_INTERVAL = float(os.environ.get("VIOLATION_FLUSH_INTERVAL", "1.0")) # Максимальная задержка записи (сек.)
+VIOLATION_BUFFER_LIMIT = int(os.environ.get("VIOLATION_BUFFER_LIMIT", "10000")) # Предел буфера ожидающих записей
+VIOLATION_MAX_RETRIES = int(os.environ.get("VIOLATION_MAX_RETRIES", "5")) # Попыток записи одного пакета
+VIOLATION_CLOSE_TIMEOUT = float(os.environ.get("VIOLATION_CLOSE_TIMEOUT", "10")) # Ожидание записи оставшихся строк при закрытии (сек.)
+RETRY_BACKOFF = 0.5 # Начальная пауза между попытками (сек.), удваивается с каждой попыткой
+
+
+class ViolationWriter:
+    """
+    Фоновая запись нарушений в БД (write-behind).
+
+    Цикл обработки кадров только помещает строку в ограниченный буфер (`add` никогда не ждет БД),
+    а отдельный поток сбрасывает накопленные строки одной пакетной вставкой, когда их набирается
+    flush_size или проходит flush_interval секунд. Неудачные вставки повторяются с нарастающей
+    паузой. При закрытии (`close`) ожидающие строки записываются не дольше close_timeout секунд;
+    если БД недоступна, оставшиеся строки отбрасываются с записью в лог, а остановка не зависает.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Any] = SessionLocal,
+        flush_size: int = VIOLATION_FLUSH_SIZE,
+        flush_interval: float = VIOLATION_FLUSH_INTERVAL,
+        buffer_limit: int = VIOLATION_BUFFER_LIMIT,
+        max_retries: int = VIOLATION_MAX_RETRIES,
+        close_timeout: Optional[float] = VIOLATION_CLOSE_TIMEOUT,
+        timings: Any = None # Замер длительности вставок: timings.observe("db_flush", seconds)
+    ):
+        self.session_factory = session_factory
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max(1, max_retries)
+        self.close_timeout = close_timeout
+        self.timings = timings
+        self._buffer: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=buffer_limit)
+        self._closed = threading.Event()
+        self._abort = threading.Event() # Истек срок закрытия: повторы прекращаются, строки отбрасываются
+        self._lock = threading.Lock()
+        self._pending = 0 # Строк в пакете, который записывается сейчас
+        self._thread: Optional[threading.Thread] = None
+        self.written = 0 # Записано строк
+        self.dropped = 0 # Отброшено строк (переполнение буфера или исчерпаны попытки)
+
+    def start(self) -> "ViolationWriter":
+        """Запускает поток записи."""
+        self._thread = threading.Thread(target=self._run, name="violation-writer", daemon=True)
+        self._thread.start()
+        return self
+
+    def add(self, row: Dict[str, Any]) -> bool:
+        """
+        Ставит нарушение (словарь значений полей Violation) в очередь на запись.
+        Не блокирует; возвращает False, если буфер переполнен и строка отброшена.
+        """
+        try:
+            self._buffer.put_nowait(row)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logging.error(f"Буфер записи нарушений переполнен, нарушение отброшено: {row}")
+            return False
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """
+        Останавливает поток, предварительно записав ожидающие строки. Ждет не дольше timeout
+        секунд (по умолчанию close_timeout; close_timeout=None - без ограничения); по истечении
+        поток прекращает повторы, а строки, которые не удалось записать, учитываются в dropped.
+        """
+        self._closed.set()
+        if self._thread is None:
+            return
+        self._thread.join(timeout if timeout is not None else self.close_timeout)
+        if self._thread.is_alive():
+            with self._lock:
+                unwritten = self._pending + self._buffer.qsize()
+            self._abort.set()
+            logging.error(f"Запись нарушений не завершена за отведенное время, не записано строк: {unwritten}")
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        """Собирает пакет: до flush_size строк или все, что накопилось за flush_interval."""
+        batch: List[Dict[str, Any]] = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.monotonic()
+            if self._closed.is_set(): # При закрытии забираем все без ожидания
+                remaining = 0
+            try:
+                batch.append(self._buffer.get(timeout=remaining) if remaining > 0 else self._buffer.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        """Основной цикл потока записи."""
+        while True:
+            closing = self._closed.is_set()
+            batch = self._take_batch()
+            if batch and self._abort.is_set():
+                self._drop(batch)
+            elif batch:
+                with self._lock:
+                    self._pending = len(batch)
+                self._flush(batch)
+                with self._lock:
+                    self._pending = 0
+            elif closing:
+                break
+
+    def _flush(self, rows: List[Dict[str, Any]]) -> None:
+        """Записывает пакет одной вставкой, повторяя попытки при ошибках БД."""
+        for attempt in range(self.max_retries):
+            if self._abort.is_set():
+                break
+            session = self.session_factory()
+            started = time.perf_counter()
+            try:
+                session.execute(insert(Violation), rows)
+                session.commit()
+                self.written += len(rows)
+                if self.timings is not None:
+                    self.timings.observe("db_flush", time.perf_counter() - started)
+                return
+            except SQLAlchemyError:
+                session.rollback()
+                logging.exception(f"Ошибка записи {len(rows)} нарушений (попытка {attempt + 1}/{self.max_retries})")
+            finally:
+                session.close()
+            if attempt + 1 < self.max_retries:
+                self._abort.wait(RETRY_BACKOFF * 2 ** attempt) # Пауза прерывается по истечении срока закрытия
+        self._drop(rows)
+
+    def _drop(self, rows: List[Dict[str, Any]]) -> None:
+        """Отбрасывает строки, которые не удалось записать."""
+        self.dropped += len(rows)
+        logging.error(f"Не удалось записать {len(rows)} нарушений: {rows}")
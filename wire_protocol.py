@@ -0,0 +1,153 @@
+import json
+import struct
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+# --- Протоколы передачи кадров /ws/video_feed ---
+LEGACY_PROTOCOL = "legacy" # JSON-сообщение с полным frame_data + бинарное сообщение с JPEG
+DELTA_PROTOCOL = "delta" # Одно бинарное сообщение на кадр: изменения метаданных + JPEG
+# JSON-сообщение с frame_data на каждый кадр без JPEG: клиент рисует рамки поверх своего видео
+# (файл по video_url из подтверждения протокола); для камеры за частью кадров следует JPEG без разметки
+METADATA_PROTOCOL = "metadata"
+SUPPORTED_PROTOCOLS = (DELTA_PROTOCOL, LEGACY_PROTOCOL, METADATA_PROTOCOL) # В порядке предпочтения сервера
+DELTA_VERSION = 1
+DELTA_HEADER = struct.Struct("!BI") # Версия формата, длина метаданных в байтах (сетевой порядок)
+# Поля frame_data, передаваемые целиком и только при изменении
+DELTA_FIELDS = (
+    "traffic_lights", "crosswalk_bbox", "total_crossings", "red_light_violations",
+    "frame_width", "frame_height", "output_path"
+)
+
+
+def negotiate_protocol(requested: Any, unavailable: Tuple[str, ...] = ()) -> str:
+    """
+    Выбирает протокол по полю "protocol" первого сообщения клиента: строка или
+    список допустимых протоколов в порядке предпочтения клиента. Без поля - legacy.
+    unavailable - протоколы, которые для этого источника не подходят.
+    """
+    if requested is None:
+        return LEGACY_PROTOCOL
+    options = [requested] if isinstance(requested, str) else list(requested)
+    return next((p for p in options if p in SUPPORTED_PROTOCOLS and p not in unavailable), LEGACY_PROTOCOL)
+
+
+def json_default(obj: Any) -> Any:
+    """Сериализация скаляров и массивов NumPy, оставшихся в метаданных кадра."""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Тип {type(obj).__name__} не сериализуется в JSON")
+
+
+class DeltaEncoder:
+    """
+    Кодировщик кадров протокола delta для одного соединения.
+
+    Сообщение: заголовок DELTA_HEADER (версия, длина метаданных), метаданные в компактном JSON
+    (UTF-8) и байты JPEG до конца сообщения. Метаданные содержат номер кадра "seq" и только
+    изменения относительно предыдущего кадра соединения (первый кадр содержит все):
+    - "vehicles_upsert": ТС с треком, которые появились или у которых изменилась рамка/метка;
+    - "vehicles_removed": ID треков, пропавших из кадра;
+    - "vehicles_untracked": ТС без ID трека (передаются при изменении списка);
+    - "vehicle_states": изменившиеся состояния ТС по ID;
+    - "vehicle_states_removed": ID состояний, удаленных из хранилища треков;
+    - поля DELTA_FIELDS, значение которых изменилось.
+    """
+
+    def __init__(self):
+        self.seq = 0 # Номер следующего кадра
+        self._vehicles: Dict[Any, Tuple[Any, Any]] = {} # Треки, известные клиенту: ID -> (метка, рамка)
+        self._states: Dict[Any, Tuple[bool, bool]] = {} # Состояния ТС, известные клиенту
+        self._fields: Dict[str, Any] = {} # Последние отправленные значения DELTA_FIELDS
+
+    def encode(self, frame_data: Dict[str, Any], jpeg: Any) -> bytes:
+        """Формирует бинарное сообщение кадра и запоминает отправленное состояние."""
+        meta: Dict[str, Any] = {"seq": self.seq}
+        self.seq += 1
+
+        # ТС с треком - только изменения, без трека - список целиком
+        vehicles: Dict[Any, Tuple[Any, Any]] = {}
+        untracked: List[Dict[str, Any]] = []
+        for vehicle in frame_data.get("vehicles", ()):
+            if vehicle["id"] == -1:
+                untracked.append(vehicle)
+            else:
+                vehicles[vehicle["id"]] = (vehicle["label"], vehicle["bbox"])
+        upsert = [
+            {"id": tid, "label": label, "bbox": bbox}
+            for tid, (label, bbox) in vehicles.items() if self._vehicles.get(tid) != (label, bbox)
+        ]
+        removed = [tid for tid in self._vehicles if tid not in vehicles]
+        if upsert:
+            meta["vehicles_upsert"] = upsert
+        if removed:
+            meta["vehicles_removed"] = removed
+        if untracked != self._fields.get("vehicles_untracked", []):
+            meta["vehicles_untracked"] = untracked
+            self._fields["vehicles_untracked"] = untracked
+        self._vehicles = vehicles
+
+        # Состояния ТС - только изменившиеся и удаленные из хранилища треков
+        current = frame_data.get("vehicle_states", {})
+        states = {}
+        for tid, state in current.items():
+            value = (state["crossed"], state["crossed_on_red"])
+            if self._states.get(tid) != value:
+                self._states[tid] = value
+                states[str(tid)] = state
+        if states:
+            meta["vehicle_states"] = states
+        if len(self._states) > len(current): # Часть состояний удалена на сервере (TrackStateStore)
+            removed_states = [tid for tid in self._states if tid not in current]
+            for tid in removed_states:
+                del self._states[tid]
+            meta["vehicle_states_removed"] = [str(tid) for tid in removed_states]
+
+        # Остальные поля - при изменении значения
+        for name in DELTA_FIELDS:
+            value = frame_data.get(name)
+            if name not in self._fields or self._fields[name] != value:
+                meta[name] = value
+                self._fields[name] = value
+
+        payload = json.dumps(meta, separators=(",", ":"), ensure_ascii=False, default=json_default).encode("utf-8")
+        return DELTA_HEADER.pack(DELTA_VERSION, len(payload)) + payload + bytes(jpeg)
+
+
+def decode_delta(message: bytes) -> Tuple[Dict[str, Any], bytes]:
+    """Разбирает сообщение протокола delta на метаданные и байты JPEG (для клиентов на Python и проверок)."""
+    version, length = DELTA_HEADER.unpack_from(message)
+    if version != DELTA_VERSION:
+        raise ValueError(f"Неподдерживаемая версия протокола delta: {version}")
+    start = DELTA_HEADER.size
+    return json.loads(message[start:start + length]), message[start + length:]
+
+
+class DeltaDecoder:
+    """Восстанавливает полный frame_data из последовательности сообщений протокола delta."""
+
+    def __init__(self):
+        self.vehicles: Dict[Any, Dict[str, Any]] = {}
+        self.frame_data: Dict[str, Any] = {"vehicles": [], "vehicle_states": {}}
+
+    def decode(self, message: bytes) -> Tuple[Dict[str, Any], bytes]:
+        meta, jpeg = decode_delta(message)
+        for tid in meta.get("vehicles_removed", ()):
+            self.vehicles.pop(tid, None)
+        for vehicle in meta.get("vehicles_upsert", ()):
+            self.vehicles[vehicle["id"]] = vehicle
+        if "vehicles_untracked" in meta:
+            self.frame_data["vehicles_untracked"] = meta["vehicles_untracked"]
+        for tid in meta.get("vehicle_states_removed", ()):
+            self.frame_data["vehicle_states"].pop(tid, None)
+        self.frame_data["vehicle_states"].update(meta.get("vehicle_states", {}))
+        for name in DELTA_FIELDS:
+            if name in meta:
+                self.frame_data[name] = meta[name]
+        self.frame_data["vehicles"] = list(self.vehicles.values()) + self.frame_data.get("vehicles_untracked", [])
+        return self.frame_data, jpeg
+
@@ -0,0 +1,371 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Any, List, Optional, Tuple
+
+import cv2
+
+from frame_transport import SharedFrameRing
+from stream_control import FRAME_DROP_POLICY, JPEG_MAX_QUALITY, METADATA_CAMERA_FPS, RENDER_FULL, RENDER_NONE
+from evidence import FULL_RECORDING
+from metrics import METRICS_ENABLED, WORKER_GAUGES, WORKER_STAGES, StageHistograms, histograms_size
+
+# --- Конфигурация пула воркеров (переопределяется переменными окружения) ---
+WORKER_POOL_SIZE = int(os.environ.get("WORKER_POOL_SIZE", "2")) # Количество заранее запущенных воркеров
+WORKER_POOL_MAX_SIZE = int(os.environ.get("WORKER_POOL_MAX_SIZE", str(max(WORKER_POOL_SIZE, 4)))) # Верхний предел при росте пула
+WORKER_HANG_TIMEOUT = float(os.environ.get("WORKER_HANG_TIMEOUT", "30")) # Секунды без новых кадров, после которых воркер считается зависшим
+WORKER_START_METHOD = os.environ.get("WORKER_START_METHOD", "spawn") # Способ запуска процессов multiprocessing
+WORKER_SESSIONS = int(os.environ.get("WORKER_SESSIONS", "1")) # Сессий на воркер; больше 1 включает пакетный инференс
+MONITOR_INTERVAL = 1.0 # Период проверки состояния воркеров (сек.)
+ACQUIRE_POLL_INTERVAL = 0.05 # Период ожидания свободного воркера (сек.)
+
+
+def camera_worker(
+    video_path, ring, stop_event, heartbeat=None, inference=None, stream_id=None,
+    quality=None, scale=None, dropped=None, metrics_buffer=None, render=None
+):
+    """
+    Обрабатывает кадры видео/камеры и отправляет результаты через кольцевой буфер
+    в разделяемой памяти (ring) до тех пор, пока не будет установлено событие остановки (stop_event).
+    Если передан heartbeat (`multiprocessing.Value`), в него записывается время последнего кадра.
+    inference и stream_id передаются в process_video для пакетного инференса.
+    quality и scale (`multiprocessing.Value`) задают качество JPEG и масштаб кадра, их меняет
+    эндпоинт по задержке клиента. При политике FRAME_DROP_POLICY="latest" кадр, для которого
+    нет свободного слота, не кодируется и не ждет клиента; число таких кадров пишется в dropped.
+    Метаданные кадра передаются вместе со временем его готовности: (frame_data, time.time()).
+    Видео целиком записывается только при FULL_RECORDING; нарушения сохраняются фрагментами.
+    Если передан metrics_buffer (общий массив слота), в него пишутся гистограммы этапов
+    кадра (metrics.WORKER_STAGES) и глубина очередей сессии.
+    render (`multiprocessing.Value`) задает режим отрисовки (stream_control.RENDER_*), его меняет
+    эндпоинт по составу зрителей: при RENDER_NONE кадр не рисуется и не кодируется, передаются
+    только метаданные (пустой кадр); при RENDER_RAW кадр без разметки кодируется не чаще
+    METADATA_CAMERA_FPS раз в секунду, остальные кадры передаются без изображения.
+    Если результаты загруженного файла уже есть в кэше (result_cache), они воспроизводятся
+    без инференса; иначе результаты обработки, дошедшей до конца файла, сохраняются в кэш.
+    """
+    from yolo8_video import process_video, replay_video # Импорт внутри функции для корректной работы multiprocessing
+    from result_cache import result_cache
+    drop_frames = FRAME_DROP_POLICY == "latest"
+    metrics = StageHistograms(WORKER_STAGES, WORKER_GAUGES, metrics_buffer) if metrics_buffer is not None else None
+    draw = (lambda: render.value == RENDER_FULL) if render is not None else True
+    last_encoded = 0.0 # Время последнего кодирования кадра в режиме RENDER_RAW
+    # SHA-256 берется только из sources.json (загруженные файлы): чтение файла целиком задержало бы первый кадр
+    cached = result_cache.find(video_path, need_frames=True, need_video=FULL_RECORDING) if isinstance(video_path, str) else None
+    if cached is not None:
+        output_path = result_cache.restore_outputs(cached) if FULL_RECORDING else None
+        frames = replay_video(
+            video_path, cached["key"], return_frame=True, stop_event=stop_event,
+            draw=draw, timings=metrics, output_path=output_path
+        )
+    else:
+        frames = process_video(
+            video_path, return_frame=True, save_output=FULL_RECORDING, stop_event=stop_event,
+            inference=inference, stream_id=stream_id, timings=metrics, draw=draw,
+            recorder=result_cache.recorder(video_path) if isinstance(video_path, str) else None
+        )
+    for frame_data, frame in frames:
+        if stop_event.is_set(): # Проверка флага остановки
+            break
+        if heartbeat is not None:
+            heartbeat.value = time.time()
+        if drop_frames and not ring.writable(): # Клиент не успевает: кадр отбрасывается до кодирования
+            if dropped is not None:
+                dropped.value += 1
+            if metrics is not None:
+                metrics.end_frame()
+            continue
+        mode = render.value if render is not None else RENDER_FULL
+        if mode != RENDER_FULL and (mode == RENDER_NONE or time.time() - last_encoded < 1.0 / METADATA_CAMERA_FPS):
+            # Клиент рисует рамки сам: передаются только метаданные кадра
+            if not ring.put((frame_data, time.time()), b"", stop_event):
+                break
+            if metrics is not None:
+                metrics.lap("publish")
+                metrics.set_gauge("ring_depth", ring.in_flight())
+                metrics.end_frame()
+            continue
+        if mode != RENDER_FULL:
+            last_encoded = time.time()
+        if scale is not None and scale.value < 1.0: # Уменьшение кадра для медленного клиента
+            frame = cv2.resize(frame, None, fx=scale.value, fy=scale.value, interpolation=cv2.INTER_AREA)
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality.value] if quality is not None else []
+        ret, jpeg = cv2.imencode('.jpg', frame, params) # Кодирование кадра в JPEG
+        if metrics is not None:
+            metrics.lap("encode")
+        if not ret:
+            if metrics is not None:
+                metrics.end_frame()
+            continue
+        if not ring.put((frame_data, time.time()), jpeg, stop_event): # Запись JPEG в слот разделяемой памяти
+            break
+        if metrics is not None: # Ожидание свободного слота и передача кадра
+            metrics.lap("publish")
+            metrics.set_gauge("ring_depth", ring.in_flight())
+            metrics.end_frame()
+    ring.close_stream()  # Сигнал о завершении обработки
+
+
+def run_session(video_path, lane, inference=None, stream_id=None) -> None:
+    """Выполняет одну сессию в слоте воркера; при ошибке сообщает потребителю о конце потока."""
+    ring, stop_event, heartbeat, quality, scale, dropped, metrics_buffer, render = lane
+    try:
+        camera_worker(video_path, ring, stop_event, heartbeat, inference, stream_id, quality, scale, dropped, metrics_buffer, render)
+    except Exception:
+        logging.exception("Ошибка в воркере пула")
+        ring.close_stream()
+
+
+def pool_worker(commands, lanes, ready) -> None:
+    """
+    Основной цикл долгоживущего воркера пула.
+    Модель YOLO загружается один раз при старте процесса, после чего воркер
+    обслуживает сессии: получает через канал commands пару (номер слота, путь к видео)
+    и передает кадры через кольцевой буфер слота. None завершает воркер.
+    При нескольких слотах сессии выполняются в потоках, а инференс для них
+    объединяется в пакеты общим BatchedInferenceService с отдельным трекером на поток.
+    """
+    import yolo8_video # Загрузка модели (и torch) один раз на весь срок жизни процесса
+    inference = None
+    if len(lanes) > 1:
+        from inference_service import BatchedInferenceService
+        inference = BatchedInferenceService(yolo8_video.model)
+        inference.start()
+    ready.set()
+    while True:
+        command = commands.recv()
+        if command is None:
+            break
+        index, video_path = command
+        if inference is None:
+            run_session(video_path, lanes[index])
+        else:
+            threading.Thread(
+                target=run_session, args=(video_path, lanes[index], inference, index),
+                name=f"session-{index}", daemon=True
+            ).start()
+    if inference is not None:
+        inference.stop()
+
+
+class WorkerLane:
+    """Слот сессии в воркере пула: свой транспорт кадров, событие остановки и heartbeat."""
+
+    def __init__(self, worker: "PoolWorker", index: int, ctx: Any):
+        self.worker = worker
+        self.index = index
+        self.ring = SharedFrameRing() # Кольцевой буфер кадров, переиспользуется между сессиями
+        self.stop_event = ctx.Event() # Событие остановки текущей сессии
+        self.heartbeat = ctx.Value('d', 0.0) # Время последнего обработанного кадра
+        self.quality = ctx.Value('i', JPEG_MAX_QUALITY) # Качество JPEG, задается эндпоинтом
+        self.scale = ctx.Value('d', 1.0) # Масштаб кадра, задается эндпоинтом
+        self.dropped = ctx.Value('i', 0) # Кадров сессии, отброшенных воркером без кодирования
+        self.render = ctx.Value('i', RENDER_FULL) # Режим отрисовки (stream_control.RENDER_*), задается эндпоинтом
+        # Гистограммы этапов сессии в общей памяти (пишет воркер, читает /metrics)
+        self.metrics = StageHistograms(WORKER_STAGES, WORKER_GAUGES, ctx.RawArray('d', histograms_size(WORKER_STAGES, WORKER_GAUGES)))
+        self.busy = False # Занят ли слот сессией
+        self.video_path: Any = None
+
+    @property
+    def dead(self) -> bool:
+        return self.worker.dead
+
+    def transport(self):
+        """Объекты слота, передаваемые в процесс воркера."""
+        metrics_buffer = self.metrics.buffer if METRICS_ENABLED else None
+        return self.ring, self.stop_event, self.heartbeat, self.quality, self.scale, self.dropped, metrics_buffer, self.render
+
+    def start_session(self, video_path: Any) -> None:
+        """Запускает обработку нового источника в этом слоте воркера."""
+        self.video_path = video_path
+        self.stop_event.clear()
+        self.heartbeat.value = time.time()
+        self.dropped.value = 0
+        self.render.value = RENDER_FULL # Уточняется эндпоинтом по зрителям источника
+        self.metrics.reset()
+        self.ring.reset()
+        self.worker.commands.send((self.index, video_path))
+
+    def is_hung(self, timeout: float) -> bool:
+        """Слот занят, давно не отдавал кадров и потребитель не отстает от него."""
+        if not self.busy or not self.worker.ready.is_set():
+            return False
+        stale = time.time() - self.heartbeat.value > timeout
+        return stale and not self.ring.pending()
+
+
+class PoolWorker:
+    """Процесс пула вместе со слотами сессий и каналом команд."""
+
+    def __init__(self, ctx: Any, sessions: int = 1):
+        self.ready = ctx.Event() # Установлено, когда модель загружена
+        self.lanes = [WorkerLane(self, i, ctx) for i in range(max(1, sessions))]
+        child_commands, self.commands = multiprocessing.Pipe(duplex=False) # Канал команд: пул -> воркер
+        self.process = ctx.Process(
+            target=pool_worker,
+            args=(child_commands, [lane.transport() for lane in self.lanes], self.ready),
+            daemon=True
+        )
+        self.dead = False # Воркер выведен из пула (завис или завершился)
+        self.process.start()
+
+    def busy_lanes(self) -> int:
+        return sum(1 for lane in self.lanes if lane.busy)
+
+    def terminate(self) -> None:
+        """Принудительно завершает процесс воркера."""
+        self.dead = True
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(timeout=5)
+
+
+class WorkerPool:
+    """
+    Пул долгоживущих процессов обработки видео с заранее загруженной моделью.
+    Каждый воркер обслуживает до `sessions` сессий одновременно. Сессии /ws/video_feed
+    назначаются свободным слотам наименее загруженного воркера; при нехватке пул растет
+    до max_size. Фоновый поток заменяет зависшие и упавшие воркеры.
+    """
+
+    def __init__(
+        self,
+        size: int = WORKER_POOL_SIZE,
+        max_size: int = WORKER_POOL_MAX_SIZE,
+        hang_timeout: float = WORKER_HANG_TIMEOUT,
+        start_method: str = WORKER_START_METHOD,
+        sessions: int = WORKER_SESSIONS
+    ):
+        self.size = size
+        self.max_size = max(size, max_size)
+        self.hang_timeout = hang_timeout
+        self.sessions = max(1, sessions)
+        self._ctx = multiprocessing.get_context(start_method)
+        self._workers: List[PoolWorker] = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+
+    def _spawn(self) -> PoolWorker:
+        return PoolWorker(self._ctx, self.sessions)
+
+    def start(self) -> None:
+        """Запускает воркеры и поток мониторинга."""
+        with self._lock:
+            for _ in range(self.size):
+                self._workers.append(self._spawn())
+        self._monitor = threading.Thread(target=self._monitor_loop, name="worker-pool-monitor", daemon=True)
+        self._monitor.start()
+        logging.info(f"Пул воркеров запущен: {self.size} процесс(ов) по {self.sessions} сессий")
+
+    def _take_idle(self) -> Optional[WorkerLane]:
+        """
+        Находит свободный слот (предпочитая воркеры, уже загрузившие модель,
+        и наименее загруженные) или расширяет пул.
+        """
+        with self._lock:
+            candidates = [w for w in self._workers if not w.dead and w.busy_lanes() < len(w.lanes)]
+            candidates.sort(key=lambda w: (not w.ready.is_set(), w.busy_lanes()))
+            lane = None
+            if candidates:
+                lane = next(lane for lane in candidates[0].lanes if not lane.busy)
+            elif len(self._workers) < self.max_size:
+                worker = self._spawn()
+                self._workers.append(worker)
+                lane = worker.lanes[0]
+            if lane is not None:
+                lane.busy = True
+            return lane
+
+    async def acquire(self, video_path: Any) -> WorkerLane:
+        """Назначает сессию свободному слоту воркера и запускает в нем обработку video_path."""
+        lane = self._take_idle()
+        while lane is None:
+            await asyncio.sleep(ACQUIRE_POLL_INTERVAL)
+            lane = self._take_idle()
+        while not lane.worker.ready.is_set(): # Воркер, созданный при росте пула, еще загружает модель
+            if not lane.worker.process.is_alive():
+                await self.release(lane, stream_finished=True)
+                raise RuntimeError("Воркер пула завершился во время загрузки модели")
+            await asyncio.sleep(ACQUIRE_POLL_INTERVAL)
+        lane.start_session(video_path)
+        return lane
+
+    async def release(self, lane: WorkerLane, stream_finished: bool) -> None:
+        """
+        Завершает сессию: останавливает обработку, вычитывает оставшиеся кадры
+        и освобождает слот. Воркер, не завершивший сессию вовремя, заменяется.
+        """
+        lane.stop_event.set()
+        if not lane.dead and not stream_finished:
+            loop = asyncio.get_running_loop()
+            drained = await loop.run_in_executor(None, lane.ring.drain, self.hang_timeout)
+            if not drained:
+                logging.warning(f"Воркер {lane.worker.process.pid} не завершил сессию, перезапуск")
+                self._recycle(lane.worker)
+        if lane.dead:
+            lane.ring.close()
+            return
+        with self._lock:
+            lane.busy = False
+            lane.video_path = None
+
+    def _recycle(self, worker: PoolWorker) -> None:
+        """Останавливает воркер и заменяет его новым процессом."""
+        with self._lock:
+            if worker.dead:
+                return
+            worker.terminate()
+            self._workers.remove(worker)
+            if not self._closed.is_set() and len(self._workers) < self.size:
+                self._workers.append(self._spawn())
+        for lane in worker.lanes:
+            if lane.busy:
+                lane.ring.close_stream() # Разблокирует эндпоинт, ожидающий кадры
+            else:
+                lane.ring.close()
+
+    def _monitor_loop(self) -> None:
+        """Периодически заменяет зависшие и неожиданно завершившиеся воркеры."""
+        while not self._closed.wait(MONITOR_INTERVAL):
+            with self._lock:
+                workers = list(self._workers)
+            for worker in workers:
+                if not worker.process.is_alive():
+                    logging.warning(f"Воркер {worker.process.pid} завершился, перезапуск")
+                    self._recycle(worker)
+                    continue
+                hung = next((lane for lane in worker.lanes if lane.is_hung(self.hang_timeout)), None)
+                if hung is not None:
+                    logging.warning(f"Воркер {worker.process.pid} завис на {hung.video_path}, перезапуск")
+                    self._recycle(worker)
+
+    def workers(self) -> List[Tuple[int, int]]:
+        """PID и число занятых слотов живых воркеров пула."""
+        with self._lock:
+            return [(w.process.pid, w.busy_lanes()) for w in self._workers if not w.dead]
+
+    def active_sessions(self) -> int:
+        """Количество слотов воркеров, занятых сессиями."""
+        with self._lock:
+            return sum(w.busy_lanes() for w in self._workers)
+
+    def shutdown(self) -> None:
+        """Останавливает все воркеры пула."""
+        self._closed.set()
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            for lane in worker.lanes:
+                lane.stop_event.set()
+            try:
+                worker.commands.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+            worker.process.join(timeout=5)
+            worker.terminate()
+            for lane in worker.lanes:
+                lane.ring.close()
+        logging.info("Пул воркеров остановлен")
@@ -3,17 +3,34 @@ import cv2
 import numpy as np
 import logging
 import datetime
-from typing import Any, Dict, Generator, Optional, Tuple
-from ultralytics import YOLO
-from db import SessionLocal
-from models import Violation
-from utils import detect_crosswalk, intersection_area
+from typing import Any, Callable, Dict, Generator, Optional, Tuple, Union
+from violation_writer import ViolationWriter
+from video_output import VideoOutput
+from evidence import EVIDENCE_CLIPS, EvidenceRecorder
+from utils import CROSSWALK_RETRY_MAX, Detections, detect_crosswalk, intersection_areas
+from calibration import crosswalk_cache, source_fingerprint
+from track_state import TrackStateStore
+from inference_service import BatchedStream
+from frame_skipping import DETECT_EVERY, SkippingStream, parse_detect_every
+from frame_source import FrameSource
+from inference_backend import INFERENCE_IMGSZ, load_model
+from result_cache import result_cache
 
 # --- Настройка логирования ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
 # --- Инициализация модели YOLO ---
-model = YOLO("yolo-coco/best.pt") # Загрузка предварительно обученной модели YOLO
+model = load_model() # Веса yolo-coco/best.pt на бэкенде INFERENCE_BACKEND (torch, onnx, openvino)
+MODEL_NAMES = model.names # Один раз: у экспортированной модели каждое обращение к names открывает ее заново
+
+# --- Маски классов (вычисляются один раз по именам классов модели) ---
+VEHICLE_LABELS = ['bus', 'car', 'motorcycle', 'truck', 'van'] # Классы транспортных средств
+LIGHT_LABELS = ['green_light', 'red_light', 'yellow_light'] # Классы сигналов светофора
+CLASS_NAMES = np.array([MODEL_NAMES[i] for i in range(len(MODEL_NAMES))], dtype=object) # Метки по ID класса
+VEHICLE_CLASS_IDS = np.array([i for i, name in MODEL_NAMES.items() if name in VEHICLE_LABELS], dtype=int)
+LIGHT_CLASS_IDS = np.array([i for i, name in MODEL_NAMES.items() if name in LIGHT_LABELS], dtype=int)
+CLASS_IDS = {name: i for i, name in MODEL_NAMES.items()} # ID класса по метке
+LIGHT_STYLES = (('green_light', (0, 255, 0), "Green"), ('red_light', (0, 0, 255), "Red"), ('yellow_light', (0, 255, 255), "Yellow")) # Цвет и подпись рамок светофоров
 
 
 def draw_box(frame: np.ndarray, box: Tuple[int, int, int, int], color: Tuple[int, int, int], label: Optional[str] = None) -> None:
@@ -24,42 +41,146 @@ def draw_box(frame: np.ndarray, box: Tuple[int, int, int, int], color: Tuple[int
         cv2.putText(frame, label, (x, y - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
 
 
+def draw_overlays(frame: np.ndarray, frame_data: Dict[str, Any]) -> None:
+    """Отрисовывает переход, светофоры, ТС и счетчики по frame_data (результат кадра или запись кэша)."""
+    if frame_data['crosswalk_bbox']: # Рамка пешеходного перехода (x, y, w, h)
+        draw_box(frame, tuple(frame_data['crosswalk_bbox']), (255, 0, 0), "Crosswalk")
+
+    # Рамки светофоров (x1, y1, x2, y2)
+    for light_label, color, text in LIGHT_STYLES:
+        for light in frame_data['traffic_lights']:
+            if light['label'] == light_label:
+                x1, y1, x2, y2 = light['bbox']
+                draw_box(frame, (x1, y1, x2 - x1, y2 - y1), color, text)
+
+    # Рамки ТС
+    for vehicle in frame_data['vehicles']:
+        x1, y1, x2, y2 = vehicle['bbox']
+        tid = vehicle['id']
+        label = f"{vehicle['label']} ID:{tid}" if tid != -1 else vehicle['label']
+        draw_box(frame, (x1, y1, x2 - x1, y2 - y1), (255, 255, 0), label)
+
+    # Счетчики
+    cv2.putText(frame, f"Crossed: {frame_data['total_crossings']}", (30, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+    cv2.putText(frame, f"Red crossed: {frame_data['red_light_violations']}", (30, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+
+
+def reset_session_state() -> None:
+    """
+    Сбрасывает состояние модели, оставшееся от предыдущей сессии обработки
+    (треки BoT-SORT), чтобы новый источник начинался с чистого листа.
+    Все вызовы model.track выполняются с persist=True: Ultralytics запоминает режим
+    трекера при первом вызове, и смешение режимов в одном процессе ломает трекинг.
+    """
+    predictor = getattr(model, "predictor", None)
+    for tracker in getattr(predictor, "trackers", None) or []:
+        tracker.reset()
+
+
+def parse_boxes(result: Any) -> Detections:
+    """Извлекает координаты, классы и ID треков всех рамок кадра одним переносом на CPU."""
+    boxes = result.boxes
+    xyxy = boxes.xyxy.cpu().numpy().astype(int) # Координаты рамок (N, 4)
+    cls = boxes.cls.cpu().numpy().astype(int) # ID классов объектов
+    if boxes.id is not None: # ID объектов от трекера
+        ids = boxes.id.cpu().numpy().astype(int)
+    else:
+        ids = np.full(len(cls), -1, dtype=int)
+    return Detections(xyxy, cls, ids)
+
+
+def track_frame(frame: np.ndarray) -> Detections:
+    """Детекция и трекинг одного кадра с сохранением состояния трекера между вызовами."""
+    results = model.track(frame, tracker="botsort.yaml", persist=True, imgsz=INFERENCE_IMGSZ, show=False, verbose=False)
+    return parse_boxes(results[0])
+
+
+def timed_detector(detect: Callable[[np.ndarray], Detections], timings: Any) -> Callable[[np.ndarray], Detections]:
+    """Добавляет к детектору замер этапов: ожидание кадра - "decode", детекция и трекинг - "inference"."""
+    if timings is None:
+        return detect
+
+    def timed(frame: np.ndarray) -> Detections:
+        timings.lap("decode")
+        detections = detect(frame)
+        timings.lap("inference")
+        return detections
+    return timed
+
+
 def process_video(
     input_video: Any, # Источник видео (путь к файлу или 0 для веб-камеры)
     show_windows: bool = False, # Флаг для отображения окон OpenCV в процессе обработки
     return_frame: bool = False, # Флаг, указывающий, нужно ли возвращать сам кадр помимо данных
     save_output: bool = True, # Флаг для сохранения обработанного видео в файл
-    stop_event: Any = None # Событие для прерывания обработки извне (например, от WebSocket)
+    stop_event: Any = None, # Событие для прерывания обработки извне (например, от WebSocket)
+    inference: Any = None, # Общий сервис пакетного инференса (BatchedInferenceService) или None
+    stream_id: Any = None, # Идентификатор потока в сервисе пакетного инференса
+    detect_every: Union[int, str] = DETECT_EVERY, # Детекция каждые N кадров или "auto" (1 - на каждом кадре)
+    save_violations: bool = True, # Флаг для записи нарушений в базу данных
+    draw: Union[bool, Callable[[], bool]] = True, # Отрисовка рамок и счетчиков (функция - решение на каждом кадре)
+    save_evidence: bool = EVIDENCE_CLIPS, # Флаг записи видеофрагмента для каждого нарушения
+    timings: Any = None, # Замер этапов: объект с методами lap(stage) и observe(stage, seconds) (metrics.StageHistograms)
+    start_frame: int = 0, # Первый обрабатываемый кадр видеофайла (сегменты segments.py)
+    end_frame: Optional[int] = None, # Кадр, перед которым обработка останавливается (None - до конца видео)
+    recorder: Any = None, # Запись результатов в кэш (result_cache.ResultRecorder) или None
+    raise_errors: bool = False # Передавать ошибку обработки вызывающему коду (задания, сегменты)
 ) -> Generator:
     """
     Генератор, возвращающий результаты детекции и кадры для каждого кадра видео.
     Обрабатывает как видеофайлы, так и потоки с веб-камеры.
     Поддерживает внешнее прерывание через stop_event.
+    Если передан inference, кадры обрабатываются пакетно вместе с другими потоками процесса.
+    При detect_every > 1 (или "auto") детектор запускается не на каждом кадре,
+    а рамки ТС на остальных кадрах переносятся моделью движения.
+    При draw=False кадры не изменяются: отрисовка пропускается, счетчики и нарушения считаются как обычно.
+    Если draw - функция, она вызывается на каждом кадре (зрители источника могут рисовать рамки сами);
+    frame_data['drawn'] сообщает, размечен ли кадр. frame_data['frame_idx'] и frame_data['pts']
+    (секунда видео) позволяют клиенту сопоставить метаданные с кадром воспроизводимого им файла.
+    При save_evidence для каждого нарушения сохраняется фрагмент видео вокруг него (evidence.EvidenceRecorder).
+    Если передан timings, после каждого этапа кадра вызывается timings.lap(этап): "decode" (ожидание
+    кадра), "inference" (при пакетном инференсе входит в "decode"), "postprocess", "crosswalk", "draw",
+    "output"; длительность записи пакета нарушений передается в timings.observe("db_flush", ...).
+    start_frame и end_frame ограничивают обработку файла диапазоном кадров [start_frame, end_frame);
+    индексы кадров (frame_idx, секунда нарушения) остаются абсолютными.
+    Если передан recorder, в него попадают frame_data каждого кадра и строки нарушений; запись
+    сохраняется в кэш, только если видео обработано до конца без ошибок.
+    Ошибка обработки записывается в лог и завершает генератор; при raise_errors она передается
+    вызывающему коду, чтобы оборванная обработка не выглядела как конец видео.
     """
+    results: Any = None
+    completed = False # Источник обработан до конца (без остановки и ошибок)
+    writer: Optional[ViolationWriter] = None
+    out: Optional[VideoOutput] = None # Фоновая запись обработанного видео
+    evidence: Optional[EvidenceRecorder] = None # Буфер последних кадров и запись фрагментов нарушений
     try:
         logging.info(f"Начало обработки видео: {input_video}")
+        detect_every = parse_detect_every(detect_every)
+        if inference is None:
+            # Трекер model.track сохраняется между вызовами (persist=True), поэтому сбрасывается здесь
+            reset_session_state()
         # --- Настройка источника видео ---
-        if input_video == 0: # Если источник - веб-камера
-            results = model.track(
-                source=input_video,
-                tracker="botsort.yaml", # Используемый трекер объектов
-                show=False, # Не отображать стандартные окна Ultralytics
-                verbose=False, # Уменьшить количество выводимой информации
-                stream=True # Потоковая обработка для веб-камеры
-            )
-            fps = 30 # Предполагаемый FPS для веб-камеры
-        else: # Если источник - видеофайл
-            results = model.track(
-                source=input_video,
-                tracker="botsort.yaml",
-                show=False,
-                verbose=False
-            )
-            fps = None
-            cap = cv2.VideoCapture(input_video)
-            if cap.isOpened():
-                fps = cap.get(cv2.CAP_PROP_FPS) # Получение FPS из видеофайла
-            cap.release()
+        if detect_every != 1: # Режим пропуска кадров
+            if inference is not None:
+                inference.open_stream(stream_id)
+                detect = lambda frame: parse_boxes(inference.track(stream_id, frame))
+                on_close = lambda: inference.close_stream(stream_id)
+            else:
+                detect, on_close = track_frame, None
+            results = SkippingStream(input_video, timed_detector(detect, timings), detect_every, on_close, start_frame)
+            fps = results.fps
+            if input_video == 0:
+                fps = 30 # Предполагаемый FPS для веб-камеры
+        elif inference is not None: # Пакетный инференс с трекером этого потока
+            results = BatchedStream(inference, stream_id, input_video, start_frame)
+            fps = results.fps
+            if input_video == 0:
+                fps = 30 # Предполагаемый FPS для веб-камеры
+        else: # Источник открывается один раз и декодируется с упреждением, трекинг - model.track по кадрам
+            results = FrameSource(input_video, start_frame=start_frame)
+            fps = results.fps # FPS из метаданных источника, без повторного открытия
+            if input_video == 0:
+                fps = 30 # Предполагаемый FPS для веб-камеры
         if not fps or fps <= 0: # Проверка и установка FPS по умолчанию, если не удалось определить
             logging.warning("FPS не определён или равен 0! Используется 30 FPS.")
             fps = 30
@@ -67,67 +188,84 @@ def process_video(
         # --- Инициализация состояния ---
         crosswalk_detected = False # Флаг, обнаружен ли пешеходный переход
         crosswalk_position = None # Координаты обнаруженного пешеходного перехода (x, y, w, h)
-        vehicle_states: Dict[int, Dict[str, bool]] = {} # Словарь для отслеживания состояния ТС (id: {crossed, crossed_on_red})
-        total_cross_count = 0 # Общее количество пересечений ТС пешеходного перехода
-        session = SessionLocal() # Сессия базы данных SQLAlchemy
-        frame_idx = 0 # Счетчик обработанных кадров
-        out = None # Объект VideoWriter для записи видео
-        output_path = None # Путь к сохраняемому обработанному видео
+        calibration_key = source_fingerprint(input_video) if crosswalk_cache.enabled else None # Ключ источника в кэше калибровки
+        crosswalk_retry = 1 # Интервал (кадров) до следующей попытки поиска перехода, растет после неудач
+        next_crosswalk_attempt = 0 # Кадр следующей попытки поиска перехода
+        track_states = TrackStateStore() # Состояния ТС, пересекших переход, и накопительные счетчики
+        writer = ViolationWriter(timings=timings).start() if save_violations else None # Фоновая пакетная запись нарушений в БД
+        frame_idx = start_frame # Индекс текущего кадра в источнике
+        output_path = None # Путь к сохраняемому обработанному видео (текущему сегменту)
+        if save_evidence and save_violations: # Фрагменты нужны только вместе с записями о нарушениях
+            os.makedirs('output', exist_ok=True)
+            if isinstance(input_video, int) and input_video == 0: # Для веб-камеры - по времени начала сессии
+                evidence_base = f"output/evidence_webcam_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            else:
+                evidence_base = f"output/evidence_{os.path.basename(str(input_video))}"
+            evidence = EvidenceRecorder(evidence_base, fps)
+
+        if isinstance(results, SkippingStream):
+            frames = iter(results) # Пары (кадр, детекции) с переносом рамок на пропущенных кадрах
+        elif isinstance(results, FrameSource):
+            detect_frame = timed_detector(track_frame, timings)
+            frames = ((frame, detect_frame(frame)) for frame in results) # Следующие кадры декодируются во время трекинга
+        else:
+            frames = ((result.orig_img, parse_boxes(result)) for result in results)
 
         # --- Основной цикл обработки кадров ---
-        for result in results: # Итерация по результатам детекции/трекинга от YOLO
+        for frame, detections in frames: # Итерация по кадрам и результатам детекции/трекинга
+            if timings is not None:
+                timings.lap("decode")
             if stop_event is not None and stop_event.is_set(): # Проверка сигнала остановки
                 logging.info("Получен сигнал остановки обработки видео.")
                 break
-            frame = result.orig_img # Получение оригинального кадра
+            if end_frame is not None and frame_idx >= end_frame: # Конец диапазона кадров
+                break
 
-            # Инициализация VideoWriter для сохранения видео, если это еще не сделано
+            # Инициализация фоновой записи видео, если это еще не сделано
             if out is None and save_output:
                 os.makedirs('output', exist_ok=True) # Создание директории output, если ее нет
                 if isinstance(input_video, int) and input_video == 0: # Для веб-камеры
                     ts = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
-                    output_path = f"output/processed_webcam_{ts}.avi"
+                    base_path = f"output/processed_webcam_{ts}"
                 else: # Для видеофайла
                     base = os.path.basename(str(input_video))
-                    output_path = f"output/processed_{base}.avi"
-                fourcc = cv2.VideoWriter_fourcc(*"MJPG") # Кодек для записи видео
-                out = cv2.VideoWriter(output_path, fourcc, fps, (frame.shape[1], frame.shape[0]))
-
-            # --- Разбор результатов детекции --- 
-            green_lights, red_lights, yellow_lights = [], [], [] # Списки для хранения рамок светофоров
-            vehicle_boxes, vehicles, traffic_lights = [], [], [] # Списки для хранения информации об ТС и светофорах
-
-            for box in result.boxes: # Итерация по обнаруженным объектам (bounding boxes)
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int) # Координаты рамки
-                cls = int(box.cls[0]) # ID класса объекта
-                track_id = int(box.id[0]) if box.id is not None else -1 # ID объекта от трекера
-                label = model.names[cls] # Метка класса (например, 'car', 'red_light')
-
-                # Фильтрация и сохранение транспортных средств
-                if label in ['bus', 'car', 'motorcycle', 'truck', 'van']:
-                    vehicle_boxes.append((x1, y1, x2 - x1, y2 - y1, label, track_id))
-                    vehicles.append({
-                        'id': track_id,
-                        'label': label,
-                        'bbox': [x1, y1, x2, y2]
-                    })
-                # Фильтрация и сохранение светофоров
-                if label in ['green_light', 'red_light', 'yellow_light']:
-                    traffic_lights.append({
-                        'label': label,
-                        'bbox': [x1, y1, x2, y2]
-                    })
-                    if label == 'green_light':
-                        green_lights.append((x1, y1, x2 - x1, y2 - y1))
-                    elif label == 'red_light':
-                        red_lights.append((x1, y1, x2 - x1, y2 - y1))
-                    elif label == 'yellow_light':
-                        yellow_lights.append((x1, y1, x2 - x1, y2 - y1))
+                    base_path = f"output/processed_{base}"
+                out = VideoOutput(base_path, fps) # Бэкенд, контейнер и сегментация задаются переменными окружения
+            if out is not None:
+                output_path = out.next_path() # Файл (сегмент), в который write запишет этот кадр
+
+            # --- Разбор результатов детекции (маски классов вместо сравнения строк) ---
+            xyxy, cls, ids = detections
+            boxes_xywh = np.column_stack((xyxy[:, :2], xyxy[:, 2:] - xyxy[:, :2])) # Рамки в формате (x, y, w, h)
+            vehicle_mask = np.isin(cls, VEHICLE_CLASS_IDS)
+            light_mask = np.isin(cls, LIGHT_CLASS_IDS)
+
+            # Транспортные средства
+            vehicle_xywh = boxes_xywh[vehicle_mask]
+            vehicle_ids = ids[vehicle_mask].tolist()
+            vehicle_labels = CLASS_NAMES[cls[vehicle_mask]].tolist()
+            vehicles = [ # Список ТС для frame_data
+                {'id': tid, 'label': label, 'bbox': bbox}
+                for tid, label, bbox in zip(vehicle_ids, vehicle_labels, xyxy[vehicle_mask].tolist())
+            ]
+            # Светофоры
+            traffic_lights = [ # Список светофоров для frame_data
+                {'label': label, 'bbox': bbox}
+                for label, bbox in zip(CLASS_NAMES[cls[light_mask]].tolist(), xyxy[light_mask].tolist())
+            ]
+            green_lights = boxes_xywh[cls == CLASS_IDS.get('green_light', -1)].tolist() # Рамки светофоров по цветам
+            red_lights = boxes_xywh[cls == CLASS_IDS.get('red_light', -1)].tolist()
+            yellow_lights = boxes_xywh[cls == CLASS_IDS.get('yellow_light', -1)].tolist()
             
             is_red = bool(red_lights) # Флаг, горит ли красный свет
+            if timings is not None:
+                timings.lap("postprocess")
 
             # --- Детекция пешеходного перехода (выполняется один раз или до успешного обнаружения) ---
-            if not crosswalk_detected:
+            if frame_idx == start_frame and calibration_key is not None: # Переход, найденный ранее для этого источника
+                crosswalk_position = crosswalk_cache.get(calibration_key, (frame.shape[1], frame.shape[0]))
+                crosswalk_detected = crosswalk_position is not None
+            if not crosswalk_detected and frame_idx >= next_crosswalk_attempt:
                 # Выбираем любой обнаруженный светофор как ориентир для поиска перехода
                 any_light = green_lights[0] if green_lights else (red_lights[0] if red_lights else (yellow_lights[0] if yellow_lights else None))
                 if any_light is not None:
@@ -135,6 +273,11 @@ def process_video(
                     crosswalk_position = detect_crosswalk(frame, (lx, ly, lw, lh))
                     if crosswalk_position is not None:
                         crosswalk_detected = True
+                        if calibration_key is not None:
+                            crosswalk_cache.put(calibration_key, crosswalk_position, (frame.shape[1], frame.shape[0]))
+                    else: # Повторные попытки все реже (например, на ночной съемке)
+                        next_crosswalk_attempt = frame_idx + crosswalk_retry
+                        crosswalk_retry = min(crosswalk_retry * 2, max(1, CROSSWALK_RETRY_MAX))
             
             crosswalk_bbox = None # Bbox перехода для отправки клиенту
             if crosswalk_position:
@@ -146,68 +289,52 @@ def process_video(
                 cx, cy, cw, ch = crosswalk_position
                 crosswalk_box = (cx, cy, cw, ch) # Рамка пешеходного перехода
 
-                for (vx, vy, vw, vh, vlabel, tid) in vehicle_boxes: # Итерация по ТС
-                    veh_box = (vx, vy, vw, vh) # Рамка ТС
-                    inter_area = intersection_area(veh_box, crosswalk_box) # Площадь пересечения ТС и перехода
-                    veh_area = vw * vh # Площадь ТС
-
-                    if veh_area > 0 and inter_area > 0: # Если есть пересечение
-                        if tid not in vehicle_states: # Инициализация состояния для нового ТС
-                            vehicle_states[tid] = {'crossed': False, 'crossed_on_red': False}
-                        
-                        if not vehicle_states[tid]['crossed']: # Если ТС еще не было отмечено как пересекшее
-                            vehicle_states[tid]['crossed'] = True
-                            total_cross_count += 1
-
-                            if is_red: # Если ТС пересекает на красный свет
-                                vehicle_states[tid]['crossed_on_red'] = True
-                                violation_time = None
-                                video_second = None
-
-                                # Определение времени/секунды нарушения
-                                if isinstance(input_video, int) and input_video == 0: # Для веб-камеры
-                                    violation_time = datetime.datetime.now()
-                                else: # Для видеофайла
-                                    if fps and fps > 0:
-                                        video_second = int((frame_idx + 1) / fps)
-                                        logging.info(f"Кадр={frame_idx}, секунда видео={video_second}")
-                                
-                                # Создание и сохранение записи о нарушении в БД
-                                violation = Violation(
-                                    vehicle_id=str(tid),
-                                    timestamp=violation_time,
-                                    video_second=video_second,
-                                    processed_video_path=output_path, # Путь к видео, где зафиксировано нарушение
-                                    original_video_path=str(input_video) if isinstance(input_video, str) else None # Путь к исходному видео
-                                )
-                                session.add(violation)
-                                session.commit()
-            
-            red_light_cross_count = sum(1 for v in vehicle_states.values() if v['crossed_on_red']) # Подсчет нарушений на красный
+                inter_areas = intersection_areas(vehicle_xywh, crosswalk_box) # Площади пересечения всех ТС с переходом
+                veh_areas = vehicle_xywh[:, 2] * vehicle_xywh[:, 3] # Площади ТС
 
-            # --- Отрисовка информации на кадре ---
-            if crosswalk_position: # Отрисовка рамки пешеходного перехода
-                cx, cy, cw, ch = crosswalk_position
-                draw_box(frame, (cx, cy, cw, ch), (255, 0, 0), "Crosswalk")
-            
-            # Отрисовка рамок светофоров
-            for (lx, ly, lw, lh) in green_lights:
-                draw_box(frame, (lx, ly, lw, lh), (0, 255, 0), "Green")
-            for (lx, ly, lw, lh) in red_lights:
-                draw_box(frame, (lx, ly, lw, lh), (0, 0, 255), "Red")
-            for (lx, ly, lw, lh) in yellow_lights:
-                draw_box(frame, (lx, ly, lw, lh), (0, 255, 255), "Yellow")
-            
-            # Отрисовка рамок ТС
-            for (vx, vy, vw, vh, vlabel, tid) in vehicle_boxes:
-                label = f"{vlabel} ID:{tid}" if tid != -1 else vlabel
-                draw_box(frame, (vx, vy, vw, vh), (255, 255, 0), label)
+                for i in np.flatnonzero((veh_areas > 0) & (inter_areas > 0)): # ТС, пересекающие переход
+                    tid = vehicle_ids[i]
+                    # Первое пересечение ТС учитывается в счетчиках; на красный - это нарушение
+                    if track_states.mark_crossed(tid, frame_idx, is_red) and is_red:
+                        violation_time = None
+                        video_second = None
+
+                        # Определение времени/секунды нарушения
+                        if isinstance(input_video, int) and input_video == 0: # Для веб-камеры
+                            violation_time = datetime.datetime.now()
+                        else: # Для видеофайла
+                            if fps and fps > 0:
+                                video_second = int((frame_idx + 1) / fps)
+                                logging.info(f"Кадр={frame_idx}, секунда видео={video_second}")
+                    
+                        # Фрагмент видео вокруг нарушения (файл дописывается в фоне)
+                        evidence_clip_path = evidence.trigger(frame_idx, f"f{frame_idx}_id{tid}") if evidence is not None else None
+
+                        violation = {
+                            'vehicle_id': str(tid),
+                            'timestamp': violation_time,
+                            'video_second': video_second,
+                            'processed_video_path': output_path, # Путь к видео, где зафиксировано нарушение
+                            'original_video_path': str(input_video) if isinstance(input_video, str) else None, # Путь к исходному видео
+                            'evidence_clip_path': evidence_clip_path, # Фрагмент видео с нарушением
+                            'vehicle_class': vehicle_labels[i] # Класс ТС по модели
+                        }
+                        # Постановка записи о нарушении в очередь фоновой записи в БД (без ожидания БД)
+                        if writer is not None:
+                            writer.add(violation)
+                        if recorder is not None:
+                            recorder.add_violation(violation)
             
-            # Отображение счетчиков на кадре
-            cv2.putText(frame, f"Crossed: {total_cross_count}", (30, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-            cv2.putText(frame, f"Red crossed: {red_light_cross_count}", (30, 70), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            # Треки, присутствующие на кадре, продлевают свои состояния; давно не появлявшиеся удаляются
+            track_states.touch(vehicle_ids, frame_idx)
+            track_states.evict(frame_idx)
+            total_cross_count = track_states.total_crossings # Общее число пересечений
+            red_light_cross_count = track_states.red_light_violations # Число нарушений на красный
+            if timings is not None:
+                timings.lap("crosswalk")
 
             # --- Подготовка данных для вывода/отправки ---
+            draw_frame = draw() if callable(draw) else draw
             frame_data = {
                 'vehicles': vehicles, # Список ТС с их параметрами
                 'traffic_lights': traffic_lights, # Список светофоров
@@ -216,12 +343,27 @@ def process_video(
                 'red_light_violations': red_light_cross_count, # Число нарушений на красный
                 'frame_width': frame.shape[1],
                 'frame_height': frame.shape[0],
-                'vehicle_states': vehicle_states, # Состояния ТС (кто пересек на красный)
-                'output_path': output_path # Путь к сохраненному видео (если сохраняется)
+                'vehicle_states': track_states.snapshot(), # Состояния недавних ТС (кто пересек на красный)
+                'output_path': output_path, # Путь к сохраненному видео (если сохраняется)
+                'frame_idx': frame_idx, # Индекс кадра в источнике
+                'pts': round(frame_idx / fps, 4), # Время кадра от начала видео (сек.)
+                'drawn': bool(draw_frame) # Рамки нарисованы на кадре сервером
             }
 
-            if out is not None: # Запись кадра в файл, если включено сохранение
+            # --- Отрисовка информации на кадре ---
+            if draw_frame:
+                draw_overlays(frame, frame_data)
+            if timings is not None:
+                timings.lap("draw")
+
+            if out is not None: # Постановка кадра в очередь записи, кодирование выполняется в фоновом потоке
                 out.write(frame)
+            if evidence is not None: # Кадр в буфер последних секунд и в записываемые фрагменты
+                evidence.add(frame, frame_idx)
+            if recorder is not None:
+                recorder.add_frame(frame_data)
+            if timings is not None:
+                timings.lap("output")
             
             # Возврат данных генератором
             if return_frame: # Если нужно вернуть и кадр
@@ -234,18 +376,66 @@ def process_video(
                 if cv2.waitKey(1) & 0xFF == ord("q"): # Выход по нажатию 'q'
                     break
             frame_idx += 1 # Инкремент счетчика кадров
+        else:
+            completed = True # Цикл не прерван: кадры источника закончились
         
         # --- Завершение обработки ---
-        if out is not None:
-            out.release() # Освобождение объекта VideoWriter
         if show_windows:
             cv2.destroyAllWindows() # Закрытие окон OpenCV
         logging.info(f"Обработка видео завершена: {input_video}")
-        session.close() # Закрытие сессии БД
     except Exception as e:
         logging.error(f"Ошибка при обработке видео: {e}")
         if show_windows: # Гарантированное закрытие окон при ошибке
             cv2.destroyAllWindows()
+        if raise_errors:
+            raise
+    finally:
+        if isinstance(results, (BatchedStream, SkippingStream, FrameSource)):
+            results.close() # Остановка декодирования, освобождение источника и трекера потока в сервисе
+        if writer is not None:
+            writer.close() # Запись оставшихся нарушений, в том числе после stop_event
+        if out is not None:
+            out.close() # Запись кадров из очереди и закрытие файла, в том числе после stop_event
+        if evidence is not None:
+            evidence.close() # Дописывание начатых фрагментов доступными кадрами
+        if recorder is not None: # Сохранение в кэш после записи видео; незавершенная обработка отбрасывается
+            recorder.finish(completed and (out is None or out.failed == 0))
+
+
+def replay_video(
+    input_video: str, # Путь к видеофайлу, результаты которого есть в кэше
+    key: str, # Ключ записи кэша результатов (result_cache)
+    return_frame: bool = False, # Флаг, указывающий, нужно ли возвращать сам кадр помимо данных
+    stop_event: Any = None, # Событие для прерывания воспроизведения извне
+    draw: Union[bool, Callable[[], bool]] = True, # Отрисовка рамок и счетчиков (функция - решение на каждом кадре)
+    timings: Any = None, # Замер этапов "decode" и "draw" (metrics.StageHistograms)
+    output_path: Optional[str] = None # Обработанное видео из кэша для frame_data['output_path']
+) -> Generator:
+    """
+    Воспроизводит результаты обработки файла из кэша в формате process_video: кадры
+    декодируются из исходного файла, frame_data берется из записи кэша, рамки рисуются по нему.
+    Модель не вызывается, нарушения в БД и видеофрагменты повторно не записываются.
+    """
+    source = FrameSource(input_video)
+    cached = result_cache.frames(key)
+    try:
+        logging.info(f"Результаты обработки {input_video} берутся из кэша: {key}")
+        for frame, frame_data in zip(source, cached):
+            if timings is not None:
+                timings.lap("decode")
+            if stop_event is not None and stop_event.is_set():
+                break
+            draw_frame = draw() if callable(draw) else draw
+            frame_data['output_path'] = output_path
+            frame_data['drawn'] = bool(draw_frame)
+            if draw_frame:
+                draw_overlays(frame, frame_data)
+            if timings is not None:
+                timings.lap("draw")
+            yield (frame_data, frame) if return_frame else frame_data
+    finally:
+        cached.close()
+        source.close()
 
 # Пример запуска обработки видео (для отладки или прямого вызова скрипта)
 if __name__ == "__main__":